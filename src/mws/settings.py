@@ -31,9 +31,12 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 ]
 
+# Use 'tenants.middlewares.AsyncTenantMiddleware' instead of
+# TenantMiddleware when serving async views with ASGI.
 MIDDLEWARE = [
-    'tenants.middlewares.TenantMiddleware',
     'mws_main.middleware.StatsMiddleware',
+    'tenants.middlewares.TenantMiddleware',
+    'mws_main.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -46,9 +49,83 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'mws.urls'
 
+# Cache shared by the processes of the platform. Without
+# MWS_CACHE_LOCATION, every process has its own memory cache.
+if os.environ.get("MWS_CACHE_LOCATION"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ["MWS_CACHE_LOCATION"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Channel of the default database where the changes of the data cached
+# by the processes are notified (see tenants.bus). Each process listens
+# to it with its own connection unless MWS_INVALIDATION_LISTENER is 0.
+INVALIDATION_CHANNEL = "mws_invalidation"
+INVALIDATION_LISTENER = os.environ.get("MWS_INVALIDATION_LISTENER", "1") == "1"
+
+# Seconds the theme of a store (see mws_main.theme) is kept in the
+# shared cache and in every process.
+STORE_THEME_TIMEOUT = 24 * 60 * 60
+STORE_THEME_LOCAL_TTL = 5
+
+# Seconds the statistics of the stores' dashboards (see mws_main.stats)
+# are cached, and seconds every process adds up the downloads before
+# writing them to the statistics.
+STORE_STATS_TIMEOUT = 60
+STORE_STATS_FLUSH_INTERVAL = 10
+
+# Fragments of the stores' pages cached (see mws_main.fragments) for
+# FRAGMENT_CACHE_TIMEOUT seconds. A request waits at most
+# FRAGMENT_LOCK_TIMEOUT seconds for another one rendering the same
+# fragment.
+FRAGMENT_CACHE = os.environ.get("MWS_FRAGMENT_CACHE", "1") == "1"
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+FRAGMENT_LOCK_TIMEOUT = 5
+
+# Number of Markdown texts whose HTML is kept by every process when it
+# isn't stored with them yet (see mws_main.markup).
+MARKDOWN_CACHE_SIZE = 1024
+
+# Directory where every process writes the metrics of its requests (see
+# mws_main.metrics), at most every METRICS_FLUSH_INTERVAL seconds, so the
+# metrics of all the processes are exported together. Without it, only
+# the metrics of the process that serves the export are exported.
+METRICS_DIR = os.environ.get("MWS_METRICS_DIR")
+METRICS_FLUSH_INTERVAL = 5
+
+# Send the time spent in each part of the requests in the Server-Timing
+# header, unless it's disabled for the tenant (Tenant.server_timing).
+SERVER_TIMING = os.environ.get("MWS_SERVER_TIMING", "1") == "1"
+
+# Query budgets of the views (see mws_main.query_inspection). A request over its
+# view's budget is logged, or fails if QUERY_BUDGET_STRICT is set, as in
+# the tests. With MWS_QUERY_INSPECTION=1, the queries run
+# QUERY_REPEAT_THRESHOLD times or more by a request are logged too.
+QUERY_BUDGET_STRICT = False
+QUERY_INSPECTION = os.environ.get("MWS_QUERY_INSPECTION", "0") == "1"
+QUERY_REPEAT_THRESHOLD = 5
+
+# Requests profiled (see mws_main.profiling): those of the tenants with
+# Tenant.profile_requests, those with a valid X-MWS-Profile header (see
+# the command profile_requests) and a PROFILE_SAMPLE_RATE fraction of
+# the others. Their stacks are sampled every PROFILE_INTERVAL seconds
+# and saved in PROFILES_DIR. Without it, no request is profiled.
+PROFILES_DIR = os.environ.get("MWS_PROFILES_DIR")
+PROFILE_SAMPLE_RATE = float(os.environ.get("MWS_PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL = 0.005
+PROFILE_TOKEN_MAX_AGE = 24 * 60 * 60
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'mws_main.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -93,8 +170,21 @@ with open(os.environ.get("MWS_PASSWD_FILE")) as f:
 DATABASE_ROUTERS = [
     'tenants.router.TenantSpecRouter',
     'tenants.router.GeneralMWSRouter',
+    'tenants.router.TenantSessionRouter',
 ]
 
+# The sessions of each tenant are stored apart (see tenants.sessions):
+# in its database ("tenants.sessions.db"), also in the cache
+# ("tenants.sessions.cached_db", which needs MWS_CACHE_LOCATION with
+# several processes) or in signed cookies
+# ("tenants.sessions.signed_cookies").
+SESSION_ENGINE = os.environ.get("MWS_SESSION_ENGINE", "tenants.sessions.db")
+
+# Move the sessions still stored in the default database to their
+# tenant when they are used. It can be disabled once SESSION_COOKIE_AGE
+# has passed since the sessions were moved to the tenants.
+TENANT_SESSIONS_FALLBACK = os.environ.get("MWS_TENANT_SESSIONS_FALLBACK", "1") == "1"
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
 
@@ -138,47 +228,105 @@ MEDIA_URL = "/media/"
 LOGIN_REDIRECT_URL = None
 LOGIN_URL = "/store/login"
 
-import psycopg
-import psycopg.sql as sql
+# UserTypeBackend loads the logged user with its type in one query.
+# ModelBackend keeps valid the sessions started before it was added.
+AUTHENTICATION_BACKENDS = [
+    "mws_main.backends.UserTypeBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
 
 # Path to database settings dir
 PATH_DB_SETTINGS = Path(BASE_DIR, "tenants/database_settings")
 
-conn = psycopg.connect(
-    host=DATABASES["default"]["HOST"],
-    port=DATABASES["default"]["PORT"],
-    user=DATABASES["default"]["USER"],
-    password=DATABASES["default"]["PASSWORD"],
-    dbname=DATABASES["default"]["NAME"],
-    autocommit=True
-)
-
-
-# Carefull with this. Hard-coded table of the model
-# where the tenant information is stored
-
-try:
-    with conn.cursor() as cur:
-        cur.execute("SELECT subdomain_prefix, db_name, db_user, db_password, db_port, db_host FROM tenants_tenant")
-    
-        for record in cur:
-            DATABASES[record[0]] = {
-                'ENGINE': 'django.db.backends.postgresql',
-                'NAME': record[1],
-                'USER': record[2],
-                'PASSWORD': record[3],
-                'PORT': record[4],
-                'HOST': record[5],
-                'CONN_MAX_AGE': 120,
-                'OPTIONS': {
-                    'client_encoding': 'UTF8',
-                    'isolation_level': IsolationLevel.SERIALIZABLE,
-                },
-            }
-
-except psycopg.errors.UndefinedTable:
-    pass
-finally:
-    conn.close()
+# The tenants' databases aren't listed in DATABASES. They are
+# registered the first time they are requested (see tenants.connections)
+# and at most TENANT_DATABASES_MAX of them are kept registered in each
+# process, evicting the least recently used ones.
+TENANT_DATABASES_MAX = int(os.environ.get("MWS_TENANT_DATABASES_MAX", 200))
+
+# Seconds a tenant's database settings lookup is cached.
+TENANT_LOOKUP_TTL = int(os.environ.get("MWS_TENANT_LOOKUP_TTL", 300))
+
+# Connection pools of the tenants' databases (see tenants.pools). Each
+# tenant has a pool of at most TENANT_POOL_MAX_SIZE connections, whose
+# idle connections are closed after TENANT_POOL_MAX_IDLE seconds. The
+# connections in use at the same time are limited per database host
+# and per process.
+TENANT_POOL_MAX_SIZE = int(os.environ.get("MWS_TENANT_POOL_MAX_SIZE", 4))
+TENANT_POOL_MAX_IDLE = float(os.environ.get("MWS_TENANT_POOL_MAX_IDLE", 60))
+TENANT_POOL_TIMEOUT = float(os.environ.get("MWS_TENANT_POOL_TIMEOUT", 10))
+TENANT_POOL_MAX_PER_HOST = int(os.environ.get("MWS_TENANT_POOL_MAX_PER_HOST", 20))
+TENANT_POOL_MAX_CONNECTIONS = int(os.environ.get("MWS_TENANT_POOL_MAX_CONNECTIONS", 40))
+
+# Where the tenants' data is stored: "database" creates a database per
+# tenant and "schema" a schema per tenant in the shared database
+# TENANT_SCHEMAS_ALIAS, whose connections are shared by all tenants.
+TENANT_STORAGE = os.environ.get("MWS_TENANT_STORAGE", "database")
+TENANT_SCHEMAS_ALIAS = "tenants"
+
+if TENANT_STORAGE == "schema":
+    DATABASES[TENANT_SCHEMAS_ALIAS] = {
+        **DATABASES["default"],
+        'ENGINE': 'tenants.backends.postgresql',
+        'NAME': os.environ.get("MWS_TENANT_SCHEMAS_DB_NAME",
+                               DATABASES["default"]["NAME"]),
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            **DATABASES["default"]["OPTIONS"],
+            'pool': {
+                'min_size': 0,
+                'max_size': TENANT_POOL_MAX_CONNECTIONS,
+                'max_idle': TENANT_POOL_MAX_IDLE,
+                'timeout': TENANT_POOL_TIMEOUT,
+            },
+        },
+    }
+
+# Reads of the tenants with a read replica (Tenant.replica_host) go to
+# it, unless its replication lag, checked every TENANT_REPLICA_LAG_CHECK
+# seconds, is greater than TENANT_REPLICA_MAX_LAG seconds. After a
+# request that writes, the client reads from the primary for
+# TENANT_REPLICA_PIN seconds, so it sees its own changes.
+TENANT_REPLICA_MAX_LAG = float(os.environ.get("MWS_TENANT_REPLICA_MAX_LAG", 5))
+TENANT_REPLICA_LAG_CHECK = 5
+TENANT_REPLICA_PIN = 10
+
+# How the database server of a new tenant is chosen among the active
+# DatabaseHost rows (see tenants.placement): "least-loaded" picks the
+# one with the fewest tenants for its weight, "round-robin" spreads the
+# registrations by weight and "explicit" uses the default database's
+# server unless a host is given. Without DatabaseHost rows, the tenants
+# are created in the default database's server.
+TENANT_PLACEMENT_POLICY = os.environ.get("MWS_TENANT_PLACEMENT_POLICY", "least-loaded")
 
 PERMISSIONS_FIXTURE = "permissions.json"
+
+# Migrated database, with the permissions loaded, from which the new
+# tenants' databases are cloned. It's built again when the migrations
+# change.
+TENANT_TEMPLATE_DB = os.environ.get("MWS_TENANT_TEMPLATE_DB", "mws_template_db")
+
+# Number of migrated databases kept unassigned in every database host by
+# the command fill_spare_databases, so registrations don't have to
+# create one.
+TENANT_SPARE_DATABASES = int(os.environ.get("MWS_TENANT_SPARE_DATABASES", 5))
+
+# Number of tenants migrated at the same time by the command
+# migrate_tenants.
+TENANT_MIGRATE_PROCESSES = int(os.environ.get("MWS_TENANT_MIGRATE_PROCESSES", 4))
+
+# Background jobs (see tenants.jobs) are run by the command run_workers.
+# A failed job is retried after JOBS_RETRY_DELAY seconds, doubled on
+# every attempt.
+JOBS_WORKER_PROCESSES = int(os.environ.get("MWS_JOBS_WORKER_PROCESSES", 2))
+JOBS_POLL_INTERVAL = 1
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 10
+# Seconds after which a running job that hasn't been updated is
+# considered abandoned. The workers update their running jobs every
+# JOBS_HEARTBEAT_INTERVAL seconds.
+JOBS_STALE_AFTER = 600
+JOBS_HEARTBEAT_INTERVAL = 60
+
+# Registrations are run as jobs. They have their own number of attempts.
+TENANT_REGISTRATION_MAX_ATTEMPTS = 5
@@ -4,3 +4,25 @@ from django.apps import AppConfig
 class MwsMainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mws_main'
+
+    def ready(self):
+        from django.contrib.auth import signals
+        from django.contrib.auth.models import User
+        from django.db.backends.signals import connection_created
+        from django.core.signals import request_finished
+        from django.db.models.signals import m2m_changed, post_delete, post_save
+        from mws_main import metrics, models, query_inspection, stats, user_types
+
+        signals.user_logged_in.connect(user_types.user_logged_in)
+        m2m_changed.connect(user_types.groups_changed, sender=User.groups.through)
+        connection_created.connect(metrics.install_query_wrapper)
+        connection_created.connect(query_inspection.install_shape_wrapper)
+
+        post_save.connect(stats.client_saved, sender=models.Client)
+        post_delete.connect(stats.client_deleted, sender=models.Client)
+        post_save.connect(stats.version_saved, sender=models.VersionEntry)
+        m2m_changed.connect(
+            stats.acquisitions_changed,
+            sender=models.Client.services_acq.through,
+        )
+        request_finished.connect(stats.flush_stats)
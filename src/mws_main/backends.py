@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+import mws_main.user_types as user_types
+
+UserModel = get_user_model()
+
+
+class UserTypeBackend(ModelBackend):
+    """
+    Authenticate against the users of the tenant, loading the logged
+    user together with its Client, Developer or TenantAdmin row, so
+    UserTypeMiddleware doesn't need another query to get it.
+    """
+
+    def get_user(self, user_id):
+
+        try:
+            user = UserModel._default_manager.select_related(
+                *[relation for _, relation in user_types.USER_TYPES]
+            ).get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,203 @@
+"""
+Cache of fragments of the stores' pages (see the template tag
+cache_fragment).
+
+The fragments are kept in the default cache under keys namespaced by
+the current tenant. Each key includes the version of the tenant and,
+for the fragments of a service, the version of the service. Changing
+the store increases its version, and changing a service increases the
+service's version, so the old fragments are no longer read and expire
+after ``FRAGMENT_CACHE_TIMEOUT`` seconds.
+
+The versions are increased by dropping them in every process (see
+tenants.bus), whose cache may not be shared, and a greater one is
+created when they're read again.
+
+When a fragment is missing, only one request renders it while the
+others wait for it, at most ``FRAGMENT_LOCK_TIMEOUT`` seconds, instead
+of all of them rendering it at the same time. The lock is an entry of
+the cache added with ``cache.add``, so it also works across the
+processes that share a file-based cache.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+import tenants.bus as bus
+from tenants.middlewares import get_current_db_name
+
+# Namespace of the fragments rendered without a tenant
+NO_TENANT = "_platform"
+
+# Seconds between the checks of a request waiting for a fragment
+WAIT_INTERVAL = 0.02
+
+# Versions older than this one are stale, because changes may have been
+# missed.
+_min_version = 0
+
+
+def new_version():
+    # If the version is evicted from the cache, the new one must be
+    # greater than the previous ones, or stale fragments would be read.
+    return time.time_ns() // 1000
+
+
+def current_tenant():
+    return get_current_db_name() or NO_TENANT
+
+
+def version_key(tenant, service=None):
+
+    if service is None:
+        return f"fragment-version:{tenant}"
+
+    return f"fragment-version:{tenant}:service:{service}"
+
+
+def get_versions(tenant, service=None):
+    """Return the versions of the tenant and, if given, of the service."""
+
+    keys = [version_key(tenant)]
+
+    if service is not None:
+        keys.append(version_key(tenant, service))
+
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        version = versions.get(key)
+
+        if version is None or version < _min_version:
+
+            if version is not None:
+                cache.delete(key)
+
+            cache.add(key, new_version(), timeout=None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+def drop_version(key):
+    """
+    Drop the version of a tenant or of one of its services.
+
+    :param key: ``<tenant>`` or ``<tenant>:<service pk>``.
+    """
+
+    tenant, _, service = key.partition(":")
+    cache.delete(version_key(tenant, service or None))
+
+
+def drop_all_versions():
+    global _min_version
+    _min_version = new_version()
+
+
+bus.subscribe("fragment", drop_version, drop_all_versions)
+
+
+def bump_version(tenant=None, service=None):
+    """
+    Discard the cached fragments of a tenant or, if given, only the
+    fragments of one of its services.
+
+    :param tenant: Subdomain of the tenant. The current one by default.
+    :param service: Primary key of the service.
+    """
+
+    key = tenant or current_tenant()
+
+    if service is not None:
+        key += f":{service}"
+
+    bus.publish("fragment", key)
+
+
+def invalidate_store(tenant=None):
+    bump_version(tenant)
+
+
+def invalidate_service(service, tenant=None):
+    bump_version(tenant, service)
+
+
+def fragment_key(name, service=None, vary_on=()):
+    """Return the key of a fragment of the current tenant."""
+
+    tenant = current_tenant()
+    versions = ":".join(str(version) for version in get_versions(tenant, service))
+    key = f"fragment:{tenant}:{name}:{versions}"
+
+    if service is not None:
+        key += f":{service}"
+
+    if vary_on:
+        # Keep the keys short and free of the characters some backends reject
+        vary = hashlib.md5(
+            ":".join(str(value) for value in vary_on).encode(),
+            usedforsecurity=False,
+        )
+        key += f":{vary.hexdigest()}"
+
+    return key
+
+
+def get_or_render(key, render):
+    """
+    Return the cached fragment of the key or render it, making the
+    other requests wait for it.
+
+    :param render: Function that returns the fragment.
+    """
+
+    fragment = cache.get(key)
+
+    if fragment is not None:
+        return fragment
+
+    lock_key = f"{key}:lock"
+    locked = cache.add(lock_key, 1, timeout=settings.FRAGMENT_LOCK_TIMEOUT)
+
+    if not locked:
+        deadline = time.monotonic() + settings.FRAGMENT_LOCK_TIMEOUT
+
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            fragment = cache.get(key)
+
+            if fragment is not None:
+                return fragment
+
+        # The request rendering it may have failed
+
+    try:
+        fragment = render()
+        cache.set(key, fragment, timeout=settings.FRAGMENT_CACHE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+    return fragment
+
+
+def cache_fragment(name, render, service=None, vary_on=()):
+    """
+    Return a fragment of the current tenant's store, rendering it if it
+    isn't cached.
+
+    :param name: Name of the fragment.
+    :param render: Function that returns the fragment.
+    :param service: Primary key of the service the fragment shows.
+    :param vary_on: Values the fragment depends on besides the store
+    and the service.
+    """
+
+    if not settings.FRAGMENT_CACHE:
+        return render()
+
+    return get_or_render(fragment_key(name, service, vary_on), render)
@@ -0,0 +1,77 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+import mws_main.profiling as profiling
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Merges the profiles of the requests in a file of collapsed "
+        "stacks, the input of flame graph tools such as flamegraph.pl or "
+        "speedscope."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tenant",
+            help="Only the profiles of this subdomain (_platform for the "
+            "platform's requests).",
+        )
+        parser.add_argument(
+            "--view",
+            help="Only the profiles of this view name, such as "
+            "mws_main:store_home.",
+        )
+        parser.add_argument(
+            "--since",
+            type=float,
+            metavar="HOURS",
+            help="Only the profiles saved in the last HOURS hours.",
+        )
+        parser.add_argument(
+            "--no-tenant-frame",
+            action="store_true",
+            help="Don't split the stacks by tenant.",
+        )
+        parser.add_argument(
+            "--no-view-frame",
+            action="store_true",
+            help="Don't split the stacks by view.",
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            help="File where the stacks are written. Standard output by default.",
+        )
+
+    def handle(self, *args, **options):
+
+        since = None
+
+        if options["since"] is not None:
+            since = time.time() - options["since"] * 60 * 60
+
+        profiles = list(profiling.find_profiles(
+            subdomain=options["tenant"],
+            view=options["view"],
+            since=since,
+        ))
+        stacks = profiling.merge_profiles(
+            profiles,
+            by_tenant=not options["no_tenant_frame"],
+            by_view=not options["no_view_frame"],
+        )
+
+        output = open(options["output"], "w") if options["output"] else sys.stdout
+
+        try:
+            for stack, count in sorted(stacks.items()):
+                output.write(f"{stack} {count}\n")
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        self.stderr.write(f"Merged {len(profiles)} profiles.")
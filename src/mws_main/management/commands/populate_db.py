@@ -11,6 +11,7 @@ from django.contrib.auth.hashers import make_password
 
 import tenants.models as tmodels
 import tenants.forms as tforms
+from tenants.middlewares import using_tenant
 import mws_main.models as mmodels
 import mws_main.forms as mforms
 
@@ -45,6 +46,13 @@ class Command(BaseCommand):
             metavar="N",
             help="Number of tenants to populate."
         )
+        parser.add_argument(
+            "--db-host",
+            help=(
+                "Name of the database host where the tenants are created. "
+                "Chosen by the placement policy if it isn't given."
+            ),
+        )
 
     def handle(self, *args, **options):
 
@@ -108,76 +116,80 @@ class Command(BaseCommand):
                 name=store_name.title(),
                 subdomain=subdomain,
                 email=ADMIN_EMAIL,
+                db_host=options["db_host"],
             )
 
-            # Generate developers
-            self.stdout.write("\tCreating developers...")
-            ndevs = get_number("developer")
-            developers = []
+            # The tenant's data is written to its database, or to its
+            # schema in schema mode.
+            with using_tenant(subdomain):
+                # Generate developers
+                self.stdout.write("\tCreating developers...")
+                ndevs = get_number("developer")
+                developers = []
         
-            for i_dev in range(ndevs):
-                self.stdout.write(f"\t\tCreating developer {i_dev}...")
-                user = generate_user()
+                for i_dev in range(ndevs):
+                    self.stdout.write(f"\t\tCreating developer {i_dev}...")
+                    user = generate_user()
                 
-                dev = mmodels.Developer.objects.create(
-                    first_name=user["first_name"],
-                    last_name=user["last_name"],
-                    username=user["username"],
-                    password=make_password(user["password1"]),
-                    email=user["email"]
-                )
-
-                developers.append(dev)
-
-            # Generate clients
-            self.stdout.write("\tCreating clients...")
-            nclients = get_number("client")
-
-            for i_client in range(nclients):
-                self.stdout.write(f"\t\tCreating client {i_client}...")
-                user = generate_user()
-
-                mmodels.Client.objects.create(
-                    first_name=user["first_name"],
-                    last_name=user["last_name"],
-                    username=user["username"],
-                    password=make_password(user["password1"]),
-                    email=user["email"]
-                )
+                    dev = mmodels.Developer.objects.create(
+                        first_name=user["first_name"],
+                        last_name=user["last_name"],
+                        username=user["username"],
+                        password=make_password(user["password1"]),
+                        email=user["email"]
+                    )
+
+                    developers.append(dev)
+
+                # Generate clients
+                self.stdout.write("\tCreating clients...")
+                nclients = get_number("client")
+
+                for i_client in range(nclients):
+                    self.stdout.write(f"\t\tCreating client {i_client}...")
+                    user = generate_user()
+
+                    mmodels.Client.objects.create(
+                        first_name=user["first_name"],
+                        last_name=user["last_name"],
+                        username=user["username"],
+                        password=make_password(user["password1"]),
+                        email=user["email"]
+                    )
                 
-            # Generate services
-            self.stdout.write("\tCreating services...")
-            nservices = get_number("service")
-            service_names = random.sample(SERVICE_NAMES, nservices)
+                # Generate services
+                self.stdout.write("\tCreating services...")
+                nservices = get_number("service")
+                service_names = random.sample(SERVICE_NAMES, nservices)
 
-            for i_service, service_name in enumerate(service_names):
+                for i_service, service_name in enumerate(service_names):
             
-                self.stdout.write(f"\t\tCreating service {i_service}: {service_name}...")
-                # Generate packages
-                npackages = get_number("package")
-                packages = random.sample(packages_paths, npackages)
+                    self.stdout.write(f"\t\tCreating service {i_service}: {service_name}...")
+                    # Generate packages
+                    npackages = get_number("package")
+                    packages = random.sample(packages_paths, npackages)
             
-                packages = [{
-                    "package": package,
-                    "descrp": lorem_ipsum.sentence()}
-                    for package in packages]
-
-                # Generate service info
-                brief_descrp = lorem_ipsum.sentence()
-                descrp = lorem_ipsum.paragraph()
+                    packages = [{
+                        "package": package,
+                        "descrp": lorem_ipsum.sentence()}
+                        for package in packages]
+
+                    # Generate service info
+                    brief_descrp = lorem_ipsum.sentence()
+                    descrp = lorem_ipsum.paragraph()
                 
-                # Randomly select the developers assigned to this service
-                nselected_devs = get_number("assigned_services")
-                selected_devs = random.sample(developers, min(ndevs, nselected_devs))
-
-                service = mmodels.create_service(
-                    service_name,
-                    brief_descrp,
-                    descrp,
-                    packages,
-                    None,
-                    selected_devs
-                )
+                    # Randomly select the developers assigned to this service
+                    nselected_devs = get_number("assigned_services")
+                    selected_devs = random.sample(developers, min(ndevs, nselected_devs))
+
+                    service = mmodels.create_service(
+                        service_name,
+                        brief_descrp,
+                        descrp,
+                        packages,
+                        None,
+                        selected_devs
+                    )
         self.stdout.write(
             self.style.SUCCESS(f"Successfully created {ntenants} tenants.")
         )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import mws_main.profiling as profiling
+import tenants.bus as bus
+import tenants.models as tmodels
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Enables or disables the profiling of every request of a store, or "
+        "prints the value of the X-MWS-Profile header that profiles a "
+        "request of the store."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("subdomain", help="Subdomain of the tenant.")
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument(
+            "--enable",
+            action="store_true",
+            help="Profile every request of the store.",
+        )
+        action.add_argument(
+            "--disable",
+            action="store_true",
+            help="Stop profiling every request of the store.",
+        )
+        action.add_argument(
+            "--token",
+            action="store_true",
+            help="Print the value of the X-MWS-Profile header.",
+        )
+
+    def handle(self, *args, **options):
+
+        subdomain = options["subdomain"]
+
+        if not tmodels.Tenant.objects.filter(subdomain_prefix=subdomain).exists():
+            raise CommandError(f"There isn't a tenant {subdomain}.")
+
+        if options["token"]:
+            self.stdout.write(profiling.make_token(subdomain))
+            return
+
+        tmodels.Tenant.objects.filter(subdomain_prefix=subdomain).update(
+            profile_requests=options["enable"],
+        )
+        # The tenant's data is cached by every process
+        bus.publish("tenant", subdomain)
+
+        state = "enabled" if options["enable"] else "disabled"
+        self.stdout.write(
+            self.style.SUCCESS(f"Profiling of {subdomain} {state}.")
+        )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import mws_main.stats as stats
+import tenants.models as tmodels
+from tenants.middlewares import using_tenant
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Counts again the statistics of the stores shown in their "
+        "dashboards, repairing the counters that have drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "subdomains",
+            nargs="*",
+            metavar="SUBDOMAIN",
+            help="Only the stores of these tenants. Every store by default.",
+        )
+
+    def handle(self, *args, **options):
+
+        tenants = tmodels.Tenant.objects.order_by("subdomain_prefix")
+        subdomains = list(tenants.values_list("subdomain_prefix", flat=True))
+
+        if options["subdomains"]:
+            missing = set(options["subdomains"]) - set(subdomains)
+
+            if missing:
+                raise CommandError(
+                    f"There are no tenants {', '.join(sorted(missing))}."
+                )
+
+            subdomains = [s for s in subdomains if s in options["subdomains"]]
+
+        # Write the downloads added up by this process first
+        stats.flush_stats(force=True)
+
+        for subdomain in subdomains:
+            with using_tenant(subdomain):
+                stats.rebuild_store_stats()
+
+            self.stdout.write(f"{subdomain}: rebuilt.")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt the statistics of {len(subdomains)} stores.")
+        )
@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+import mws_main.models as models
+import tenants.models as tmodels
+from tenants.middlewares import using_tenant
+
+# Models whose Markdown is rendered (see mws_main.markup)
+MARKDOWN_MODELS = (models.Service, models.Package, models.VersionEntry)
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Renders and stores the HTML of the Markdown descriptions saved "
+        "before it was stored with them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "subdomains",
+            nargs="*",
+            metavar="SUBDOMAIN",
+            help="Only the stores of these tenants. Every store by default.",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Render again every description, for instance after "
+            "changing the sanitization.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows rendered and updated at a time.",
+        )
+
+    def handle(self, *args, **options):
+
+        tenants = tmodels.Tenant.objects.order_by("subdomain_prefix")
+        subdomains = list(tenants.values_list("subdomain_prefix", flat=True))
+
+        if options["subdomains"]:
+            missing = set(options["subdomains"]) - set(subdomains)
+
+            if missing:
+                raise CommandError(
+                    f"There are no tenants {', '.join(sorted(missing))}."
+                )
+
+            subdomains = [s for s in subdomains if s in options["subdomains"]]
+
+        for subdomain in subdomains:
+            with using_tenant(subdomain):
+                rendered = sum(
+                    self.render_model(model, options["all"], options["batch_size"])
+                    for model in MARKDOWN_MODELS
+                )
+
+            self.stdout.write(f"{subdomain}: {rendered} descriptions rendered.")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rendered the descriptions of {len(subdomains)} stores.")
+        )
+
+    def render_model(self, model, render_all, batch_size):
+        """Render the Markdown fields of a model, in batches of rows."""
+
+        fields = list(model.markdown_fields)
+        html_fields = list(model.markdown_fields.values())
+        queryset = model.objects.only("pk", *fields, *html_fields).order_by("pk")
+
+        if not render_all:
+            pending = Q()
+
+            for field, html_field in model.markdown_fields.items():
+                pending |= Q(**{html_field: ""}) & ~Q(**{field: ""})
+
+            queryset = queryset.filter(pending)
+
+        rendered = 0
+        batch = []
+
+        for instance in queryset.iterator(chunk_size=batch_size):
+            instance.render_markdown()
+            batch.append(instance)
+
+            if len(batch) == batch_size:
+                model.objects.bulk_update(batch, html_fields)
+                rendered += len(batch)
+                batch = []
+
+        if batch:
+            model.objects.bulk_update(batch, html_fields)
+            rendered += len(batch)
+
+        return rendered
@@ -0,0 +1,235 @@
+"""
+Rendering of the Markdown of the descriptions of the stores.
+
+The descriptions are written by the stores' users, so the HTML rendered
+from them is sanitized: only the tags and attributes that Markdown
+produces are kept, and the links only to safe schemes. The rest of the
+tags are removed, keeping their text, except the content of script and
+style tags.
+
+The HTML is rendered when the descriptions are saved (see
+RenderedMarkdownMixin) and stored in a column of its own. The
+descriptions saved before are rendered when shown, and the result is
+kept in a per-process LRU cache, ``MARKDOWN_CACHE_SIZE`` renders long,
+keyed by the hash of the Markdown.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+import markdown
+from django.conf import settings
+
+from mws_main.timing import timed, MARKDOWN
+
+ALLOWED_TAGS = {
+    "a", "abbr", "blockquote", "br", "code", "dd", "del", "dl", "dt", "em",
+    "h1", "h2", "h3", "h4", "h5", "h6", "hr", "img", "li", "ol", "p",
+    "pre", "strong", "table", "tbody", "td", "th", "thead", "tr", "ul",
+}
+VOID_TAGS = {"br", "hr", "img"}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "abbr": {"title"},
+    "img": {"src", "alt", "title"},
+    "td": {"align"},
+    "th": {"align"},
+}
+URL_ATTRIBUTES = {"href", "src"}
+ALLOWED_SCHEMES = {"", "http", "https", "mailto"}
+# Tags whose content is removed with them
+DROPPED_CONTENT_TAGS = {"script", "style"}
+
+
+class Sanitizer(HTMLParser):
+    """HTML parser that writes again only the allowed HTML."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.output = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        text = tag
+
+        for name, value in attrs:
+
+            if name not in allowed or value is None:
+                continue
+
+            if name in URL_ATTRIBUTES and not is_safe_url(value):
+                continue
+
+            text += f' {name}="{escape(value)}"'
+
+        self.output.append(f"<{text}>")
+
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+
+        if self.dropping or tag not in self.open_tags:
+            return
+
+        # Close the tags left open inside this one
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.output.append(f"</{open_tag}>")
+
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(escape(data, quote=False))
+
+    def close(self):
+        super().close()
+
+        while self.open_tags:
+            self.output.append(f"</{self.open_tags.pop()}>")
+
+        return "".join(self.output)
+
+
+def is_safe_url(url):
+    # Browsers ignore the control characters and spaces of the schemes
+    url = "".join(char for char in url if char > " ")
+    return urlsplit(url).scheme.lower() in ALLOWED_SCHEMES
+
+
+def sanitize(html):
+    """Return the allowed HTML of `html`."""
+
+    sanitizer = Sanitizer()
+    sanitizer.feed(html)
+    return sanitizer.close()
+
+
+def render(text):
+    """Return the sanitized HTML of a Markdown text."""
+
+    with timed(MARKDOWN):
+        return sanitize(markdown.markdown(text))
+
+
+class RenderCache:
+    """LRU cache of rendered Markdown, keyed by the hash of the text."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.renders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text):
+
+        key = hashlib.sha256(text.encode()).digest()
+
+        with self._lock:
+            html = self.renders.get(key)
+
+            if html is not None:
+                self.renders.move_to_end(key)
+                return html
+
+        html = render(text)
+
+        with self._lock:
+            self.renders[key] = html
+
+            while len(self.renders) > self.maxsize:
+                self.renders.popitem(last=False)
+
+        return html
+
+    def clear(self):
+        with self._lock:
+            self.renders.clear()
+
+
+_cache = None
+
+
+def cached_render(text):
+    """Return the sanitized HTML of a Markdown text, rendered once."""
+
+    global _cache
+
+    if _cache is None:
+        _cache = RenderCache(settings.MARKDOWN_CACHE_SIZE)
+
+    return _cache.get(text)
+
+
+class RenderedMarkdownMixin:
+    """
+    Model mixin that keeps the HTML of its Markdown fields in sync.
+
+    :cvar markdown_fields: Name of each Markdown field and of the field
+    where its HTML is stored.
+    :type markdown_fields: dict
+    """
+
+    markdown_fields = {}
+
+    def render_markdown(self, fields=None):
+        """
+        Render the Markdown of the fields.
+
+        :return: Names of the fields of the HTML rendered.
+        """
+
+        rendered = []
+
+        for field, html_field in self.markdown_fields.items():
+
+            if fields is None or field in fields:
+                setattr(self, html_field, render(getattr(self, field)))
+                rendered.append(html_field)
+
+        return rendered
+
+    def save(self, *args, update_fields=None, **kwargs):
+
+        rendered = self.render_markdown(update_fields)
+
+        if update_fields is not None and rendered:
+            update_fields = list(update_fields) + rendered
+
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+    def get_markdown_html(self, field):
+        """
+        Return the HTML of a Markdown field, rendered when shown if it
+        was saved before the HTML was stored.
+        """
+
+        html = getattr(self, self.markdown_fields[field])
+        text = getattr(self, field)
+
+        if html or not text:
+            return html
+
+        return cached_render(text)
@@ -0,0 +1,361 @@
+"""
+Metrics of the requests served, exported in the Prometheus text format.
+
+Each process aggregates the metrics of its requests (see
+StatsMiddleware). Pre-fork servers run several processes, so, when
+``METRICS_DIR`` is set, every process writes its metrics to a file of
+that directory at most every ``METRICS_FLUSH_INTERVAL`` seconds, and
+the metrics exported are the sum of all the files. When they're
+exported, the files of the processes that have ended are added up in a
+single file, so the counters don't go back and the directory doesn't
+grow with every restarted process.
+
+The queries are measured by a wrapper installed in every database
+connection, which only records them while a request is being measured.
+"""
+
+import atexit
+import contextvars
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20)
+
+# [number of queries, seconds] of the request being measured
+REQUEST_QUERIES = contextvars.ContextVar("request_queries", default=None)
+
+
+class Counter:
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self.series[labels] = self.series.get(labels, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self.series.items()]
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram:
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Labels -> [count of each bucket and +Inf, sum]
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self.series.get(labels)
+
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(series)] for labels, series in self.series.items()]
+
+    @staticmethod
+    def merge(series, other):
+        return [a + b for a, b in zip(series, other)]
+
+    def samples(self, labels, series):
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + ("+Inf",), series):
+            cumulative += count
+            yield f"{self.name}_bucket", labels + (("le", str(bound)),), cumulative
+
+        yield f"{self.name}_sum", labels, series[-1]
+        yield f"{self.name}_count", labels, cumulative
+
+
+REQUESTS = Counter(
+    "mws_requests_total",
+    "Requests served.",
+    ("tenant", "view", "status"),
+)
+REQUEST_DURATION = Histogram(
+    "mws_request_duration_seconds",
+    "Time spent serving a request.",
+    ("tenant", "view"),
+    LATENCY_BUCKETS,
+)
+REQUEST_QUERY_COUNT = Histogram(
+    "mws_request_db_queries",
+    "Database queries run by a request.",
+    ("tenant", "view"),
+    QUERY_BUCKETS,
+)
+REQUEST_DB_DURATION = Histogram(
+    "mws_request_db_duration_seconds",
+    "Time spent by a request in the database.",
+    ("tenant", "view"),
+    LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "mws_response_size_bytes",
+    "Size of the response bodies, except streaming ones.",
+    ("tenant", "view"),
+    SIZE_BUCKETS,
+)
+
+METRICS = (REQUESTS, REQUEST_DURATION, REQUEST_QUERY_COUNT, REQUEST_DB_DURATION, RESPONSE_SIZE)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper that measures the request's queries."""
+
+    queries = REQUEST_QUERIES.get()
+
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - start
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Measure the queries of a new database connection."""
+
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_request(tenant, view, status, duration, queries, size):
+    """
+    Record a request served.
+
+    :param queries: Number of queries and seconds spent running them.
+    :type queries: list
+    :param size: Size of the response body or None if it's streamed.
+    """
+
+    labels = (tenant or "", view)
+    REQUESTS.inc(labels + (str(status),))
+    REQUEST_DURATION.observe(labels, duration)
+    REQUEST_QUERY_COUNT.observe(labels, queries[0])
+    REQUEST_DB_DURATION.observe(labels, queries[1])
+
+    if size is not None:
+        RESPONSE_SIZE.observe(labels, size)
+
+    flush()
+
+
+def snapshot():
+    """Return the metrics of this process."""
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+def merge(snapshots):
+    """Add up the metrics of several processes."""
+
+    merged = {metric.name: {} for metric in METRICS}
+
+    for metric in METRICS:
+        series = merged[metric.name]
+
+        for process_metrics in snapshots:
+            for labels, value in process_metrics.get(metric.name, ()):
+                labels = tuple(labels)
+
+                if labels in series:
+                    series[labels] = metric.merge(series[labels], value)
+                else:
+                    series[labels] = value
+
+    return merged
+
+
+_last_flush = 0
+_flush_lock = threading.Lock()
+
+
+# File of the metrics of the processes that have ended
+DEAD_PROCESSES_FILE = "dead.json"
+
+
+def metrics_file(pid=None):
+    return os.path.join(settings.METRICS_DIR, f"{pid or os.getpid()}.json")
+
+
+def write_metrics(path, process_metrics):
+    # Readers mustn't see a partially written file.
+    fd, tmp_path = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix=".tmp")
+
+    with os.fdopen(fd, "w") as f:
+        json.dump(process_metrics, f)
+
+    os.replace(tmp_path, path)
+
+
+def flush(force=False):
+    """
+    Write the metrics of this process to its file of METRICS_DIR, if
+    they haven't been written for METRICS_FLUSH_INTERVAL seconds.
+    """
+
+    global _last_flush
+
+    if not settings.METRICS_DIR:
+        return
+
+    now = time.monotonic()
+
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+
+    with _flush_lock:
+        _last_flush = now
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_metrics(metrics_file(), snapshot())
+
+
+atexit.register(flush, force=True)
+
+
+def is_alive(pid):
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def read_metrics(path):
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def merge_dead_processes():
+    """
+    Add up the files of the processes that have ended in
+    DEAD_PROCESSES_FILE and remove them.
+    """
+
+    dead = [
+        os.path.join(settings.METRICS_DIR, filename)
+        for filename in os.listdir(settings.METRICS_DIR)
+        if filename.endswith(".json")
+        and filename[:-len(".json")].isdigit()
+        and not is_alive(int(filename[:-len(".json")]))
+    ]
+
+    if not dead:
+        return
+
+    # Processes exporting the metrics at the same time mustn't add up
+    # the same files twice.
+    with open(os.path.join(settings.METRICS_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead_path = os.path.join(settings.METRICS_DIR, DEAD_PROCESSES_FILE)
+        snapshots = [
+            process_metrics
+            for process_metrics in map(read_metrics, [dead_path, *dead])
+            if process_metrics is not None
+        ]
+        merged = merge(snapshots)
+        write_metrics(dead_path, {
+            name: [[list(labels), value] for labels, value in series.items()]
+            for name, series in merged.items()
+        })
+
+        for path in dead:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """Return the metrics of every process."""
+
+    if not settings.METRICS_DIR:
+        return merge([snapshot()])
+
+    flush(force=True)
+    merge_dead_processes()
+    snapshots = []
+
+    for filename in os.listdir(settings.METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+
+        process_metrics = read_metrics(os.path.join(settings.METRICS_DIR, filename))
+
+        if process_metrics is not None:
+            snapshots.append(process_metrics)
+
+    return merge(snapshots)
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(collected):
+    """Return the metrics in the Prometheus text format."""
+
+    lines = []
+
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+        for labels, value in sorted(collected[metric.name].items()):
+            labels = tuple(zip(metric.labelnames, labels))
+
+            for name, sample_labels, sample in metric.samples(labels, value):
+                text = ",".join(f'{key}="{escape(val)}"' for key, val in sample_labels)
+                lines.append(f"{name}{{{text}}} {sample}")
+
+    return "\n".join(lines) + "\n"
@@ -1,12 +1,30 @@
+import threading
 import time
-
-from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
+from functools import partial
+
+from django.contrib import auth
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import SimpleLazyObject
+from django.conf import settings
+from tenants.connections import get_tenant_record
+from tenants.middlewares import get_current_db_name
+from tenants.utils import tenant_db_from_request
 import  mws_main.models as mmodels
+import mws_main.metrics as metrics
+import mws_main.profiling as profiling
+import mws_main.query_inspection as query_inspection
+import mws_main.timing as timing
+import mws_main.user_types as user_types
 
 class StatsMiddleware:
     """
     Calculate the time passed since the request is received
-    until a response is sent.
+    until a response is sent, and record the metrics of the request
+    (see mws_main.metrics). The queries are checked against the view's
+    budget (see mws_main.query_inspection).
+
+    It must be the first middleware, so the Server-Timing header (see
+    mws_main.timing) includes the tenant resolution.
     """
     
     def __init__(self, get_response):
@@ -14,14 +32,88 @@ class StatsMiddleware:
 
     def __call__(self, request):
 
-        start_time = time.time()        
-        response = self.get_response(request)
-        duration = time.time() - start_time
+        queries = [0, 0.0]
+        token = metrics.REQUEST_QUERIES.set(queries)
+        shapes = query_inspection.new_shapes()
+        shapes_token = query_inspection.REQUEST_SHAPES.set(shapes)
+        timings = timing.Timings() if settings.SERVER_TIMING else None
+        timings_token = timing.TIMINGS.set(timings)
+        start_time = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.TIMINGS.reset(timings_token)
+            query_inspection.REQUEST_SHAPES.reset(shapes_token)
+            metrics.REQUEST_QUERIES.reset(token)
+
+        duration = time.perf_counter() - start_time
         response["X-Page-Generation_duration-ms"] = int(duration * 1000)
+
+        # Unknown subdomains aren't labelled, so they can't add series.
+        tenant = tenant_db_from_request(request)
+        record = get_tenant_record(tenant)
+
+        if timings is not None and (record is None or record.get("server_timing", True)):
+            timings.add(timing.DB, queries[1])
+            timings.add(timing.TOTAL, duration)
+            response["Server-Timing"] = timings.header()
+
+        match = request.resolver_match
+        metrics.record_request(
+            tenant=tenant if record is not None else "",
+            view=match.view_name if match is not None else "",
+            status=response.status_code,
+            duration=duration,
+            queries=queries,
+            size=None if response.streaming else len(response.content),
+        )
+        query_inspection.check_request(request, queries[0], shapes)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Run some requests of the stores under the sampling profiler (see
+    mws_main.profiling). It must be after TenantMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        if not settings.PROFILES_DIR:
+            return self.get_response(request)
+
+        subdomain = get_current_db_name()
+        record = get_tenant_record(subdomain)
+
+        if not profiling.should_profile(request, subdomain, record):
+            return self.get_response(request)
+
+        sampler = profiling.Sampler(threading.get_ident(), settings.PROFILE_INTERVAL)
+        sampler.start()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+
+        match = request.resolver_match
+        profiling.save_profile(
+            subdomain if record is not None else None,
+            match.view_name if match is not None else None,
+            sampler.stacks,
+        )
         return response
 
 
 def is_usertype(user, user_model):
+    """
+    Check the user's groups. UserTypeMiddleware reads the type from the
+    session instead.
+    """
     return True if user.groups.filter(name=user_model.group_name).exists() else False
 
 def is_client(user):
@@ -37,6 +129,10 @@ def is_admin(user):
 class UserTypeMiddleware:
     """
     Check the type of the authenticated user.
+
+    The type is read from the session (see mws_main.user_types), so
+    `request.user` is replaced by a lazy Client, Developer or TenantAdmin
+    that is only loaded if the view uses it.
     """
 
     def __init__(self, get_response):
@@ -54,28 +150,47 @@ class UserTypeMiddleware:
             )
 
         request.is_client = request.is_developer = request.is_admin = False
-        
-        if request.user.is_authenticated:
-            request.is_client = is_client(request.user)
-
-            if not request.is_client:
-                request.is_developer = is_developer(request.user)
-
-                if not request.is_developer:
-                    request.is_admin = is_admin(request.user)
-
-                    if not request.is_admin:
-                        raise SuspiciousOperation(
-                            "A user who is not a client, developer or admin"
-                            "has logged."
-                        )
-                    else:
-                        request.user = request.user.tenantadmin
-                    
-                else:
-                    request.user = request.user.developer
-            else:
-                request.user = request.user.client
-        
+
+        with timing.timed(timing.USER_TYPE):
+            self.set_user_type(request)
+
         response = self.get_response(request)
         return response
+
+    def set_user_type(self, request):
+
+        if auth.SESSION_KEY not in request.session:
+            return
+
+        # The session's user may have been deactivated or deleted, or
+        # its password changed.
+        if not request.user.is_authenticated:
+            request.session.pop(user_types.SESSION_KEY, None)
+            return
+
+        # Sessions started before the type was stored, or whose user's
+        # groups have changed, resolve it again.
+        stored = (
+            user_types.get_stored_user_type(request.session)
+            or user_types.store_user_type(request.session, request.user)
+        )
+
+        user_model, relation = user_types.user_type_model(stored["type"])
+        request.is_client = user_model is mmodels.Client
+        request.is_developer = user_model is mmodels.Developer
+        request.is_admin = user_model is mmodels.TenantAdmin
+        request.user = SimpleLazyObject(
+            partial(get_typed_user, request.user, relation)
+        )
+
+
+def get_typed_user(user, relation):
+    """
+    Return the Client, Developer or TenantAdmin of the user. Without
+    mws_main.backends.UserTypeBackend, it's another query.
+    """
+
+    if not user.is_authenticated:
+        return user
+
+    return getattr(user, relation)
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:27
+
+from django.db import migrations, models
+
+
+def count_store_stats(apps, schema_editor):
+    from mws_main.stats import write_store_stats
+
+    write_store_stats(
+        apps.get_model("mws_main", "Client"),
+        apps.get_model("mws_main", "VersionEntry"),
+        apps.get_model("mws_main", "Service"),
+        apps.get_model("mws_main", "StoreStats"),
+        using=schema_editor.connection.alias,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mws_main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoreStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=7, unique=True)),
+                ('clients', models.BigIntegerField(default=0)),
+                ('acquisitions', models.BigIntegerField(default=0)),
+                ('updates', models.BigIntegerField(default=0)),
+                ('downloads', models.BigIntegerField(default=0)),
+                ('bandwidth', models.BigIntegerField(default=0, help_text='Bytes downloaded.')),
+            ],
+        ),
+        migrations.RunPython(count_store_stats, migrations.RunPython.noop),
+    ]
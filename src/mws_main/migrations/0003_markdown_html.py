@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:29
+
+import mws_main.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mws_main', '0002_storestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='descrp_html',
+            field=mws_main.models.MarkdownHTMLField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='descrp_html',
+            field=mws_main.models.MarkdownHTMLField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='versionentry',
+            name='changes_html',
+            field=mws_main.models.MarkdownHTMLField(blank=True, default='', editable=False),
+        ),
+    ]
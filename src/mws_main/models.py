@@ -2,14 +2,17 @@ import os
 import datetime
 
 from django.apps import apps
-from django.db import models
+from django.db import IntegrityError, models, router, transaction
 from django.core.validators import RegexValidator
 from django.conf import settings
 from django.utils import timezone
 from django.core.files.storage import default_storage
 import django.contrib.auth.models as auth_models
 
+import mws_main.fragments as fragments
 import mws_main.utils as utils
+from mws_main.markup import RenderedMarkdownMixin
+import tenants.jobs as jobs
 from tenants.middlewares import get_current_db_name
 
 
@@ -25,14 +28,30 @@ class DescriptionField(models.TextField):
     help_text = "1000 characters max. Markdown markup available",
 
 
-class VersionEntry(models.Model):
+class MarkdownHTMLField(models.TextField):
+    """
+    Sanitized HTML rendered from a Markdown field when it's saved (see
+    mws_main.markup).
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("editable", False)
+        kwargs.setdefault("blank", True)
+        kwargs.setdefault("default", "")
+        super().__init__(*args, **kwargs)
+
+
+class VersionEntry(RenderedMarkdownMixin, models.Model):
     """
     Store the a version change of a package.
     """
 
+    markdown_fields = {"changes": "changes_html"}
+
     version = models.CharField(max_length=25)
     update_date = models.DateField(auto_now_add=True)
     changes = DescriptionField("changes description")
+    changes_html = MarkdownHTMLField()
     package = models.ForeignKey("Package", on_delete=models.CASCADE)
 
 
@@ -46,11 +65,13 @@ def image_dir_path(instance, filename):
     return f"{get_current_db_name()}/{instance.name}/image/{filename}"
 
 
-class Package(models.Model):
+class Package(RenderedMarkdownMixin, models.Model):
     """
     Represent a package file that can be downloaded and used.
     """
-    
+
+    markdown_fields = {"descrp": "descrp_html"}
+
     name = models.CharField(
         "package name",
         max_length=60,
@@ -84,6 +105,7 @@ class Package(models.Model):
         "related to the service, use the description field of the service.",
         default="",
     )
+    descrp_html = MarkdownHTMLField()
     service = models.ForeignKey("Service", on_delete=models.CASCADE)
 
     def __str__(self):
@@ -112,6 +134,8 @@ class Package(models.Model):
                 package=self,
             )
 
+        # Parsed within the request, unlike the icon, because it checks
+        # the upload and gives the version that the page shows next.
         parsed_package = utils.ParsedPackage(package_file)
 
         VersionEntry.objects.create(
@@ -126,13 +150,15 @@ class Package(models.Model):
         self.os_name = parsed_dict["os_name"]
         self.last_version = parsed_dict["last_version"]
         self.save()
+        # Notifies every process (see mws_main.fragments)
+        fragments.invalidate_service(self.service_id)
 
 
 class PackageNotFoundError(Exception):
     pass
 
         
-class Service(models.Model):
+class Service(RenderedMarkdownMixin, models.Model):
     """
     Represent a software component that offer grouped functionalities.
 
@@ -140,6 +166,8 @@ class Service(models.Model):
     so it may contain multiple packages.
     """
 
+    markdown_fields = {"descrp": "descrp_html"}
+
     name = models.CharField(
         "service name",
         max_length=25,
@@ -157,6 +185,7 @@ class Service(models.Model):
         blank=False,
         help_text="General description of the service. Markdown markup available.",
     )
+    descrp_html = MarkdownHTMLField()
 
     icon = models.ImageField(
         upload_to=image_dir_path,
@@ -192,6 +221,8 @@ class Service(models.Model):
         :type is_client: boolean
         """
 
+        # Two single-row writes, cheaper than the job that would defer
+        # them. The download statistics are batched (see stats.add_later).
         if is_client:
 
             self.n_downloads = models.F("n_downloads") + 1
@@ -202,26 +233,9 @@ class Service(models.Model):
             self.save(update_fields=["n_downloads"])
 
 
-def get_nupdates():
-    """
-    Return the number of packages updates that has been made in a store.
-    """
-    return VersionEntry.objects.all().count()
-
-
-def get_monthly_nupdates():
-    """
-    Return the number of packages updates that has been made in the
-    current month.
-    """
-    
-    return VersionEntry.objects.filter(update_date__month=timezone.now().month).count()
-    
-
 def create_service(name, brief_descrp, descrp, packages, creator, developers):
 
     packages_objs = []
-    icon = None
 
     service = Service.objects.create(
         name=name,
@@ -231,6 +245,8 @@ def create_service(name, brief_descrp, descrp, packages, creator, developers):
 
     for package in packages:
 
+        # The package rows are filled from the parsed files before the
+        # service's page is shown, so only the icon is left to a job.
         parsed_package = utils.ParsedPackage(package["package"])
 
         Package.objects.create(
@@ -244,11 +260,8 @@ def create_service(name, brief_descrp, descrp, packages, creator, developers):
             service=service,
         )
 
-        if not icon:
-            icon = parsed_package.get_icon()
-
-    service.icon = icon
-    service.save(update_fields=["icon"])
+    # Reading the icon from the package is left to a background job.
+    jobs.enqueue("mws_main.extract_service_icon", args=[service.pk])
 
     if creator:
         creator.assigned_services.add(service)
@@ -256,6 +269,9 @@ def create_service(name, brief_descrp, descrp, packages, creator, developers):
     for developer in developers:
         developer.assigned_services.add(service)
 
+    # A service with the same primary key may have been deleted
+    fragments.invalidate_service(service.pk)
+
     return service
 
 
@@ -404,3 +420,86 @@ class Metadata(models.Model):
     def downloaded_package(self, size):
         self.download_bandwidth[self.__class__.date_key()] += size
         self.save(update_fields=["download_bandwidth"])
+
+
+class StoreStats(models.Model):
+    """
+    Counters of the activity of a store, kept up to date as it happens
+    (see mws_main.stats), so the dashboards don't count the tables.
+
+    The row of the period TOTAL holds the totals, and the row of each
+    month, whose period is ``YYYY-MM``, the counters of that month.
+    Acquisitions, downloads and bandwidth can't be rebuilt by month.
+    """
+
+    TOTAL = "total"
+    COUNTERS = ("clients", "acquisitions", "updates", "downloads", "bandwidth")
+
+    period = models.CharField(max_length=7, unique=True)
+    clients = models.BigIntegerField(default=0)
+    acquisitions = models.BigIntegerField(default=0)
+    updates = models.BigIntegerField(default=0)
+    downloads = models.BigIntegerField(default=0)
+    bandwidth = models.BigIntegerField(default=0, help_text="Bytes downloaded.")
+
+    def __str__(self):
+        return self.period
+
+    @staticmethod
+    def month_period(date=None):
+        """Return the period of the month of a date, today by default."""
+        return (date or timezone.localdate()).strftime("%Y-%m")
+
+    @classmethod
+    def add(cls, date=None, **deltas):
+        """
+        Add to the counters of the totals and of the month of `date`.
+
+        If the store's counters haven't been counted yet, they're
+        counted instead, with the change that's being added.
+
+        :param deltas: Amount added to each counter.
+        """
+
+        if not cls.objects.filter(period=cls.TOTAL).exists():
+            from mws_main.stats import rebuild_store_stats
+            rebuild_store_stats()
+            return
+
+        for period in (cls.TOTAL, cls.month_period(date)):
+            updates = {counter: models.F(counter) + delta for counter, delta in deltas.items()}
+
+            if cls.objects.filter(period=period).update(**updates):
+                continue
+
+            try:
+                with transaction.atomic(using=router.db_for_write(cls)):
+                    cls.objects.create(period=period, **deltas)
+            except IntegrityError:
+                # Created by a concurrent transaction
+                cls.objects.filter(period=period).update(**updates)
+
+
+def get_nupdates():
+    """
+    Return the number of packages updates that has been made in a store.
+    """
+    return (
+        StoreStats.objects
+        .filter(period=StoreStats.TOTAL)
+        .values_list("updates", flat=True)
+        .first()
+    ) or 0
+
+
+def get_monthly_nupdates():
+    """
+    Return the number of packages updates that has been made in the
+    current month.
+    """
+    return (
+        StoreStats.objects
+        .filter(period=StoreStats.month_period())
+        .values_list("updates", flat=True)
+        .first()
+    ) or 0
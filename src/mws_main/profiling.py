@@ -0,0 +1,182 @@
+"""
+Sampling profiler of the requests of the stores (see ProfilingMiddleware).
+
+A request is profiled when its tenant has ``Tenant.profile_requests``
+set, when it has a valid ``X-MWS-Profile`` header (see `make_token`) or,
+otherwise, with probability ``PROFILE_SAMPLE_RATE``. While it's served,
+a thread takes the stack of the thread serving it every
+``PROFILE_INTERVAL`` seconds.
+
+The stacks are saved in the collapsed format, one ``frame;frame;... count``
+line per stack, in ``PROFILES_DIR/<tenant>/<view>/``. The command
+merge_profiles adds them up in a file ready for flame graph tools.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+PROFILE_HEADER = "HTTP_X_MWS_PROFILE"
+TOKEN_SALT = "mws_main.profiling"
+
+# Directory names of the requests without tenant or view
+NO_TENANT = "_platform"
+NO_VIEW = "_unresolved"
+
+
+def make_token(subdomain):
+    """Return the value of the profiling header for the tenant's store."""
+    return signing.dumps(subdomain, salt=TOKEN_SALT)
+
+
+def is_valid_token(token, subdomain):
+
+    try:
+        return signing.loads(
+            token,
+            salt=TOKEN_SALT,
+            max_age=settings.PROFILE_TOKEN_MAX_AGE,
+        ) == subdomain
+    except signing.BadSignature:
+        return False
+
+
+def should_profile(request, subdomain, record):
+    """
+    Return whether a request is profiled.
+
+    :param record: Cached data of the request's tenant or None if it
+    isn't for a tenant.
+    :type record: dict or None
+    """
+
+    if record is not None and record.get("profile_requests"):
+        return True
+
+    token = request.META.get(PROFILE_HEADER)
+
+    if token and is_valid_token(token, subdomain):
+        return True
+
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+def collapse(frame):
+    """Return the stack of a frame in the collapsed format, root first."""
+
+    names = []
+
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    """Thread that takes the stack of other thread at regular intervals."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="mws-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def save_profile(subdomain, view, stacks):
+    """Save the stacks sampled in a request of a tenant's view."""
+
+    if not stacks:
+        return
+
+    directory = os.path.join(
+        settings.PROFILES_DIR,
+        subdomain or NO_TENANT,
+        view or NO_VIEW,
+    )
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{time.time_ns()}-{os.getpid()}.folded")
+
+    with open(path, "w") as f:
+        for stack, count in stacks.items():
+            f.write(f"{stack} {count}\n")
+
+
+def find_profiles(subdomain=None, view=None, since=None):
+    """
+    Yield the tenant, view and path of the saved profiles.
+
+    :param since: Only the profiles saved from this timestamp.
+    :type since: float
+    """
+
+    if not os.path.isdir(settings.PROFILES_DIR):
+        return
+
+    for tenant_dir in sorted(os.listdir(settings.PROFILES_DIR)):
+
+        if subdomain is not None and tenant_dir != subdomain:
+            continue
+
+        tenant_path = os.path.join(settings.PROFILES_DIR, tenant_dir)
+
+        for view_dir in sorted(os.listdir(tenant_path)):
+
+            if view is not None and view_dir != view:
+                continue
+
+            view_path = os.path.join(tenant_path, view_dir)
+
+            for filename in sorted(os.listdir(view_path)):
+                path = os.path.join(view_path, filename)
+
+                if since is None or os.path.getmtime(path) >= since:
+                    yield tenant_dir, view_dir, path
+
+
+def merge_profiles(profiles, by_tenant=True, by_view=True):
+    """
+    Add up the stacks of several profiles.
+
+    :param profiles: Tenant, view and path of each profile.
+    :param by_tenant: Put the stacks under a frame of their tenant.
+    :param by_view: Put the stacks under a frame of their view.
+    :rtype: collections.Counter
+    """
+
+    merged = Counter()
+
+    for subdomain, view, path in profiles:
+        prefix = [subdomain] if by_tenant else []
+        prefix += [view] if by_view else []
+
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                merged[";".join(prefix + [stack])] += int(count)
+
+    return merged
@@ -0,0 +1,140 @@
+"""
+Inspection of the queries run by each request.
+
+Views declare the maximum number of queries they may run with a
+`query_budget` attribute, or the `query_budget` decorator for function
+views. A request that runs more queries than its view's budget raises
+QueryBudgetExceeded if ``QUERY_BUDGET_STRICT`` is set, as in the tests,
+or is logged otherwise.
+
+With ``QUERY_INSPECTION``, the SQL of every query of a request is also
+reduced to its shape (the SQL without the parameters' values), and the
+shapes repeated at least ``QUERY_REPEAT_THRESHOLD`` times, a sign of a
+query run for every row of another one (N+1), are logged.
+"""
+
+import contextvars
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Shape -> times run, of the request being inspected
+REQUEST_SHAPES = contextvars.ContextVar("request_shapes", default=None)
+
+_PLACEHOLDERS = re.compile(r"%s(?:\s*,\s*%s)+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """A request has run more queries than its view's budget."""
+    pass
+
+
+def query_budget(budget):
+    """Declare the query budget of a function view."""
+
+    def decorator(view):
+        view.query_budget = budget
+        return view
+
+    return decorator
+
+
+def get_query_budget(match):
+    """
+    Return the query budget of the view of a resolved URL.
+
+    :type match: django.urls.ResolverMatch
+    :return: The budget or None if the view doesn't declare one.
+    """
+
+    if match is None:
+        return None
+
+    view_class = getattr(match.func, "view_class", None)
+    return getattr(view_class or match.func, "query_budget", None)
+
+
+def query_shape(sql):
+    """
+    Return the SQL of a query without the values that change between
+    executions, so the queries that only differ in them are the same.
+    """
+
+    sql = _PLACEHOLDERS.sub("%s", sql)
+    sql = _LITERALS.sub("?", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def record_shape(execute, sql, params, many, context):
+    """Database execute wrapper that counts the shapes of the queries."""
+
+    shapes = REQUEST_SHAPES.get()
+
+    if shapes is not None:
+        shapes[query_shape(sql)] += 1
+
+    return execute(sql, params, many, context)
+
+
+def install_shape_wrapper(sender, connection, **kwargs):
+    """Count the shapes of the queries of a new database connection."""
+
+    if record_shape not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_shape)
+
+
+def new_shapes():
+    """Return the shapes counter of a new request, if they're inspected."""
+    return Counter() if settings.QUERY_INSPECTION else None
+
+
+def repeated_shapes(shapes):
+    """Return the shapes run at least QUERY_REPEAT_THRESHOLD times."""
+
+    return {
+        shape: count
+        for shape, count in shapes.most_common()
+        if count >= settings.QUERY_REPEAT_THRESHOLD
+    }
+
+
+def check_request(request, n_queries, shapes=None):
+    """
+    Check the queries run by a request against its view's budget.
+
+    :param n_queries: Number of queries run.
+    :param shapes: Shapes of the queries run, if they were inspected.
+    :type shapes: collections.Counter or None
+    :raises QueryBudgetExceeded: if the budget is exceeded and
+    QUERY_BUDGET_STRICT is set.
+    """
+
+    match = request.resolver_match
+    view = match.view_name if match is not None else request.path
+    repeated = repeated_shapes(shapes) if shapes else {}
+
+    for shape, count in repeated.items():
+        logger.warning(f"{view} ran {count} times: {shape}")
+
+    budget = get_query_budget(match)
+
+    if budget is None or n_queries <= budget:
+        return
+
+    message = f"{view} ran {n_queries} queries, over its budget of {budget}."
+
+    if repeated:
+        message += " Repeated queries: " + "; ".join(
+            f"{count} x {shape}" for shape, count in repeated.items()
+        )
+
+    if settings.QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+
+    logger.warning(message)
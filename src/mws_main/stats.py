@@ -0,0 +1,240 @@
+"""
+Statistics of a store shown in its dashboards.
+
+The statistics are the counters of the StoreStats table, updated when
+clients register, services are acquired, packages are updated or
+downloaded. The downloads are frequent, so their counters are added up
+in each process and written every ``STORE_STATS_FLUSH_INTERVAL``
+seconds. The counters that drift, for instance because of lost
+downloads, are rebuilt from the tables with the command rebuild_stats.
+
+The statistics are cached for ``STORE_STATS_TIMEOUT`` seconds per
+tenant.
+"""
+
+import atexit
+import datetime
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, router
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+import mws_main.models as models
+from tenants.middlewares import get_current_db_name, using_tenant
+
+logger = logging.getLogger(__name__)
+
+StoreStats = models.StoreStats
+
+
+def stats_key(subdomain):
+    return f"store-stats:{subdomain}"
+
+
+def read_store_stats():
+    """
+    Read the statistics of the current tenant's store.
+
+    The counters are rebuilt if they don't exist yet.
+
+    :rtype: dict
+    """
+
+    month = StoreStats.month_period()
+    rows = {
+        row.period: row
+        for row in StoreStats.objects.filter(period__in=[StoreStats.TOTAL, month])
+    }
+
+    if StoreStats.TOTAL not in rows:
+        rebuild_store_stats()
+        return read_store_stats()
+
+    total = rows[StoreStats.TOTAL]
+    monthly = rows.get(month, StoreStats(period=month))
+
+    return {
+        "reg_clients": total.clients,
+        "monthly_reg_clients": monthly.clients,
+        "acquisitions": total.acquisitions,
+        "updates": total.updates,
+        "monthly_updates": monthly.updates,
+        "downloads": total.downloads,
+        "bandwidth": total.bandwidth,
+    }
+
+
+def get_store_stats(subdomain):
+    """Return the cached statistics of a store."""
+
+    stats = cache.get(stats_key(subdomain))
+
+    if stats is None:
+        stats = read_store_stats()
+        cache.set(stats_key(subdomain), stats, timeout=settings.STORE_STATS_TIMEOUT)
+
+    return stats
+
+
+def count_by_month(queryset, field):
+    """Return the number of rows of each month of a date field."""
+
+    return {
+        row["month"].strftime("%Y-%m"): row["n"]
+        for row in queryset
+        .annotate(month=TruncMonth(field))
+        .values("month")
+        .annotate(n=Count("pk"))
+        .order_by()
+    }
+
+
+def write_store_stats(Client, VersionEntry, Service, StoreStats, using):
+    """
+    Count the counters of a store that can be counted from its tables
+    and write them.
+
+    The models are given so the migration that creates StoreStats can
+    fill it with its historical models.
+
+    :param using: Alias of the store's database.
+    """
+
+    clients = count_by_month(Client.objects.using(using), "date_joined")
+    updates = count_by_month(VersionEntry.objects.using(using), "update_date")
+    total = {
+        "clients": sum(clients.values()),
+        "updates": sum(updates.values()),
+        "acquisitions": Client.services_acq.through.objects.using(using).count(),
+        "downloads": (
+            Service.objects.using(using).aggregate(n=Sum("n_downloads"))["n"] or 0
+        ),
+    }
+    stats = StoreStats.objects.using(using)
+    # The historical models don't have the constants
+    TOTAL = models.StoreStats.TOTAL
+
+    with transaction.atomic(using=using):
+        stats.update_or_create(period=TOTAL, defaults=total)
+        stats.exclude(period=TOTAL).update(clients=0, updates=0)
+
+        for period in clients.keys() | updates.keys():
+            stats.update_or_create(
+                period=period,
+                defaults={
+                    "clients": clients.get(period, 0),
+                    "updates": updates.get(period, 0),
+                },
+            )
+
+
+def rebuild_store_stats():
+    """
+    Count again the counters of the current tenant's store that can be
+    counted from its tables.
+
+    The bandwidth and the monthly acquisitions and downloads aren't
+    stored anywhere else, so they're kept.
+    """
+
+    write_store_stats(
+        models.Client,
+        models.VersionEntry,
+        models.Service,
+        StoreStats,
+        using=router.db_for_write(StoreStats),
+    )
+    cache.delete(stats_key(get_current_db_name()))
+
+
+# Subdomain -> period -> counter deltas not written yet
+_pending = defaultdict(lambda: defaultdict(Counter))
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def add_later(**deltas):
+    """
+    Add to the counters of the current tenant's store in the next
+    flush of this process.
+    """
+
+    subdomain = get_current_db_name()
+    period = StoreStats.month_period()
+
+    with _pending_lock:
+        _pending[subdomain][period].update(deltas)
+
+
+def flush_stats(force=False, **kwargs):
+    """
+    Write the counters added up by this process, if they haven't been
+    written for STORE_STATS_FLUSH_INTERVAL seconds.
+    """
+
+    global _last_flush
+
+    if not force and time.monotonic() - _last_flush < settings.STORE_STATS_FLUSH_INTERVAL:
+        return
+
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+
+    for subdomain, periods in pending.items():
+        for period, deltas in periods.items():
+
+            try:
+                with using_tenant(subdomain), transaction.atomic(using=router.db_for_write(StoreStats)):
+                    StoreStats.add(date=period_date(period), **deltas)
+            except Exception:
+                # The command rebuild_stats repairs the counters
+                logger.exception(f"Couldn't update the statistics of {subdomain}")
+
+
+def period_date(period):
+    year, month = period.split("-")
+    return datetime.date(int(year), int(month), 1)
+
+
+atexit.register(flush_stats, force=True)
+
+
+def client_saved(sender, instance, created, raw=False, **kwargs):
+
+    if created and not raw:
+        StoreStats.add(date=timezone.localdate(instance.date_joined), clients=1)
+
+
+def client_deleted(sender, instance, **kwargs):
+    StoreStats.add(date=timezone.localdate(instance.date_joined), clients=-1)
+
+
+def version_saved(sender, instance, created, raw=False, **kwargs):
+
+    if created and not raw:
+        StoreStats.add(date=instance.update_date, updates=1)
+
+
+def acquisitions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+
+    if action == "post_add" and pk_set:
+        StoreStats.add(acquisitions=len(pk_set))
+    elif action == "post_remove" and pk_set:
+        StoreStats.add(acquisitions=-len(pk_set))
+    elif action == "pre_clear":
+        related = instance.client_set if reverse else instance.services_acq
+        instance._cleared_acquisitions = related.count()
+    elif action == "post_clear":
+        cleared = instance.__dict__.pop("_cleared_acquisitions", 0)
+
+        if cleared:
+            StoreStats.add(acquisitions=-cleared)
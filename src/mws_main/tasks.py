@@ -0,0 +1,30 @@
+import mws_main.fragments as fragments
+import mws_main.models as mmodels
+import mws_main.utils as utils
+import tenants.jobs as jobs
+
+
+@jobs.task(name="mws_main.extract_service_icon")
+def extract_service_icon(service_id):
+    """
+    Copy the icon of the first package of a service that has one.
+
+    It's enqueued by create_service, so the package is parsed again
+    outside the request that created the service.
+    """
+
+    service = mmodels.Service.objects.get(pk=service_id)
+
+    for package in service.package_set.order_by("pk"):
+        parsed_package = utils.ParsedPackage(package.package_file.path)
+
+        try:
+            icon = parsed_package.get_icon()
+
+            if icon:
+                service.icon = icon
+                service.save(update_fields=["icon"])
+                fragments.invalidate_service(service.pk)
+                return
+        finally:
+            parsed_package.close()
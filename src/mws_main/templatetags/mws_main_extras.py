@@ -1,11 +1,79 @@
 from django import template
 from django.template.defaultfilters import stringfilter
+from django.utils.safestring import mark_safe
 
-import markdown
+import mws_main.fragments as fragments
+import mws_main.markup as markup
 
 register = template.Library()
 
 @register.filter
 @stringfilter
 def to_markdown(value):
-    return markdown.markdown(value)
+    return markup.cached_render(value)
+
+@register.filter
+def markdown_html(instance, field):
+    """
+    Return the stored HTML of a Markdown field of a model instance (see
+    mws_main.markup.RenderedMarkdownMixin).
+    """
+    return mark_safe(instance.get_markdown_html(field))
+
+
+class CacheFragmentNode(template.Node):
+
+    def __init__(self, nodelist, name, service, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.service = service
+        self.vary_on = vary_on
+
+    def render(self, context):
+        service = self.service.resolve(context) if self.service else None
+
+        return mark_safe(fragments.cache_fragment(
+            self.name.resolve(context),
+            lambda: self.nodelist.render(context),
+            service=service,
+            vary_on=[value.resolve(context) for value in self.vary_on],
+        ))
+
+
+@register.tag
+def cache_fragment(parser, token):
+    """
+    Cache a fragment of a store's page (see mws_main.fragments).
+
+    Usage::
+
+        {% cache_fragment "name" [service=<pk>] [vary_on ...] %}
+        ...
+        {% endcache_fragment %}
+
+    The fragment is cached until the store changes or, if `service` is
+    given, the service changes. It's cached apart for every value of
+    the other arguments.
+    """
+
+    bits = token.split_contents()
+
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' tag requires at least the name of the fragment."
+        )
+
+    name = parser.compile_filter(bits[1])
+    service = None
+    vary_on = []
+
+    for bit in bits[2:]:
+        if bit.startswith("service="):
+            service = parser.compile_filter(bit.removeprefix("service="))
+        else:
+            vary_on.append(parser.compile_filter(bit))
+
+    nodelist = parser.parse(("endcache_fragment",))
+    parser.delete_first_token()
+
+    return CacheFragmentNode(nodelist, name, service, vary_on)
@@ -1,5 +1,31 @@
-from django.test import TestCase
+import datetime
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import URLResolver, resolve, reverse
+from django.utils.functional import empty
+import mws_main.fragments as fragments
+import mws_main.markup as markup
+import mws_main.metrics as metrics
+import mws_main.middleware as middleware
+import mws_main.models as mmodels
+import mws_main.profiling as profiling
+import mws_main.query_inspection as query_inspection
+import mws_main.stats as stats
+import mws_main.theme as theme
+import mws_main.timing as timing
+import mws_main.urls as urls
+import mws_main.user_types as user_types
 import mws_main.utils as utils
+from tenants.connections import TENANT_DB_FIELDS
+from tenants.middlewares import using_tenant
+import tenants.bus as bus
+import tenants.db_management as db
 import tenants.models as tmodels
 import os
 
@@ -42,6 +68,704 @@ class PackageTestCase(TestCase):
         self.packages_creation(filenames)
 
 
+class StoreThemeTestCase(SimpleTestCase):
+
+    def setUp(self):
+        theme._local.clear()
+        patcher = mock.patch.object(
+            theme,
+            "load_store_theme",
+            side_effect=lambda subdomain: theme.StoreTheme(subdomain, {}),
+        )
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Only this process is notified.
+        patcher = mock.patch.object(bus, "publish", side_effect=bus.dispatch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_theme_is_loaded_once(self):
+        """Test that the theme of a store is only read once."""
+        theme.get_store_theme("tenant1")
+        theme._local.clear()
+        self.assertEqual(theme.get_store_theme("tenant1").tenant, "tenant1")
+        self.assertEqual(self.load.call_count, 1)
+
+    def test_invalidated_theme_is_loaded_again(self):
+        """Test that a changed theme isn't read from the cache."""
+        theme.get_store_theme("tenant2")
+        theme.invalidate_store_theme("tenant2")
+        theme.get_store_theme("tenant2")
+        self.assertEqual(self.load.call_count, 2)
+
+    def test_notified_process_loads_new_theme(self):
+        """Test that a process that doesn't share the cache reads the new theme."""
+        # Each process has its own local memory cache
+        processes = [
+            {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": name}}
+            for name in ("process1", "process2")
+        ]
+
+        for caches in processes:
+            with override_settings(CACHES=caches):
+                theme.get_store_theme("tenant3")
+
+        self.load.side_effect = lambda subdomain: theme.StoreTheme(subdomain, {"new": True})
+
+        with override_settings(CACHES=processes[1]):
+            # Notified by the first process
+            bus.dispatch("theme", "tenant3")
+            self.assertEqual(theme.get_store_theme("tenant3").appearance_metadata, {"new": True})
+
+
+class MetricsTestCase(SimpleTestCase):
+
+    def test_processes_are_merged(self):
+        """Test that the metrics of several processes are added up."""
+        histogram = metrics.Histogram("latency", "", ("view",), (0.1, 1))
+        histogram.observe(("home",), 0.05)
+        first = {"latency": histogram.snapshot()}
+        histogram.observe(("home",), 2)
+        second = {"latency": histogram.snapshot()}
+
+        with mock.patch.object(metrics, "METRICS", (histogram,)):
+            text = metrics.render(metrics.merge([first, second]))
+
+        self.assertIn('latency_bucket{view="home",le="0.1"} 2', text)
+        self.assertIn('latency_bucket{view="home",le="+Inf"} 3', text)
+        self.assertIn('latency_count{view="home"} 3', text)
+
+    def test_dead_processes_are_merged(self):
+        """Test that the files of the ended processes are added up in one."""
+        counter = metrics.Counter("requests", "", ("view",))
+        counter.inc(("home",), 2)
+
+        with tempfile.TemporaryDirectory() as metrics_dir, \
+                override_settings(METRICS_DIR=metrics_dir), \
+                mock.patch.object(metrics, "METRICS", (counter,)), \
+                mock.patch.object(metrics, "is_alive", lambda pid: pid == os.getpid()):
+
+            for pid in (1000001, 1000002):
+                metrics.write_metrics(metrics.metrics_file(pid), metrics.snapshot())
+
+            self.assertEqual(metrics.collect()["requests"], {("home",): 6})
+            self.assertEqual(metrics.collect()["requests"], {("home",): 6})
+            self.assertEqual(
+                sorted(os.listdir(metrics_dir)),
+                [".lock", f"{os.getpid()}.json", metrics.DEAD_PROCESSES_FILE],
+            )
+
+
+class ProfilingTestCase(SimpleTestCase):
+
+    @override_settings(PROFILE_SAMPLE_RATE=0)
+    def test_signed_header(self):
+        """Test that only the header signed for the store profiles it."""
+        request = SimpleNamespace(
+            META={profiling.PROFILE_HEADER: profiling.make_token("tenant1")},
+        )
+        self.assertTrue(profiling.should_profile(request, "tenant1", {}))
+        self.assertFalse(profiling.should_profile(request, "tenant2", {}))
+
+    def test_profiles_are_merged(self):
+        """Test that the stacks of several requests are added up."""
+        with tempfile.TemporaryDirectory() as profiles_dir:
+            with override_settings(PROFILES_DIR=profiles_dir):
+                profiling.save_profile("tenant1", "home", Counter({"a;b": 2}))
+                profiling.save_profile("tenant1", "home", Counter({"a;b": 1, "a": 1}))
+                profiling.save_profile(None, None, Counter({"a": 5}))
+
+                merged = profiling.merge_profiles(
+                    profiling.find_profiles(subdomain="tenant1")
+                )
+
+        self.assertEqual(merged, Counter({"tenant1;home;a;b": 3, "tenant1;home;a": 1}))
+
+
+class StoreStatsTestCase(SimpleTestCase):
+
+    def test_period_of_month(self):
+        """Test that the periods of the months round-trip to their first day."""
+        period = mmodels.StoreStats.month_period(datetime.date(2024, 3, 31))
+
+        self.assertEqual(period, "2024-03")
+        self.assertEqual(stats.period_date(period), datetime.date(2024, 3, 1))
+
+    @override_settings(STORE_STATS_FLUSH_INTERVAL=3600)
+    def test_downloads_are_batched(self):
+        """Test that the downloads are written together when flushed."""
+        with mock.patch.object(mmodels.StoreStats, "add") as add, \
+                mock.patch.object(stats, "transaction"), \
+                mock.patch.dict(stats._pending, clear=True):
+
+            with using_tenant("tenant1"):
+                stats.add_later(downloads=1, bandwidth=100)
+                stats.add_later(downloads=1, bandwidth=50)
+
+            stats.flush_stats()
+            add.assert_not_called()
+
+            stats.flush_stats(force=True)
+
+        add.assert_called_once_with(
+            date=stats.period_date(mmodels.StoreStats.month_period()),
+            downloads=2,
+            bandwidth=150,
+        )
+
+    def test_cleared_acquisitions(self):
+        """Test that clearing the services of a client subtracts them."""
+        client = SimpleNamespace(services_acq=mock.Mock(**{"count.return_value": 3}))
+
+        with mock.patch.object(mmodels.StoreStats, "add") as add:
+            for action in ("pre_clear", "post_clear"):
+                stats.acquisitions_changed(
+                    sender=None,
+                    instance=client,
+                    action=action,
+                    reverse=False,
+                    pk_set=None,
+                )
+
+        add.assert_called_once_with(acquisitions=-3)
+
+
+class MarkupTestCase(SimpleTestCase):
+
+    def test_sanitize(self):
+        """Test that scripts, event handlers and unsafe links are removed."""
+        html = markup.render(
+            "[link](javascript:alert(1)) **bold**\n\n"
+            "<script>alert(1)</script><p onclick=\"alert(1)\">text</p>"
+        )
+
+        self.assertEqual(
+            html,
+            "<p><a>link</a> <strong>bold</strong></p>\n\n<p>text</p>",
+        )
+
+    @override_settings(MARKDOWN_CACHE_SIZE=1)
+    def test_render_cache(self):
+        """Test that a text is rendered once while it's in the cache."""
+        with mock.patch.object(markup, "_cache", None), \
+                mock.patch.object(markup, "render", side_effect=markup.render) as render:
+            markup.cached_render("*a*")
+            markup.cached_render("*a*")
+            markup.cached_render("*b*")
+            markup.cached_render("*a*")
+
+        self.assertEqual(render.call_count, 3)
+
+    def test_stored_html(self):
+        """Test that the HTML is rendered when it isn't stored."""
+        entry = mmodels.VersionEntry(changes="*Changes*")
+
+        self.assertEqual(entry.get_markdown_html("changes"), "<p><em>Changes</em></p>")
+
+        entry.changes_html = "<p>Stored</p>"
+        self.assertEqual(entry.get_markdown_html("changes"), "<p>Stored</p>")
+
+    def test_save_renders(self):
+        """Test that saving a Markdown field saves its HTML too."""
+        service = mmodels.Service(descrp="*Description*")
+
+        with mock.patch("django.db.models.Model.save") as save:
+            service.save(update_fields=["descrp"])
+
+        save.assert_called_once_with(update_fields=["descrp", "descrp_html"])
+        self.assertEqual(service.descrp_html, "<p><em>Description</em></p>")
+
+
+class FragmentCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.backends = {
+            "locmem": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "filebased": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": self.cache_dir.name,
+            },
+        }
+
+        patcher = mock.patch.object(bus, "publish", side_effect=bus.dispatch)
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def for_each_backend(self):
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name), override_settings(CACHES={"default": backend}):
+                fragments.cache.clear()
+                yield
+
+    def render(self, name, value, tenant="tenant1", service=None):
+        with using_tenant(tenant):
+            return fragments.cache_fragment(name, lambda: value, service=service)
+
+    def test_invalidation(self):
+        """Test that the fragments are cached by tenant until their version changes."""
+
+        for _ in self.for_each_backend():
+            self.assertEqual(self.render("footer", "a"), "a")
+            self.assertEqual(self.render("footer", "b"), "a")
+            self.assertEqual(self.render("footer", "b", tenant="tenant2"), "b")
+            self.assertEqual(self.render("card", "a", service=1), "a")
+            self.assertEqual(self.render("card", "a", service=2), "a")
+
+            with using_tenant("tenant1"):
+                fragments.invalidate_service(1)
+
+            self.assertEqual(self.render("card", "b", service=1), "b")
+            self.assertEqual(self.render("card", "b", service=2), "a")
+            self.assertEqual(self.render("footer", "c"), "a")
+
+            with using_tenant("tenant1"):
+                fragments.invalidate_store()
+
+            self.assertEqual(self.render("footer", "c"), "c")
+            self.assertEqual(self.render("card", "c", service=2), "c")
+            self.assertEqual(self.render("footer", "d", tenant="tenant2"), "b")
+
+    def test_invalidation_of_other_processes(self):
+        """Test that the processes that don't share the cache are notified."""
+        # Each process has its own local memory cache
+        processes = [
+            {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": name}}
+            for name in ("process1", "process2")
+        ]
+
+        for caches in processes:
+            with override_settings(CACHES=caches):
+                fragments.cache.clear()
+                self.assertEqual(self.render("card", "a", service=1), "a")
+                self.assertEqual(self.render("footer", "a"), "a")
+
+        with override_settings(CACHES=processes[0]):
+            # Only this process' handlers are called
+            self.publish.side_effect = None
+
+            with using_tenant("tenant1"):
+                fragments.invalidate_service(1)
+                fragments.invalidate_store()
+
+        with override_settings(CACHES=processes[1]):
+            for call in self.publish.call_args_list:
+                bus.dispatch(*call.args)
+
+            self.assertEqual(self.render("card", "b", service=1), "b")
+            self.assertEqual(self.render("footer", "b"), "b")
+
+    def test_missed_changes(self):
+        """Test that every fragment is discarded when changes may have been missed."""
+
+        for _ in self.for_each_backend():
+            self.assertEqual(self.render("card", "a", service=1), "a")
+
+            with mock.patch.object(fragments, "_min_version", 0):
+                bus.reset_all()
+                self.assertEqual(self.render("card", "b", service=1), "b")
+
+    def test_single_flight(self):
+        """Test that a fragment being rendered is waited for, not rendered again."""
+
+        for _ in self.for_each_backend():
+            with using_tenant("tenant1"):
+                key = fragments.fragment_key("footer")
+
+            cache = fragments.cache
+            cache.add(f"{key}:lock", 1)
+            render = mock.Mock(return_value="b")
+
+            # The other request finishes while this one waits
+            with mock.patch.object(fragments.time, "sleep", side_effect=lambda _: cache.set(key, "a")):
+                self.assertEqual(fragments.get_or_render(key, render), "a")
+
+            render.assert_not_called()
+
+    def test_template_tag(self):
+        """Test that the tag caches its content by service."""
+        template = Template(
+            '{% load mws_main_extras %}'
+            '{% cache_fragment "card" service=pk %}{{ name }}{% endcache_fragment %}'
+        )
+
+        for _ in self.for_each_backend():
+            with using_tenant("tenant1"):
+                self.assertEqual(template.render(Context({"pk": 1, "name": "a"})), "a")
+                self.assertEqual(template.render(Context({"pk": 1, "name": "b"})), "a")
+                self.assertEqual(template.render(Context({"pk": 2, "name": "b"})), "b")
+
+
+class QueryInspectionTestCase(SimpleTestCase):
+
+    def test_query_shape(self):
+        """Test that queries differing in their values have the same shape."""
+        self.assertEqual(
+            query_inspection.query_shape(
+                'SELECT * FROM "t" WHERE "id" IN (%s, %s, %s) LIMIT 21'
+            ),
+            query_inspection.query_shape(
+                'SELECT * FROM "t"\n WHERE "id" IN (%s) LIMIT 1'
+            ),
+        )
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_budget_exceeded(self):
+        """Test that a request over its view's budget fails."""
+        request = SimpleNamespace(
+            path="/",
+            resolver_match=mock.Mock(
+                func=mock.Mock(view_class=SimpleNamespace(query_budget=2)),
+            ),
+        )
+        query_inspection.check_request(request, 2)
+
+        with self.assertRaises(query_inspection.QueryBudgetExceeded):
+            query_inspection.check_request(request, 3)
+
+
+class ServerTimingTestCase(SimpleTestCase):
+
+    def test_nested_parts_are_measured_once(self):
+        """Test that a part nested in itself isn't counted twice."""
+        timings = timing.Timings()
+        token = timing.TIMINGS.set(timings)
+
+        with mock.patch.object(timing.time, "perf_counter", side_effect=[0, 1, 2, 3]):
+            with timing.timed(timing.TEMPLATE):
+                with timing.timed(timing.TEMPLATE):
+                    with timing.timed(timing.MARKDOWN):
+                        pass
+
+        timing.TIMINGS.reset(token)
+        self.assertEqual(
+            timings.header(),
+            'markdown;dur=1000.0;desc="Markdown rendering", '
+            'template;dur=3000.0;desc="Template rendering"',
+        )
+
+    def test_nothing_is_measured_outside_requests(self):
+        """Test that the parts aren't measured without a request."""
+        with timing.timed(timing.TEMPLATE):
+            self.assertIsNone(timing.TIMINGS.get())
+
+
+def named_urls(patterns, namespace):
+    """Return the names of the URLs of a list of URL patterns."""
+
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from named_urls(pattern.url_patterns, namespace)
+        elif pattern.name:
+            yield f"{namespace}:{pattern.name}"
+
+
+class SeededStoreTestCase(TransactionTestCase):
+    """
+    Base of the test cases that request the pages of a store with
+    seeded data: developers, services with packages and versions, and
+    clients who have acquired them.
+    """
+
+    subdomain = None
+    host = None
+    password = "Ab12345678"
+
+    n_clients = 1
+    n_services = 1
+    n_packages = 1
+    n_versions = 1
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tenant = tmodels.register_tenant(
+            cls.subdomain.title(), cls.subdomain, f"admin@{cls.subdomain}.test",
+        )
+
+        with using_tenant(cls.subdomain):
+            cls.seed()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.revert_tenant_storage(
+            cls.subdomain,
+            {field: getattr(cls.tenant, field) for field in TENANT_DB_FIELDS},
+        )
+        super().tearDownClass()
+
+    @classmethod
+    def seed(cls):
+
+        developers = [
+            mmodels.Developer.objects.create_user(
+                username=f"developer{i}",
+                email=f"developer{i}@budgets.test",
+                password=cls.password,
+            )
+            for i in range(3)
+        ]
+
+        services = []
+
+        for i in range(cls.n_services):
+            service = mmodels.Service.objects.create(
+                name=f"Service {i}",
+                brief_descrp="Brief description.",
+                descrp="*Description*.",
+            )
+            services.append(service)
+
+            for developer in developers:
+                developer.assigned_services.add(service)
+
+            for j in range(cls.n_packages):
+                package = mmodels.Package.objects.create(
+                    name=f"package{j}",
+                    package_file=f"{cls.subdomain}/{service.name}/package{j}.apk",
+                    size=1024,
+                    package_type="APK",
+                    os_name="Android",
+                    last_version=str(cls.n_versions),
+                    service=service,
+                )
+
+                for version in range(cls.n_versions):
+                    mmodels.VersionEntry.objects.create(
+                        version=str(version),
+                        changes="- Changes.",
+                        package=package,
+                    )
+
+        for i in range(cls.n_clients):
+            client = mmodels.Client.objects.create_user(
+                username=f"client{i}",
+                email=f"client{i}@budgets.test",
+                password=cls.password,
+            )
+            client.services_acq.add(*services)
+
+        cls.url_kwargs = {
+            "mws_main:client_detail": {"pk": client.pk},
+            "mws_main:developer_detail": {"pk": developers[0].pk},
+            "mws_main:service_admin_detail": {"pk": service.pk},
+            "mws_main:service_detail": {"pk": service.pk},
+            "mws_main:update_service": {"pk": service.pk},
+            "mws_main:download_service": {"service_id": service.pk, "package_id": package.pk},
+            "mws_main:update_package": {"service_id": service.pk, "package_id": package.pk},
+        }
+
+
+class QueryBudgetTestCase(SeededStoreTestCase):
+    """
+    Request every URL of mws_main.urls in a store with seeded data and
+    check that their views keep within their query budgets.
+    """
+
+    subdomain = "budgets"
+    host = "budgets.mws.local"
+
+    # The data is large enough for a query run per row to exceed any
+    # budget.
+    n_clients = 10
+    n_services = 3
+    n_packages = 3
+    n_versions = 3
+
+    # Views that can't be requested without the data of a password
+    # reset, or that only accept POST.
+    not_requested = {"mws_main:password_reset_confirm", "mws_main:logout"}
+
+    # Users that have permission to request each view, if not all of
+    # them.
+    allowed_users = {
+        "mws_main:client_detail": {"admin"},
+        "mws_main:developer_detail": {"admin"},
+        "mws_main:add_developer": {"admin"},
+        "mws_main:store_info": {"admin"},
+        "mws_main:update_store": {"admin"},
+        "mws_main:service_admin_detail": {"admin", "developer0"},
+        "mws_main:add_service": {"admin", "developer0"},
+    }
+
+    # Status of the views that don't respond with a page
+    expected_status = {
+        "mws_main:login": 302,
+        "mws_main:download_service": 302,
+    }
+
+    def assert_url_budgets(self, username):
+        """Request every URL as the given user."""
+
+        with using_tenant(self.subdomain):
+            self.assertTrue(self.client.login(username=username, password=self.password))
+
+        for name in named_urls(urls.urlpatterns, urls.app_name):
+
+            if name in self.not_requested or username not in self.allowed_users.get(name, {username}):
+                continue
+
+            with self.subTest(url=name, user=username):
+                url = reverse(name, kwargs=self.url_kwargs.get(name))
+                self.assertIsNotNone(query_inspection.get_query_budget(resolve(url)))
+                response = self.client.get(url, HTTP_HOST=self.host)
+                self.assertEqual(response.status_code, self.expected_status.get(name, 200))
+
+    @override_settings(QUERY_BUDGET_STRICT=True, QUERY_INSPECTION=True)
+    def test_views_keep_within_budgets(self):
+        """Test that no view exceeds its query budget."""
+
+        for username in ("admin", "developer0", "client0"):
+            self.assert_url_budgets(username)
+
+
+class ServiceDetailQueriesTestCase(SeededStoreTestCase):
+    """
+    Check that the pages of a service with many packages and versions
+    run the same queries as the pages of a service with one.
+    """
+
+    subdomain = "servicedetail"
+    host = "servicedetail.mws.local"
+
+    n_clients = 1
+    n_services = 1
+    n_packages = 5
+    n_versions = 200
+
+    @classmethod
+    def seed(cls):
+        super().seed()
+
+        small_service = mmodels.Service.objects.create(
+            name="Small service",
+            brief_descrp="Brief description.",
+            descrp="*Description*.",
+        )
+        package = mmodels.Package.objects.create(
+            name="package",
+            package_file=f"{cls.subdomain}/{small_service.name}/package.apk",
+            size=1024,
+            package_type="APK",
+            os_name="Android",
+            last_version="0",
+            service=small_service,
+        )
+        mmodels.VersionEntry.objects.create(version="0", changes="- Changes.", package=package)
+        mmodels.Developer.objects.get(username="developer0").assigned_services.add(small_service)
+
+        cls.service_pks = (cls.url_kwargs["mws_main:service_detail"]["pk"], small_service.pk)
+
+    def count_queries(self, url):
+
+        with mock.patch.object(metrics, "record_request") as record_request:
+            response = self.client.get(url, HTTP_HOST=self.host)
+
+        self.assertEqual(response.status_code, 200)
+        return record_request.call_args.kwargs["queries"][0]
+
+    @override_settings(FRAGMENT_CACHE=False)
+    def test_constant_queries(self):
+        """Test that the number of queries doesn't depend on the packages and versions."""
+
+        for username, name in (
+                ("client0", "mws_main:service_detail"),
+                ("developer0", "mws_main:service_admin_detail"),
+        ):
+            with using_tenant(self.subdomain):
+                self.assertTrue(self.client.login(username=username, password=self.password))
+
+            large_url, small_url = (reverse(name, kwargs={"pk": pk}) for pk in self.service_pks)
+
+            with self.subTest(url=name):
+                # The first request fills the caches of the store
+                self.count_queries(large_url)
+                self.assertEqual(self.count_queries(large_url), self.count_queries(small_url))
+
+
+class UserTypeMiddlewareTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            user_types,
+            "resolve_user_type",
+            return_value=user_types.models.Client.group_name,
+        )
+        self.resolve = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(bus, "publish", side_effect=bus.dispatch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = mock.Mock(pk=7, is_authenticated=True)
+        self.session = {"_auth_user_id": "7"}
+        user_types.store_user_type(self.session, self.user)
+        self.resolve.reset_mock()
+
+    def process(self):
+        request = SimpleNamespace(session=self.session, user=self.user)
+        middleware.UserTypeMiddleware(lambda request: request)(request)
+        return request
+
+    def test_stored_type_is_used(self):
+        """Test that the type isn't resolved again after logging in."""
+        request = self.process()
+        self.assertTrue(request.is_client)
+        self.assertFalse(request.is_developer)
+        self.resolve.assert_not_called()
+        self.assertIs(request.user._wrapped, empty)
+        self.assertEqual(request.user.pk, self.user.client.pk)
+
+    def test_changed_groups_resolve_type_again(self):
+        """Test that the type is resolved again when the groups change."""
+        self.resolve.return_value = user_types.models.Developer.group_name
+        user_types.mark_stale("None:7")
+        request = self.process()
+        self.resolve.assert_called_once()
+        self.assertTrue(request.is_developer)
+
+    def test_stored_type_of_anonymous_user_is_dropped(self):
+        """Test that a session whose user can't be authenticated gets no type."""
+        self.user = AnonymousUser()
+        request = self.process()
+        self.assertFalse(request.is_admin or request.is_developer or request.is_client)
+        self.assertIs(request.user, self.user)
+        self.assertNotIn(user_types.SESSION_KEY, self.session)
+
+    def test_cleared_groups_resolve_type_again(self):
+        """Test that clearing the users of a group marks them as stale."""
+        group = mock.Mock()
+        group.user_set.values_list.return_value = [7, 8]
+        sender = user_types.models.auth_models.User.groups.through
+
+        with mock.patch.object(bus, "publish") as publish, \
+                mock.patch.object(user_types.transaction, "on_commit") as on_commit:
+            user_types.groups_changed(sender, group, "pre_clear", True, None, "tenant1")
+            on_commit.assert_not_called()
+
+            # The users are no longer in the group after clearing it
+            group.user_set.values_list.return_value = []
+            user_types.groups_changed(sender, group, "post_clear", True, None, "tenant1")
+
+            # The marks are only published once the change is committed
+            publish.assert_not_called()
+            self.assertEqual(
+                [call.kwargs for call in on_commit.call_args_list],
+                [{"using": "tenant1"}] * 2,
+            )
+
+            for call in on_commit.call_args_list:
+                call.args[0]()
+
+        self.assertEqual(
+            [call.args for call in publish.call_args_list],
+            [("user_type", "None:7"), ("user_type", "None:8")],
+        )
+
+
 """
 class ServiceTestCase(TestCase):
 
@@ -0,0 +1,136 @@
+"""
+Cache of the data every store page shows: the tenant's name and the
+appearance of its store.
+
+The data is cached in the default cache, shared by the processes when
+``MWS_CACHE_LOCATION`` is set, under a version number of the tenant.
+Changing the store's appearance drops the version, and a greater one is
+created when it's read again, so the old data is no longer read. Each
+process also keeps the data it has read for ``STORE_THEME_LOCAL_TTL``
+seconds, so most of the requests don't even read the shared cache. The
+changes are notified to the other processes (see tenants.bus), which
+drop their copy and, in case they don't share the cache, their version.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+import mws_main.models as models
+import tenants.bus as bus
+
+StoreTheme = namedtuple("StoreTheme", ["tenant", "appearance_metadata"])
+
+# Subdomain -> (expiration time, version, StoreTheme)
+_local = {}
+_local_lock = threading.Lock()
+
+
+def version_key(subdomain):
+    return f"store-theme:{subdomain}:version"
+
+
+def theme_key(subdomain, version):
+    return f"store-theme:{subdomain}:{version}"
+
+
+def new_version():
+    # If the version is evicted from the shared cache, the new one must
+    # be greater than the previous ones, or stale data would be read.
+    return time.time_ns() // 1000
+
+
+def get_version(subdomain):
+    version = cache.get(version_key(subdomain))
+
+    if version is None:
+        cache.add(version_key(subdomain), new_version(), timeout=None)
+        version = cache.get(version_key(subdomain))
+
+    return version
+
+
+def load_store_theme(subdomain):
+    """
+    Read the theme of a store from the databases.
+
+    Only the tenant's fields shown in the store are read, so its
+    database credentials aren't cached.
+    """
+
+    Tenant = apps.get_model("tenants", "Tenant")
+    tenant = Tenant.objects.only("name", "subdomain_prefix").get(
+        subdomain_prefix=subdomain,
+    )
+    appearance_metadata = (
+        models.Metadata.objects
+        .values_list("appearance_metadata", flat=True)
+        .first()
+    )
+
+    return StoreTheme(tenant, appearance_metadata)
+
+
+def get_store_theme(subdomain):
+    """
+    Return the theme of a store.
+
+    :rtype: StoreTheme
+    :raises Tenant.DoesNotExist: if there isn't a tenant with that
+    subdomain.
+    """
+
+    now = time.monotonic()
+    local = _local.get(subdomain)
+
+    if local is not None and local[0] > now:
+        return local[2]
+
+    version = get_version(subdomain)
+
+    if local is not None and local[1] == version:
+        theme = local[2]
+    else:
+        theme = cache.get(theme_key(subdomain, version))
+
+        if theme is None:
+            theme = load_store_theme(subdomain)
+            cache.set(
+                theme_key(subdomain, version),
+                theme,
+                timeout=settings.STORE_THEME_TIMEOUT,
+            )
+
+    with _local_lock:
+        _local[subdomain] = (now + settings.STORE_THEME_LOCAL_TTL, version, theme)
+
+    return theme
+
+
+def evict_local(subdomain):
+    with _local_lock:
+        _local.pop(subdomain, None)
+
+    cache.delete(version_key(subdomain))
+
+
+def clear_local():
+    with _local_lock:
+        _local.clear()
+
+
+bus.subscribe("theme", evict_local, clear_local)
+
+
+def invalidate_store_theme(subdomain):
+    """
+    Discard the cached theme of a store after its tenant or appearance
+    have changed.
+    """
+
+    # Every process, this one too, drops the version
+    bus.publish("theme", subdomain)
@@ -0,0 +1,105 @@
+"""
+Breakdown of the time spent serving a request, sent in the
+``Server-Timing`` header (see StatsMiddleware).
+
+The parts of the request are measured with `timed`, which only records
+them while a request is being measured. A part is only measured once
+when it's nested in itself, as templates included by other templates,
+but different parts may overlap: the Markdown rendered by a template is
+also template time.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import (
+    DjangoTemplates,
+    Template as DjangoTemplate,
+    reraise,
+)
+
+TENANT = "tenant"
+USER_TYPE = "usertype"
+DB = "db"
+TEMPLATE = "template"
+MARKDOWN = "markdown"
+TOTAL = "total"
+
+DESCRIPTIONS = {
+    TENANT: "Tenant resolution",
+    USER_TYPE: "User type resolution",
+    TEMPLATE: "Template rendering",
+    MARKDOWN: "Markdown rendering",
+}
+
+
+class Timings:
+    """Time spent in each part of a request."""
+
+    def __init__(self):
+        self.durations = {}
+        self.active = set()
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0) + duration
+
+    def header(self):
+        """Return the value of the Server-Timing header."""
+
+        metrics = []
+
+        for name, duration in self.durations.items():
+            metric = f"{name};dur={duration * 1000:.1f}"
+
+            if name in DESCRIPTIONS:
+                metric += f';desc="{DESCRIPTIONS[name]}"'
+
+            metrics.append(metric)
+
+        return ", ".join(metrics)
+
+
+# Timings of the request being measured
+TIMINGS = contextvars.ContextVar("server_timings", default=None)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the part `name` of the request."""
+
+    timings = TIMINGS.get()
+
+    if timings is None or name in timings.active:
+        yield
+        return
+
+    timings.active.add(name)
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+        timings.active.discard(name)
+
+
+class TimedTemplate(DjangoTemplate):
+
+    def render(self, context=None, request=None):
+        with timed(TEMPLATE):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template engine whose rendering time is measured."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
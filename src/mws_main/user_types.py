@@ -0,0 +1,170 @@
+"""
+Type of the users of a store: client, developer or administrator.
+
+The type is resolved when the user logs in and stored in the session,
+together with the primary key of the user's Client, Developer or
+TenantAdmin row (the same as the user's one), so the following requests
+don't have to read the user's groups.
+
+Changing the groups of a user marks the type stored in its sessions as
+stale, in the default cache, so it's resolved again in the next request.
+The changes are notified to the other processes (see tenants.bus), in
+case they don't share the cache.
+"""
+
+import time
+from functools import partial
+
+from django.conf import settings
+from django.contrib import auth
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
+from django.db import transaction
+
+import mws_main.models as models
+import tenants.bus as bus
+from tenants.middlewares import get_current_db_name
+
+SESSION_KEY = "_mws_user_type"
+
+# Models of the user types, in order of precedence, and the name of the
+# User's relation with each one.
+USER_TYPES = (
+    (models.Client, "client"),
+    (models.Developer, "developer"),
+    (models.TenantAdmin, "tenantadmin"),
+)
+
+# Key of the stale mark of all the users
+ALL_USERS = "*"
+
+
+def user_type_model(group_name):
+    """Return the model and relation name of a user type."""
+
+    for user_model, relation in USER_TYPES:
+        if user_model.group_name == group_name:
+            return user_model, relation
+
+    raise SuspiciousOperation(f"Unknown user type {group_name}.")
+
+
+def resolve_user_type(user):
+    """
+    Return the group name of the user's type, reading its groups with
+    a single query.
+
+    :raises SuspiciousOperation: if the user isn't a client, developer
+    or admin.
+    """
+
+    group_names = set(
+        user.groups
+        .filter(name__in=[user_model.group_name for user_model, _ in USER_TYPES])
+        .values_list("name", flat=True)
+    )
+
+    for user_model, _ in USER_TYPES:
+        if user_model.group_name in group_names:
+            return user_model.group_name
+
+    raise SuspiciousOperation(
+        "A user who is not a client, developer or admin has logged."
+    )
+
+
+def store_user_type(session, user):
+    """Resolve the type of the user and store it in the session."""
+
+    session[SESSION_KEY] = {
+        "type": resolve_user_type(user),
+        "pk": user.pk,
+        "resolved": time.time_ns(),
+    }
+
+    return session[SESSION_KEY]
+
+
+def stale_key(key):
+    return f"user-type-stale:{key}"
+
+
+def get_stored_user_type(session):
+    """
+    Return the user type stored in the session, or None if there isn't
+    one for the logged user or it's stale.
+    """
+
+    stored = session.get(SESSION_KEY)
+    user_pk = session.get(auth.SESSION_KEY)
+
+    if stored is None or str(stored["pk"]) != str(user_pk):
+        return None
+
+    tenant = get_current_db_name()
+    marks = cache.get_many([
+        stale_key(f"{tenant}:{user_pk}"),
+        stale_key(ALL_USERS),
+    ])
+
+    if any(mark > stored["resolved"] for mark in marks.values()):
+        return None
+
+    return stored
+
+
+def mark_stale(key):
+    """
+    Mark the type stored in the sessions of a user as stale.
+
+    :param key: ``<tenant>:<user pk>``, or ALL_USERS.
+    """
+
+    cache.set(stale_key(key), time.time_ns(), timeout=settings.SESSION_COOKIE_AGE)
+
+
+def mark_all_stale():
+    mark_stale(ALL_USERS)
+
+
+bus.subscribe("user_type", mark_stale, mark_all_stale)
+
+
+def user_logged_in(sender, request, user, **kwargs):
+    """Store the type of a user who has just logged in."""
+
+    try:
+        store_user_type(request.session, user)
+    except SuspiciousOperation:
+        # UserTypeMiddleware rejects its requests
+        pass
+
+
+def groups_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """
+    Mark the type of the users whose groups change as stale, once the
+    change is committed, so it isn't resolved again from the old groups.
+    """
+
+    if action == "pre_clear":
+        # The users of a group are no longer known after clearing them
+        instance._cleared_users = (
+            list(instance.user_set.values_list("pk", flat=True))
+            if reverse else [instance.pk]
+        )
+        return
+
+    if action == "post_clear":
+        user_pks = instance.__dict__.pop("_cleared_users", [])
+    elif action in ("post_add", "post_remove"):
+        user_pks = pk_set if reverse else [instance.pk]
+    else:
+        return
+
+    tenant = get_current_db_name()
+
+    for user_pk in user_pks or ():
+        transaction.on_commit(
+            partial(bus.publish, "user_type", f"{tenant}:{user_pk}"),
+            using=using,
+        )
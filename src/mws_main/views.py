@@ -20,25 +20,35 @@ from django.shortcuts import get_object_or_404, render, resolve_url, redirect
 from django.urls import reverse
 from django.http import Http404, HttpResponse, HttpResponseForbidden
 from django.forms import formset_factory
-from django.utils import timezone
+from django.db.models import Count
+from django.utils.functional import cached_property
 
 import mws_main.models as models
 import mws_main.forms as forms
-import tenants.models as tmodels
+import mws_main.fragments as fragments
+import mws_main.stats as stats
+import mws_main.theme as theme
 from tenants.middlewares import get_current_db_name
 
 class ThemeMixin(ContextMixin):
+    """
+    Add the tenant and the appearance of its store, which are cached,
+    to the context.
+    """
 
-    def setup(self, request, *args, **kwargs):
-        super().setup(request, *args, **kwargs)
-        self.metadata = models.Metadata.objects.all().first()
+    # Maximum number of queries of the store's pages, including the
+    # session, the user and its permissions (see mws_main.query_inspection)
+    query_budget = 10
+
+    @cached_property
+    def metadata(self):
+        return models.Metadata.objects.all().first()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["tenant"] = tmodels.Tenant.objects.get(
-            subdomain_prefix=get_current_db_name()
-        )
-        context["metadata"] = self.metadata.appearance_metadata
+        store_theme = theme.get_store_theme(get_current_db_name())
+        context["tenant"] = store_theme.tenant
+        context["metadata"] = store_theme.appearance_metadata
         return context
 
 
@@ -109,6 +119,8 @@ class StoreHomeView(UserMixin, TemplateView):
     The template is determined by the group the authenticated
     user belongs to.
     """
+
+    query_budget = 15
     
     def get_template_names(self):
 
@@ -133,25 +145,48 @@ class StoreHomeView(UserMixin, TemplateView):
             context["last_uploaded_services"] = context["services"].order_by("-datetime_published")[:3]
         elif self.is_developer:
             context["services"] = self.user.assigned_services.all()
-            context["updates"] = models.get_nupdates()
-            context["monthly_updates"] = models.get_monthly_nupdates()
+            store_stats = stats.get_store_stats(get_current_db_name())
+            context["updates"] = store_stats["updates"]
+            context["monthly_updates"] = store_stats["monthly_updates"]
             
         elif self.is_admin:
             context["developers"] = models.Developer.objects.all()
-            context["clients"] = models.Client.objects.all()
-            context["monthly_reg_clients"] = context["clients"].filter(date_joined__month=timezone.now().month).count()
-            context["reg_clients"] = context["clients"].count()
-            context["acquisitions"] = sum([client.services_acq.get_queryset().count() for client in context["clients"]])
-            context["updates"] = models.get_nupdates()
-            context["monthly_updates"] = models.get_monthly_nupdates()
+            context.update(stats.get_store_stats(get_current_db_name()))
 
         return context
 
 
-class ServiceDetailView(UserMixin, DetailView):
+class ServiceDetailMixin:
+    """
+    Add the packages of the service to the context, with their version
+    entries prefetched, so a service's page runs the same queries
+    whatever their number.
+
+    The service is annotated with its number of packages,
+    ``n_packages``, and the packages with their number of versions,
+    ``n_versions``. The packages are only read if their list isn't
+    cached (see mws_main.fragments).
+    """
+
     model = models.Service
     context_object_name = "service"
 
+    def get_queryset(self):
+        return models.Service.objects.annotate(n_packages=Count("package"))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["packages"] = (
+            self.object.package_set
+            .annotate(n_versions=Count("versionentry"))
+            .prefetch_related("versionentry_set")
+        )
+        return context
+
+
+class ServiceDetailView(ServiceDetailMixin, UserMixin, DetailView):
+    query_budget = 15
+
 
 class ClientAdminDetailView(PermissionRequiredMixin, UserMixin, DetailView):
     model = models.Client
@@ -165,10 +200,10 @@ class DeveloperAdminDetailView(PermissionRequiredMixin, UserMixin, DetailView):
     permission_required = "mws_main.view_admin_developer"
 
 
-class ServiceAdminDetailView(PermissionRequiredMixin, UserMixin, DetailView):
-    model = models.Service
+class ServiceAdminDetailView(ServiceDetailMixin, PermissionRequiredMixin, UserMixin, DetailView):
     template_name = "mws_main/service_admin_detail.html"
     permission_required = "mws_main.view_admin_service"
+    query_budget = 15
 
     def dispatch(self, *args, **kwargs):
         """
@@ -177,7 +212,7 @@ class ServiceAdminDetailView(PermissionRequiredMixin, UserMixin, DetailView):
         
         if (
                 self.is_developer
-                and self.get_object() not in self.user.assigned_services.all()
+                and not self.user.assigned_services.filter(pk=self.kwargs["pk"]).exists()
         ):
             return HttpResponseForbidden("You cannot access the administrative page of this service")
 
@@ -330,6 +365,11 @@ class UpdateServiceView(UserMixin, UpdateView):
         super().setup(request, *args, **kwargs)
         self.queryset = models.Service.objects.all()
         self.success_url = reverse("mws_main:service_admin_detail", args=[self.get_object().pk])
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        fragments.invalidate_service(self.object.pk)
+        return response
     
 
 class PackageMixin(UserMixin):
@@ -365,8 +405,8 @@ class DownloadServiceView(PackageMixin, View):
         self.service.new_acquirement(self.user, self.is_client)
 
         if self.is_client:
-            self.metadata.download_bandwidth
-            
+            stats.add_later(downloads=1, bandwidth=self.package.size)
+
         return redirect(package_url)
 
 
@@ -448,4 +488,6 @@ class UpdateStoreInfo(PermissionRequiredMixin, UserMixin, FormView):
                 self.metadata.appearance_metadata["footer"].append(col_dict)
 
         self.metadata.save(update_fields=["appearance_metadata"])
+        theme.invalidate_store_theme(get_current_db_name())
+        fragments.invalidate_store()
         return super().form_valid(form)
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class TenantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tenants'
+
+    def ready(self):
+        from tenants import bus, connections
+        connections.install()
+
+        bus.subscribe(
+            "tenant",
+            connections.invalidate_tenant,
+            connections.forget_tenants,
+        )
+        request_started.connect(bus.start_listener)
@@ -0,0 +1,124 @@
+"""
+PostgreSQL backend of the tenants' databases.
+
+It is Django's PostgreSQL backend using a `TenantConnectionPool`, so
+the connections are limited per database host and per process.
+
+On the shared database of the schema storage mode, the ``search_path``
+of the connection is set to the current tenant's schema before a
+cursor is created. Without a current tenant, such as while the test
+databases are set up or in management commands, it's set to the public
+schema.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from psycopg import sql
+
+from tenants.connections import get_tenant_databases
+from tenants.exceptions import TenantNotFoundError
+from tenants.middlewares import get_current_db_name
+from tenants.pools import TenantConnectionPool
+
+# Schema of the shared database used without a current tenant
+PUBLIC_SCHEMA = "public"
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    # Schema the connection's search_path is set to
+    tenant_schema = None
+
+    @property
+    def pool(self):
+        pool_options = self.settings_dict["OPTIONS"].get("pool")
+        if self.alias == NO_DB_ALIAS or not pool_options:
+            return None
+
+        if self.alias not in self._connection_pools:
+            if self.settings_dict.get("CONN_MAX_AGE", 0) != 0:
+                raise ImproperlyConfigured(
+                    "Pooling doesn't support persistent connections."
+                )
+
+            if pool_options is True:
+                pool_options = {}
+
+            connect_kwargs = self.get_connection_params()
+            # Django sets the autocommit mode later on.
+            connect_kwargs["autocommit"] = True
+            enable_checks = self.settings_dict["CONN_HEALTH_CHECKS"]
+            pool = TenantConnectionPool(
+                kwargs=connect_kwargs,
+                open=False,
+                configure=self._configure_connection,
+                check=(
+                    TenantConnectionPool.check_connection
+                    if enable_checks else None
+                ),
+                name=self.alias,
+                host=self.settings_dict["HOST"],
+                port=self.settings_dict["PORT"],
+                **pool_options,
+            )
+            self._connection_pools.setdefault(self.alias, pool)
+
+        return self._connection_pools[self.alias]
+
+    def _close(self):
+        # The pool of an evicted tenant may have been removed already,
+        # so the connection is returned to the pool it was taken from.
+        if (
+            self.connection is not None
+            and getattr(self.connection, "_pool", None) is not None
+        ):
+            with self.wrap_database_errors:
+                self.connection._pool.putconn(self.connection)
+                self.connection = None
+            return
+
+        return super()._close()
+
+    def connect(self):
+        super().connect()
+        self.tenant_schema = None
+
+    def _rollback(self):
+        # A rolled back SET is undone as well.
+        self.tenant_schema = None
+        return super()._rollback()
+
+    def _savepoint_rollback(self, sid):
+        self.tenant_schema = None
+        return super()._savepoint_rollback(sid)
+
+    def set_tenant_schema(self):
+        """Point the search_path to the current tenant's schema."""
+
+        subdomain = get_current_db_name()
+
+        if subdomain is None:
+            schema = PUBLIC_SCHEMA
+        else:
+            schema = get_tenant_databases().schema(subdomain)
+
+            if schema is None:
+                raise TenantNotFoundError(
+                    f"There isn't a tenant with the subdomain {subdomain}."
+                )
+
+        if schema != self.tenant_schema:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    sql.SQL("SET search_path TO {}").format(sql.Identifier(schema))
+                )
+            self.tenant_schema = schema
+
+    def create_cursor(self, name=None):
+
+        if self.alias == settings.TENANT_SCHEMAS_ALIAS:
+            self.set_tenant_schema()
+
+        return super().create_cursor(name)
@@ -0,0 +1,171 @@
+"""
+Invalidation of the caches kept by every process, through Postgres
+LISTEN/NOTIFY in the default database.
+
+A change that makes cached data stale is published with `publish`, as
+a kind of data and the key that changed. Every process has a listener
+thread, started with its first request or job, that calls the handlers
+subscribed to that kind with the key. If the listener loses its
+connection, the notifications sent meanwhile are lost, so the handlers'
+`reset` functions are called to drop everything they cache.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import psycopg
+import psycopg.sql as sql
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+# Kind -> list of (handler, reset)
+_subscribers = {}
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def origin():
+    """Identifier of this process in the messages it publishes."""
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+
+def subscribe(kind, handler, reset=None):
+    """
+    Call `handler` with the key of every change of `kind` published by
+    any process.
+
+    :param reset: Function called without arguments when changes may
+    have been missed.
+    """
+
+    _subscribers.setdefault(kind, []).append((handler, reset))
+
+
+def dispatch(kind, key):
+    for handler, reset in _subscribers.get(kind, ()):
+        try:
+            handler(key)
+        except Exception:
+            logger.exception(f"Couldn't invalidate the {kind} {key}")
+
+
+def reset_all():
+    for kind, subscribers in _subscribers.items():
+        for handler, reset in subscribers:
+            if reset is not None:
+                reset()
+
+
+def publish(kind, key):
+    """
+    Notify every process that the data `key` of `kind` has changed.
+
+    This process' handlers are called straight away. If the default
+    database is in a transaction, the other processes are notified when
+    it's committed.
+    """
+
+    dispatch(kind, key)
+
+    payload = json.dumps({"kind": kind, "key": key, "origin": origin()})
+
+    with connections[DEFAULT_DB_ALIAS].cursor() as cur:
+        cur.execute(
+            "SELECT pg_notify(%s, %s)",
+            [settings.INVALIDATION_CHANNEL, payload],
+        )
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Thread that listens to the invalidation channel with its own
+    connection to the default database.
+    """
+
+    def __init__(self):
+        super().__init__(name="mws-invalidation-listener", daemon=True)
+        self.origin = origin()
+        self.stopped = threading.Event()
+
+    def connect(self):
+        default = settings.DATABASES[DEFAULT_DB_ALIAS]
+
+        return psycopg.connect(
+            host=default["HOST"],
+            port=default["PORT"],
+            user=default["USER"],
+            password=default["PASSWORD"],
+            dbname=default["NAME"],
+            autocommit=True,
+        )
+
+    def handle(self, payload):
+
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.error(f"Invalid invalidation message: {payload}")
+            return
+
+        if message.get("origin") != self.origin:
+            dispatch(message["kind"], message["key"])
+
+    def run(self):
+
+        delay = 1
+        connected_before = False
+
+        while not self.stopped.is_set():
+
+            try:
+                with self.connect() as conn:
+                    conn.execute(
+                        sql.SQL("LISTEN {}")
+                        .format(sql.Identifier(settings.INVALIDATION_CHANNEL))
+                    )
+
+                    if connected_before:
+                        reset_all()
+
+                    connected_before = True
+                    delay = 1
+
+                    while not self.stopped.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            self.handle(notify.payload)
+
+            except psycopg.Error as e:
+                logger.warning(f"The invalidation listener was disconnected: {e}")
+                self.stopped.wait(delay)
+                delay = min(delay * 2, 60)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_listener(**kwargs):
+    """
+    Start the listener of this process, if it isn't running.
+
+    Forked processes start their own one.
+    """
+
+    global _listener
+
+    if not settings.INVALIDATION_LISTENER:
+        return
+
+    with _listener_lock:
+        if (
+            _listener is None
+            or not _listener.is_alive()
+            or _listener.origin != origin()
+        ):
+            _listener = InvalidationListener()
+            _listener.start()
@@ -0,0 +1,489 @@
+"""
+On-demand registry of the tenants' databases.
+
+The tenants' databases aren't listed in ``settings.DATABASES``. Their
+settings are added to Django's connection handler the first time a
+tenant's alias is requested, using the connection data stored in the
+``Tenant`` model, and they are evicted when there are more than
+``TENANT_DATABASES_MAX`` registered, the least recently used first.
+
+A tenant with a read replica also has the alias ``<subdomain>__replica``,
+whose settings are the tenant's with the replica's host and port (see
+tenants.replicas).
+
+With ``TENANT_STORAGE = "schema"`` every tenant is a schema of the
+database ``TENANT_SCHEMAS_ALIAS`` instead, and only the tenants'
+connection data is looked up and cached.
+"""
+
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.signals import request_started, request_finished
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from .utils import TENANTS_TABLE
+from .pools import close_pool
+
+logger = logging.getLogger(__name__)
+
+
+def tenant_db_settings(db_name, db_user, db_password, db_host, db_port):
+    """
+    Return the Django settings of a tenant's database.
+
+    Every key Django fills in when it reads ``settings.DATABASES`` is
+    given here, because the tenants' settings are added after that.
+    The connections are taken from a pool (see tenants.pools).
+    """
+
+    return {
+        "ENGINE": "tenants.backends.postgresql",
+        "NAME": db_name,
+        "USER": db_user,
+        "PASSWORD": db_password,
+        "HOST": db_host,
+        "PORT": db_port,
+        "TIME_ZONE": None,
+        "CONN_MAX_AGE": 0,
+        "AUTOCOMMIT": True,
+        "ATOMIC_REQUESTS": False,
+        "CONN_HEALTH_CHECKS": False,
+        "OPTIONS": {
+            "client_encoding": "UTF8",
+            "isolation_level": IsolationLevel.SERIALIZABLE,
+            "pool": {
+                "min_size": 0,
+                "max_size": settings.TENANT_POOL_MAX_SIZE,
+                "max_idle": settings.TENANT_POOL_MAX_IDLE,
+                "timeout": settings.TENANT_POOL_TIMEOUT,
+            },
+        },
+        "TEST": {
+            "CHARSET": None,
+            "COLLATION": None,
+            "MIGRATE": True,
+            "MIRROR": None,
+            "NAME": None,
+        },
+    }
+
+
+TENANT_DB_FIELDS = ("db_name", "db_user", "db_password", "db_host", "db_port")
+TENANT_RECORD_FIELDS = TENANT_DB_FIELDS + (
+    "read_only",
+    "replica_host",
+    "replica_port",
+    "server_timing",
+    "profile_requests",
+)
+
+# Suffix of the aliases of the tenants' read replicas
+REPLICA_SUFFIX = "__replica"
+
+
+def lookup_tenant_record(subdomain):
+    """
+    Fetch the database connection data of the tenant with the given
+    subdomain from the default database.
+
+    :return: The ``Tenant`` columns in `TENANT_RECORD_FIELDS` or None if
+    there isn't such tenant.
+    :rtype: dict or None
+    """
+
+    with connections[DEFAULT_DB_ALIAS].cursor() as cur:
+        cur.execute(
+            f"SELECT {', '.join(TENANT_RECORD_FIELDS)} "
+            f"FROM {TENANTS_TABLE} WHERE subdomain_prefix = %s",
+            [subdomain],
+        )
+        record = cur.fetchone()
+
+    if record is None:
+        return None
+
+    return dict(zip(TENANT_RECORD_FIELDS, record))
+
+
+def record_db_settings(record):
+    """Return the Django settings of the database of a tenant record."""
+    return tenant_db_settings(**{field: record[field] for field in TENANT_DB_FIELDS})
+
+
+def record_replica_settings(record, primary_alias):
+    """
+    Return the Django settings of the read replica of a tenant record.
+
+    In the tests, the replica is the primary database.
+    """
+
+    db_settings = record_db_settings(record)
+    db_settings["HOST"] = record["replica_host"]
+    db_settings["PORT"] = record["replica_port"]
+    db_settings["TEST"]["MIRROR"] = primary_alias
+    return db_settings
+
+
+class TenantDatabases(dict):
+    """
+    Database settings used by Django's connection handler.
+
+    Aliases that aren't in the mapping are looked up as tenants'
+    subdomains. The tenant aliases are kept in least recently used
+    order and, once there are more than `max_tenants`, the oldest is
+    removed and its connections closed.
+
+    When the tenants are stored in schemas of a shared database
+    (`schemas` is true), the tenants don't have aliases of their own:
+    all of them use `schemas_alias` and the tenant's schema is the
+    ``db_name`` of its ``Tenant`` row.
+    """
+
+    def __init__(self, databases, max_tenants, lookup_ttl,
+                 schemas=False, schemas_alias=None):
+        super().__init__(databases)
+        self.static_aliases = frozenset(databases)
+        self.max_tenants = max_tenants
+        self.lookup_ttl = lookup_ttl
+        self.schemas = schemas
+        self.schemas_alias = schemas_alias
+        self._lock = threading.RLock()
+        self._lru = OrderedDict()
+        # Subdomain -> (expiration time, tenant record or None)
+        self._lookups = {}
+        # Alias -> opened connection wrappers, in any thread
+        self._wrappers = defaultdict(weakref.WeakSet)
+        self._evicted = defaultdict(weakref.WeakSet)
+
+    def __contains__(self, alias):
+        if super().__contains__(alias):
+            return True
+        return self.load(alias) is not None
+
+    def __missing__(self, alias):
+        db_settings = self.load(alias)
+
+        if db_settings is None:
+            raise KeyError(alias)
+
+        return db_settings
+
+    def __iter__(self):
+        # Other threads may register tenants while Django iterates over
+        # the connections.
+        return iter(list(self.keys()))
+
+    def is_registered(self, alias):
+        """Return whether `alias` is registered, without looking it up."""
+        return super().__contains__(alias)
+
+    def is_tenant_alias(self, alias):
+        return alias not in self.static_aliases
+
+    def lookup(self, subdomain):
+        """Return the cached database connection data of a tenant."""
+
+        now = time.monotonic()
+        cached = self._lookups.get(subdomain)
+
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        record = lookup_tenant_record(subdomain)
+        self._lookups[subdomain] = (now + self.lookup_ttl, record)
+        return record
+
+    def remember(self, subdomain, record):
+        """
+        Cache the database connection data of a tenant whose ``Tenant``
+        row doesn't exist yet.
+        """
+        self._lookups[subdomain] = (time.monotonic() + self.lookup_ttl, record)
+
+    def forget(self, subdomain):
+        """Drop the cached database connection data of a tenant."""
+        self._lookups.pop(subdomain, None)
+
+    def forget_all(self):
+        """Drop the cached database connection data of every tenant."""
+        self._lookups.clear()
+
+    def load(self, alias):
+        """
+        Register the database of the tenant `alias` if it exists.
+
+        :return: The database settings or None if there isn't a tenant
+        with that subdomain.
+        """
+
+        if (
+            self.schemas
+            or not isinstance(alias, str)
+            or alias in self.static_aliases
+        ):
+            return None
+
+        subdomain = alias.removesuffix(REPLICA_SUFFIX)
+        record = self.lookup(subdomain)
+
+        if record is None:
+            return None
+
+        if subdomain == alias:
+            db_settings = record_db_settings(record)
+        elif record.get("replica_host"):
+            db_settings = record_replica_settings(record, subdomain)
+        else:
+            return None
+
+        with self._lock:
+            db_settings = self.setdefault(alias, db_settings)
+            self.touch(alias)
+
+        return db_settings
+
+    def ensure(self, subdomain):
+        """
+        Register the tenant's database if needed and mark it as the most
+        recently used.
+
+        :return: Whether there is a tenant with that subdomain.
+        :rtype: bool
+        """
+
+        if self.schemas:
+            return self.lookup(subdomain) is not None
+
+        if subdomain not in self:
+            return False
+
+        self.touch(subdomain)
+        return True
+
+    def alias(self, subdomain):
+        """Return the database alias where a tenant's data is stored."""
+
+        if subdomain is None:
+            return None
+
+        if self.schemas:
+            return self.schemas_alias
+
+        return subdomain
+
+    def replica_alias(self, subdomain):
+        """
+        Return the alias of the read replica of a tenant or None if it
+        doesn't have one.
+        """
+
+        if self.schemas or subdomain is None:
+            return None
+
+        record = self.lookup(subdomain)
+
+        if record is None or not record.get("replica_host"):
+            return None
+
+        return f"{subdomain}{REPLICA_SUFFIX}"
+
+    def is_read_only(self, subdomain):
+        """
+        Return whether the tenant's database is being moved, so it
+        doesn't accept writes.
+
+        A cached read-only record is looked up again, so the tenant
+        accepts writes as soon as the move finishes.
+        """
+
+        record = self.lookup(subdomain)
+
+        if record is None or not record.get("read_only"):
+            return False
+
+        self.forget(subdomain)
+        record = self.lookup(subdomain)
+        return record is not None and record["read_only"]
+
+    def invalidate(self, subdomain):
+        """
+        Drop the cached connection data and the settings of a tenant's
+        database, so they are looked up again on the next use.
+        """
+
+        self.forget(subdomain)
+
+        if self.schemas:
+            return
+
+        for alias in (subdomain, f"{subdomain}{REPLICA_SUFFIX}"):
+            if self.is_registered(alias):
+                self.evict(alias)
+
+    def schema(self, subdomain):
+        """
+        Return the schema of a tenant in the shared database or None if
+        there isn't such tenant.
+        """
+
+        record = self.lookup(subdomain)
+        return record["db_name"] if record is not None else None
+
+    def register(self, alias, db_settings):
+        """Add the settings of a tenant's database explicitly."""
+
+        with self._lock:
+            self[alias] = db_settings
+            self._lookups.pop(alias, None)
+            self.touch(alias)
+
+    def touch(self, alias):
+        """Mark a tenant alias as the most recently used one."""
+
+        if not self.is_tenant_alias(alias):
+            return
+
+        with self._lock:
+            self._lru[alias] = None
+            self._lru.move_to_end(alias)
+
+            while len(self._lru) > self.max_tenants:
+                oldest = next(iter(self._lru))
+                logger.debug("Evicting the tenant database %s", oldest)
+                self.evict(oldest)
+
+    def evict(self, alias):
+        """
+        Remove the settings of a tenant's database and close its
+        connections.
+
+        Connections opened by other threads are closed by themselves when
+        they start or finish their next request.
+        """
+
+        if not self.is_tenant_alias(alias):
+            raise ValueError(
+                f"The database {alias} is not a tenant's database."
+            )
+
+        with self._lock:
+            self._lru.pop(alias, None)
+            self._lookups.pop(alias, None)
+            self.pop(alias, None)
+            self._evicted[alias].update(self._wrappers.pop(alias, ()))
+
+        self.close_evicted_connections()
+        close_pool(alias)
+
+        wrapper = getattr(connections._connections, alias, None)
+        if wrapper is not None and wrapper.connection is None:
+            del connections[alias]
+
+    def connection_created(self, connection):
+        if self.is_tenant_alias(connection.alias):
+            self._wrappers[connection.alias].add(connection)
+
+    def close_evicted_connections(self):
+        """Close this thread's connections to evicted tenant databases."""
+
+        thread_ident = threading.get_ident()
+
+        with self._lock:
+            evicted = [
+                (alias, wrapper)
+                for alias, wrappers in self._evicted.items()
+                for wrapper in wrappers
+                if wrapper._thread_ident == thread_ident
+            ]
+
+            for alias, wrapper in evicted:
+                self._evicted[alias].discard(wrapper)
+
+                if not self._evicted[alias]:
+                    del self._evicted[alias]
+
+        for alias, wrapper in evicted:
+            wrapper.close()
+
+            # Don't go through connections[alias], it would register the
+            # tenant again.
+            if getattr(connections._connections, alias, None) is wrapper:
+                del connections[alias]
+
+
+def get_tenant_databases():
+    """Return the registry of databases installed in the connection handler."""
+
+    databases = connections.settings
+
+    if not isinstance(databases, TenantDatabases):
+        raise RuntimeError(
+            "The tenants' database registry isn't installed. Check that "
+            "'tenants.apps.TenantsConfig' is in INSTALLED_APPS."
+        )
+
+    return databases
+
+
+def get_tenant_alias(subdomain):
+    """Return the database alias where a tenant's data is stored."""
+    return get_tenant_databases().alias(subdomain)
+
+
+def get_tenant_record(subdomain):
+    """
+    Return the cached data of the tenant with that subdomain, or None if
+    there isn't such tenant.
+    """
+
+    if subdomain is None:
+        return None
+
+    return get_tenant_databases().lookup(subdomain)
+
+
+def is_tenant(subdomain):
+    """Return whether there is a tenant with that subdomain."""
+    return get_tenant_record(subdomain) is not None
+
+
+def invalidate_tenant(subdomain):
+    get_tenant_databases().invalidate(subdomain)
+
+
+def forget_tenants():
+    get_tenant_databases().forget_all()
+
+
+def _connection_created(sender, connection, **kwargs):
+    get_tenant_databases().connection_created(connection)
+
+
+def _close_evicted_connections(**kwargs):
+    get_tenant_databases().close_evicted_connections()
+
+
+def install():
+    """Replace the settings of Django's connection handler by the registry."""
+
+    if isinstance(connections.settings, TenantDatabases):
+        return
+
+    connections.settings = TenantDatabases(
+        connections.settings,
+        max_tenants=settings.TENANT_DATABASES_MAX,
+        lookup_ttl=settings.TENANT_LOOKUP_TTL,
+        schemas=settings.TENANT_STORAGE == "schema",
+        schemas_alias=settings.TENANT_SCHEMAS_ALIAS,
+    )
+
+    connection_created.connect(_connection_created)
+    request_started.connect(_close_evicted_connections)
+    request_finished.connect(_close_evicted_connections)
@@ -1,31 +1,55 @@
+import functools
+import hashlib
 import logging
+import os
+import subprocess
+import tempfile
+import uuid
 
 import psycopg.sql as sql
 import psycopg
 
+from django.apps import apps
 from django.conf import settings
-from django.db import connections
+from django.db import connections, transaction, DatabaseError
+from django.db.transaction import TransactionManagementError
 from django.core.management import call_command
-
-from tenants.middlewares import set_db_for_router
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+
+from tenants.middlewares import set_db_for_router, using_tenant
+from tenants.connections import (
+    TENANT_DB_FIELDS,
+    get_tenant_databases,
+    get_tenant_alias,
+    tenant_db_settings,
+)
+import tenants.bus as bus
 import tenants.exceptions as exceptions
+import tenants.placement as placement
+
+logger = logging.getLogger(__name__)
 
 def save_cached_db_settings(db_settings, id):
+    """
+    Register the settings of a new tenant's database in the
+    connection handler.
 
-    if id in settings.DATABASES:
-        raise CachingDatabaseError(
-            f"The identifier {id} of the database is already in the"
-            "settings DATABASE property."
-        )
+    :param db_settings: Django settings of the database.
+    :type db_settings: dict
+    :param id: Identifier of the database.
+    :type id: str
+    """
+
+    databases = get_tenant_databases()
 
-    if id in connections.databases:
-        raise CachingDatabaseError(
+    if databases.is_registered(id):
+        raise exceptions.CachingDatabaseError(
             f"The identifier {id} of the database is already in the "
             "connections databases property."
         )
-    
-    settings.DATABASES[id] = db_settings
-    connections.databases[id] = db_settings
+
+    databases.register(id, db_settings)
     
 
 def revert_cached_db_settings(id):
@@ -44,11 +68,7 @@ def revert_cached_db_settings(id):
             "of the default database."
         )
 
-    if id in connections.databases:
-        del connections.databases[id]
-
-    if id in settings.DATABASES[id]:
-        del settings.DATABASES[id]
+    get_tenant_databases().evict(id)
 
 def revert_creation_of_database(db_name, db_settings):
     """
@@ -63,19 +83,12 @@ def revert_creation_of_database(db_name, db_settings):
     :type db_name: str
     """
 
-    if db_name == settings.DATABASES['default']:
+    if db_name == settings.DATABASES['default']['NAME']:
         raise ValueError(
             "Default database attempted to be removed!"
         )
 
-    conn = psycopg.connect(
-        host=db_settings["HOST"],
-        port=db_settings["PORT"],
-        user=db_settings["USER"],
-        password=db_settings["PASSWORD"],
-        dbname=settings.DATABASES["default"]["NAME"],
-        autocommit=True
-    )
+    conn = placement.find_server(db_settings["HOST"], db_settings["PORT"]).connect()
 
     try:
         with conn:
@@ -83,7 +96,7 @@ def revert_creation_of_database(db_name, db_settings):
             with conn.cursor() as cur:
                 cur.execute(
                     sql.SQL("DROP DATABASE {}")
-                    .format(sql.Identifier(tenant_db))
+                    .format(sql.Identifier(db_name))
                 )
     except psycopg.OperationalError as e:
         raise e
@@ -91,6 +104,59 @@ def revert_creation_of_database(db_name, db_settings):
         conn.close()    
         
 
+def revert_creation_of_schema(schema):
+    """
+    Drop a tenant's schema of the shared database in case of error
+    during the process of registration.
+
+    :param schema: Name of tenant's schema.
+    :type schema: str
+    """
+
+    shared_settings = settings.DATABASES[settings.TENANT_SCHEMAS_ALIAS]
+    conn = psycopg.connect(
+        host=shared_settings["HOST"],
+        port=shared_settings["PORT"],
+        user=shared_settings["USER"],
+        password=shared_settings["PASSWORD"],
+        dbname=shared_settings["NAME"],
+        autocommit=True
+    )
+
+    try:
+        with conn:
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL("DROP SCHEMA {} CASCADE")
+                    .format(sql.Identifier(schema))
+                )
+    finally:
+        conn.close()
+
+
+def revert_tenant_storage(subdomain, db_record):
+    """
+    Drop the database, or schema, of a tenant whose registration
+    couldn't be completed.
+
+    :param subdomain: Subdomain of the tenant.
+    :type subdomain: str
+    :param db_record: Connection data returned by `create_db`.
+    :type db_record: dict
+    """
+
+    if settings.TENANT_STORAGE == "schema":
+        get_tenant_databases().forget(subdomain)
+        revert_creation_of_schema(db_record["db_name"])
+    else:
+        revert_cached_db_settings(subdomain)
+        revert_creation_of_database(
+            db_record["db_name"],
+            tenant_db_settings(**db_record),
+        )
+
+
 def migrate_new_db(new_db_name, id):
     """
     Migrate the platform model to the newly created tenant's database.
@@ -111,31 +177,43 @@ def load_permissions(id):
                  settings=settings)
 
 
-def generate_tenant_db(name):
-    return f"mws_{name}_db"
+# Alias used while the template database is migrated
+TEMPLATE_ALIAS = "tenant_template"
+# Key of the advisory lock taken while the template is built
+TEMPLATE_LOCK_ID = 72616901
 
-def create_db(subdomain):
 
-    tenant_db = generate_tenant_db(subdomain)
-    new_db_settings = {
-        "NAME": tenant_db,
-        "ENGINE": "django.db.backends.postgresql",
-        "USER": settings.DATABASES["default"]["USER"],
-        "PASSWORD": settings.DATABASES["default"]["PASSWORD"],
-        "HOST": settings.DATABASES["default"]["HOST"],
-        "PORT": settings.DATABASES["default"]["PORT"],
-        "TIME_ZONE": None,
-        "CONN_MAX_AGE": 0,
-        "AUTOCOMMIT": True,
-        "ATOMIC_REQUESTS": False,
-        "CONN_HEALTH_CHECKS": False,
-        "OPTIONS": {},
-        "DISABLE_SERVER_SIDE_CURSORS": False,
-        "TEST":  {},
-    }
+@functools.cache
+def template_fingerprint():
+    """
+    Return a digest of the migrations and the permissions fixture
+    applied to the template database.
 
-    # Create the tenant database
-    conn = psycopg.connect(
+    If it changes, the template has to be built again.
+    """
+
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    digest = hashlib.sha256()
+
+    for app_label, name in sorted(loader.graph.leaf_nodes()):
+        digest.update(f"{app_label}.{name};".encode())
+
+    fixture_path = os.path.join(
+        apps.get_app_config("mws_main").path,
+        "fixtures",
+        settings.PERMISSIONS_FIXTURE,
+    )
+
+    with open(fixture_path, "rb") as fixture:
+        digest.update(fixture.read())
+
+    return digest.hexdigest()
+
+
+def connect_to_default_server():
+    """Open an autocommit connection to the default database."""
+
+    return psycopg.connect(
         host=settings.DATABASES["default"]["HOST"],
         port=settings.DATABASES["default"]["PORT"],
         user=settings.DATABASES["default"]["USER"],
@@ -144,21 +222,519 @@ def create_db(subdomain):
         autocommit=True
     )
 
+
+def read_template_fingerprint(cur):
+    """
+    Return the fingerprint stored as comment of the template database
+    or None if it doesn't exist.
+    """
+
+    cur.execute(
+        "SELECT shobj_description(oid, 'pg_database') "
+        "FROM pg_database WHERE datname = %s",
+        [settings.TENANT_TEMPLATE_DB],
+    )
+    record = cur.fetchone()
+    return record[0] if record is not None else None
+
+
+def drop_template_db(cur):
+    """Drop the template database if it exists."""
+
+    template = sql.Identifier(settings.TENANT_TEMPLATE_DB)
+    cur.execute(
+        "SELECT 1 FROM pg_database WHERE datname = %s",
+        [settings.TENANT_TEMPLATE_DB],
+    )
+
+    if cur.fetchone() is not None:
+        cur.execute(
+            sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE false")
+            .format(template)
+        )
+        cur.execute(sql.SQL("DROP DATABASE {}").format(template))
+
+
+def build_template_db(force=False, server=None):
+    """
+    Create the template database from which the tenants' databases are
+    cloned, with the platform models migrated and the permissions
+    loaded.
+
+    The template is only built again if its fingerprint doesn't match
+    the current migrations, unless `force` is true.
+
+    :param server: Database host where the template is built. Every
+    host has its own, because a database can only be cloned in its
+    server. The default database's server if it isn't given.
+    :type server: DatabaseHost
+    """
+
+    server = server or placement.default_server()
+    template = settings.TENANT_TEMPLATE_DB
+    alias = f"{TEMPLATE_ALIAS}_{server.name}"
+    fingerprint = template_fingerprint()
+    databases = get_tenant_databases()
+    conn = server.connect()
+
+    try:
+        with conn.cursor() as cur:
+            # Other processes may be building it at the same time
+            cur.execute("SELECT pg_advisory_lock(%s)", [TEMPLATE_LOCK_ID])
+
+            try:
+                if not force and read_template_fingerprint(cur) == fingerprint:
+                    return
+
+                logger.info("Building the tenants' template database in %s", server)
+                drop_template_db(cur)
+                cur.execute(
+                    sql.SQL("CREATE DATABASE {} WITH ENCODING 'UTF8'")
+                    .format(sql.Identifier(template))
+                )
+
+                databases.register(
+                    alias,
+                    tenant_db_settings(**server.to_record(template)),
+                )
+
+                try:
+                    with using_tenant(alias):
+                        migrate_new_db(template, alias)
+                        load_permissions(alias)
+                finally:
+                    # A database can't be cloned while there are
+                    # connections to it.
+                    databases.evict(alias)
+
+                cur.execute(
+                    sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE true")
+                    .format(sql.Identifier(template))
+                )
+                cur.execute(
+                    sql.SQL("COMMENT ON DATABASE {} IS {}")
+                    .format(sql.Identifier(template), sql.Literal(fingerprint))
+                )
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", [TEMPLATE_LOCK_ID])
+    finally:
+        conn.close()
+
+
+# Server name -> fingerprint of its template checked by this process
+_templates_ready = {}
+
+def ensure_template_db(server=None):
+    """
+    Build the template database of a server if it doesn't exist or its
+    migrations are outdated. It's only checked once per process.
+    """
+
+    server = server or placement.default_server()
+    fingerprint = template_fingerprint()
+
+    if _templates_ready.get(server.name) != fingerprint:
+        build_template_db(server=server)
+        _templates_ready[server.name] = fingerprint
+
+
+# Key of the advisory lock taken while the spare databases are filled
+SPARES_LOCK_ID = 72616902
+
+def generate_spare_db():
+    return f"mws_spare_{uuid.uuid4().hex[:16]}"
+
+def create_spare_db(fingerprint, server=None):
+    """
+    Create a migrated database, or schema, that isn't assigned to any
+    tenant and add it to the spare ones.
+
+    :param server: Database host where the database is created. The
+    default database's server if it isn't given.
+    :type server: DatabaseHost
+    """
+
+    SpareDatabase = apps.get_model("tenants", "SpareDatabase")
+    name = generate_spare_db()
+
+    if settings.TENANT_STORAGE == "schema":
+
+        try:
+            record = provision_schema(name, name)
+        except (psycopg.Error, DatabaseError):
+            revert_creation_of_schema(name)
+            raise
+        finally:
+            get_tenant_databases().forget(name)
+
+    else:
+        server = server or placement.default_server()
+        ensure_template_db(server)
+        conn = server.connect()
+
+        try:
+            with conn:
+
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL("CREATE DATABASE {} WITH TEMPLATE {}")
+                        .format(
+                            sql.Identifier(name),
+                            sql.Identifier(settings.TENANT_TEMPLATE_DB),
+                        )
+                    )
+        finally:
+            conn.close()
+
+        record = server.to_record(name)
+
+    return SpareDatabase.objects.create(fingerprint=fingerprint, **record)
+
+def drop_spare_db(spare):
+    """Drop the database, or schema, of a spare database."""
+
+    if settings.TENANT_STORAGE == "schema":
+        revert_creation_of_schema(spare.db_name)
+    else:
+        revert_creation_of_database(
+            spare.db_name,
+            tenant_db_settings(**spare.to_record()),
+        )
+
+def claim_spare_db(fingerprint=None, server=None):
+    """
+    Take one of the spare databases that are up to date with the
+    migrations, so no other registration can take it.
+
+    It must be called in a transaction of the default database, the
+    one that creates the tenant's row. The spare database's row is
+    locked and deleted in it, so the database goes back to the spare
+    ones if the transaction is rolled back. A failure to serialize with
+    other claims dooms that transaction, so it's the caller who retries
+    the whole of it.
+
+    :param server: Database host of the spare database. Any if it isn't
+    given.
+    :type server: DatabaseHost
+
+    :return: The claimed database, which is no longer in the spare
+    ones, or None if there isn't any.
+    :rtype: SpareDatabase or None
+    """
+
+    SpareDatabase = apps.get_model("tenants", "SpareDatabase")
+
+    if not transaction.get_connection("default").in_atomic_block:
+        raise TransactionManagementError(
+            "A spare database must be claimed in the transaction that "
+            "creates its tenant."
+        )
+
+    if fingerprint is None:
+        fingerprint = template_fingerprint()
+
+    spares = SpareDatabase.objects.filter(fingerprint=fingerprint)
+
+    if server is not None:
+        spares = spares.filter(db_host=server.host, db_port=server.port)
+
+    spare = spares.select_for_update(skip_locked=True).order_by("pk").first()
+
+    if spare is not None:
+        SpareDatabase.objects.filter(pk=spare.pk).delete()
+
+    return spare
+
+
+def bind_spare_db(spare, subdomain):
+    """
+    Assign a claimed spare database to a new tenant.
+
+    The database keeps its name, which is stored in the tenant's row.
+    """
+
+    record = spare.to_record()
+
+    if settings.TENANT_STORAGE == "schema":
+        get_tenant_databases().remember(subdomain, record)
+    else:
+        save_cached_db_settings(tenant_db_settings(**record), subdomain)
+
+    set_db_for_router(subdomain)
+    return record
+
+def release_spare_db(subdomain):
+    """
+    Unassign a spare database from a tenant whose registration failed,
+    once the claim has been rolled back.
+    """
+
+    set_db_for_router()
+
+    if settings.TENANT_STORAGE == "schema":
+        get_tenant_databases().forget(subdomain)
+    else:
+        revert_cached_db_settings(subdomain)
+
+def fill_spare_dbs(watermark):
+    """
+    Create spare databases until there are `watermark` of them up to
+    date with the migrations in every database host where tenants can
+    be placed, dropping the outdated ones.
+
+    Nothing is done if other process is filling them.
+
+    :return: Number of spare databases created.
+    :rtype: int
+    """
+
+    SpareDatabase = apps.get_model("tenants", "SpareDatabase")
+    fingerprint = template_fingerprint()
+    created = 0
+    conn = connect_to_default_server()
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", [SPARES_LOCK_ID])
+
+            if not cur.fetchone()[0]:
+                return created
+
+            try:
+                while True:
+                    # The row is deleted before the database is dropped,
+                    # so no registration can claim it meanwhile.
+                    with transaction.atomic(using="default"):
+                        spare = (
+                            SpareDatabase.objects
+                            .exclude(fingerprint=fingerprint)
+                            .select_for_update(skip_locked=True)
+                            .order_by("pk")
+                            .first()
+                        )
+
+                        if spare is None:
+                            break
+
+                        SpareDatabase.objects.filter(pk=spare.pk).delete()
+
+                    logger.info("Dropping the outdated spare database %s", spare)
+                    drop_spare_db(spare)
+
+                # In schema mode, the spare schemas are all in the
+                # shared database.
+                if settings.TENANT_STORAGE == "schema":
+                    servers = [None]
+                else:
+                    servers = placement.get_servers()
+
+                for server in servers:
+                    available = SpareDatabase.objects.filter(fingerprint=fingerprint)
+
+                    if server is not None:
+                        available = available.filter(
+                            db_host=server.host,
+                            db_port=server.port,
+                        )
+
+                    for _ in range(watermark - available.count()):
+                        create_spare_db(fingerprint, server)
+                        created += 1
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", [SPARES_LOCK_ID])
+    finally:
+        conn.close()
+
+    return created
+
+def migrate_tenant(subdomain):
+    """
+    Migrate the platform model to the database or schema of an
+    existing tenant.
+    """
+
+    alias = get_tenant_alias(subdomain)
+
+    with using_tenant(subdomain):
+        migrate_new_db(alias, alias)
+
+
+def pending_migrations(subdomain):
+    """
+    Return the migrations that haven't been applied to the database or
+    schema of a tenant, in the order they would be applied.
+    """
+
+    alias = get_tenant_alias(subdomain)
+
+    with using_tenant(subdomain):
+        executor = MigrationExecutor(connections[alias])
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+    return [migration for migration, backwards in plan]
+
+
+def generate_tenant_db(name):
+    return f"mws_{name}_db"
+
+def generate_tenant_schema(name):
+    return f"mws_{name}"
+
+def provision_schema(schema, subdomain):
+    """
+    Create the schema `schema` in the shared database and migrate it as
+    the data of the tenant `subdomain`.
+
+    :return: Connection data of the schema as stored in a Tenant.
+    :rtype: dict
+    """
+
+    alias = settings.TENANT_SCHEMAS_ALIAS
+    shared_settings = settings.DATABASES[alias]
+    record = {
+        "db_host": shared_settings["HOST"],
+        "db_port": shared_settings["PORT"],
+        "db_name": schema,
+        "db_user": shared_settings["USER"],
+        "db_password": shared_settings["PASSWORD"],
+    }
+
+    conn = psycopg.connect(
+        host=shared_settings["HOST"],
+        port=shared_settings["PORT"],
+        user=shared_settings["USER"],
+        password=shared_settings["PASSWORD"],
+        dbname=shared_settings["NAME"],
+        autocommit=True
+    )
+
     try:
         with conn:
 
             with conn.cursor() as cur:
                 cur.execute(
-                    sql.SQL("CREATE DATABASE {} WITH ENCODING 'UTF8'")
-                    .format(sql.Identifier(tenant_db))
+                    sql.SQL("CREATE SCHEMA {}")
+                    .format(sql.Identifier(schema))
+                )
+    finally:
+        conn.close()
+
+    # The Tenant row is created afterwards, so the schema of the
+    # new tenant can't be looked up yet.
+    get_tenant_databases().remember(subdomain, record)
+
+    with using_tenant(subdomain):
+        migrate_new_db(schema, alias)
+        load_permissions(alias)
+
+    return record
+
+def create_schema(subdomain):
+    """
+    Create and migrate the schema of a new tenant in the shared
+    database.
+    """
+
+    schema = generate_tenant_schema(subdomain)
+
+    try:
+        tenant_record = provision_schema(schema, subdomain)
+
+    except (psycopg.Error, DatabaseError):
+
+        get_tenant_databases().forget(subdomain)
+
+        try:
+            revert_creation_of_schema(schema)
+        except psycopg.Error as e:
+            logger.critical(f"Couldn't drop an invalid schema: {e}")
+
+        raise exceptions.TenantRegistrationError(
+            "There has been an internal error trying"
+            "to register your data. Please, try again"
+            "later."
+        )
+
+    set_db_for_router(subdomain)
+    return tenant_record
+
+def create_db(subdomain, db_host=None):
+    """
+    Create the database, or schema, of a new tenant.
+
+    In database mode, it's created in the server chosen by the
+    placement policy or in `db_host`, if it's given. In schema mode, the
+    tenant is always placed in the shared database.
+
+    A spare database is taken if there's one, so it must be called in
+    the transaction of the default database that creates the tenant
+    (see `claim_spare_db`).
+
+    :param db_host: Name of the database host.
+    :type db_host: str
+    :return: The connection data of the database and the spare database
+    claimed, or None if it has been created.
+    :rtype: tuple
+    """
+
+    if settings.TENANT_STORAGE == "schema":
+        server = None
+    else:
+        try:
+            server = placement.place_tenant(db_host)
+        except (exceptions.PlacementError, DatabaseError) as e:
+            logger.critical(f"Couldn't place the tenant {subdomain}: {e}")
+            raise exceptions.TenantRegistrationError(
+                "There has been an internal error trying"
+                "to register your data. Please, try again"
+                "later."
+            )
+
+    try:
+        spare = claim_spare_db(server=server)
+    except DatabaseError as e:
+        logger.error(f"Couldn't claim a spare database: {e}")
+        spare = None
+
+    if spare is not None:
+        return bind_spare_db(spare, subdomain), spare
+
+    if settings.TENANT_STORAGE == "schema":
+        return create_schema(subdomain), None
+
+    tenant_db = generate_tenant_db(subdomain)
+    new_db_settings = tenant_db_settings(**server.to_record(tenant_db))
+
+    try:
+        ensure_template_db(server)
+    except (psycopg.Error, DatabaseError) as e:
+        logger.critical(f"Couldn't build the template database: {e}")
+        raise exceptions.TenantRegistrationError(
+            "There has been an internal error trying"
+            "to register your data. Please, try again"
+            "later."
+        )
+
+    # Create the tenant database as a copy of the template, which is
+    # already migrated and has the permissions loaded.
+    conn = server.connect()
+
+    try:
+        with conn:
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL("CREATE DATABASE {} WITH TEMPLATE {}")
+                    .format(
+                        sql.Identifier(tenant_db),
+                        sql.Identifier(settings.TENANT_TEMPLATE_DB),
+                    )
                 )
 
         save_cached_db_settings(new_db_settings, subdomain)
         set_db_for_router(subdomain)
-        migrate_new_db(tenant_db, subdomain)
-        load_permissions(subdomain)
 
-    except psycopg.Error as e:
+    except (psycopg.Error, DatabaseError):
 
         set_db_for_router()
         revert_cached_db_settings(subdomain)
@@ -169,7 +745,7 @@ def create_db(subdomain):
         except ValueError as e:
             logger.error(str(e))
         except psycopg.OperationalError as e:
-            logging.critical(f"Couldn't drop an invalid database: {e}")
+            logger.critical(f"Couldn't drop an invalid database: {e}")
 
         raise exceptions.TenantRegistrationError(
             "There has been an internal error trying"
@@ -186,4 +762,207 @@ def create_db(subdomain):
         "db_name": new_db_settings["NAME"],
         "db_user": new_db_settings["USER"],
         "db_password": new_db_settings["PASSWORD"]
-    }
+    }, None
+
+
+def terminate_connections(cur, db_name):
+    """Close the other sessions connected to a database."""
+
+    cur.execute(
+        "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+        "WHERE datname = %s AND pid <> pg_backend_pid()",
+        [db_name],
+    )
+
+def set_database_read_only(server, db_name, read_only):
+    """
+    Make the transactions of a database read-only, or writable again.
+
+    The open sessions are closed, so the connections of every worker
+    are opened again with the new setting.
+    """
+
+    conn = server.connect()
+
+    try:
+        with conn.cursor() as cur:
+            if read_only:
+                cur.execute(
+                    sql.SQL("ALTER DATABASE {} SET default_transaction_read_only = on")
+                    .format(sql.Identifier(db_name))
+                )
+            else:
+                cur.execute(
+                    sql.SQL("ALTER DATABASE {} RESET default_transaction_read_only")
+                    .format(sql.Identifier(db_name))
+                )
+
+            terminate_connections(cur, db_name)
+    finally:
+        conn.close()
+
+def pg_command_args(record):
+    """
+    Return the connection arguments and environment of the Postgres
+    client programs for a database.
+    """
+
+    args = ["--host", record["db_host"], "--username", record["db_user"]]
+
+    if record["db_port"]:
+        args += ["--port", str(record["db_port"])]
+
+    env = {**os.environ, "PGPASSWORD": record["db_password"]}
+    return args, env
+
+def copy_database(source_record, target, db_name):
+    """
+    Copy a database to other host, streaming the output of pg_dump to
+    pg_restore.
+
+    :param source_record: Connection data of the database to copy.
+    :type source_record: dict
+    :param target: Host of the empty database `db_name` where the copy
+    is restored.
+    :type target: DatabaseHost
+    :raises TenantRelocationError: if the copy fails.
+    """
+
+    dump_args, dump_env = pg_command_args(source_record)
+    restore_args, restore_env = pg_command_args(target.to_record(db_name))
+
+    # The errors of pg_dump aren't read until pg_restore ends, so they
+    # go to a file: pg_dump would block on a full pipe.
+    with tempfile.TemporaryFile() as dump_stderr:
+        dump = subprocess.Popen(
+            ["pg_dump", "--format=custom", "--no-owner", "--no-acl",
+             *dump_args, source_record["db_name"]],
+            stdout=subprocess.PIPE,
+            stderr=dump_stderr,
+            env=dump_env,
+        )
+
+        try:
+            restore = subprocess.run(
+                ["pg_restore", "--no-owner", "--no-acl", "--exit-on-error",
+                 *restore_args, "--dbname", db_name],
+                stdin=dump.stdout,
+                stderr=subprocess.PIPE,
+                env=restore_env,
+            )
+        finally:
+            dump.stdout.close()
+            dump.wait()
+
+        dump_stderr.seek(0)
+        dump_errors = dump_stderr.read()
+
+    if dump.returncode or restore.returncode:
+        raise exceptions.TenantRelocationError(
+            "Couldn't copy the database: "
+            + (dump_errors or restore.stderr).decode(errors="replace")
+        )
+
+def close_database(server, db_name, drop=False):
+    """Reject the connections to a database that is no longer used."""
+
+    conn = server.connect()
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("ALTER DATABASE {} WITH ALLOW_CONNECTIONS false")
+                .format(sql.Identifier(db_name))
+            )
+            terminate_connections(cur, db_name)
+
+            if drop:
+                cur.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(db_name)))
+    finally:
+        conn.close()
+
+def move_tenant(tenant, target, drop_source=False):
+    """
+    Move the database of a tenant to other host.
+
+    The tenant is read-only while its database is copied. Its row is
+    then pointed to the copy and the workers are notified (see
+    tenants.bus). The old database stops accepting connections, so the
+    workers that missed the notification look the settings up again
+    (see TenantMiddleware.process_exception).
+
+    :param tenant: Tenant to move.
+    :type tenant: Tenant
+    :param target: Host where the database is moved.
+    :type target: DatabaseHost
+    :param drop_source: Drop the old database once moved.
+    :return: Connection data of the new database.
+    :rtype: dict
+    :raises TenantRelocationError: if the database can't be moved.
+    """
+
+    if settings.TENANT_STORAGE == "schema":
+        raise exceptions.TenantRelocationError(
+            "The tenants stored in schemas of the shared database can't "
+            "be moved."
+        )
+
+    Tenant = type(tenant)
+    source_record = {field: getattr(tenant, field) for field in TENANT_DB_FIELDS}
+    source = placement.find_server(tenant.db_host, tenant.db_port)
+    db_name = tenant.db_name
+
+    if target.host == tenant.db_host and str(target.port) == str(tenant.db_port):
+        raise exceptions.TenantRelocationError(
+            f"The database of {tenant.subdomain_prefix} is already in {target}."
+        )
+
+    conn = target.connect()
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("CREATE DATABASE {} WITH ENCODING 'UTF8' TEMPLATE template0")
+                .format(sql.Identifier(db_name))
+            )
+    except psycopg.Error as e:
+        raise exceptions.TenantRelocationError(
+            f"Couldn't create the database {db_name} in {target}: {e}"
+        ) from e
+    finally:
+        conn.close()
+
+    Tenant.objects.filter(pk=tenant.pk).update(read_only=True)
+    bus.publish("tenant", tenant.subdomain_prefix)
+    set_database_read_only(source, db_name, True)
+
+    try:
+        copy_database(source_record, target, db_name)
+
+    except (exceptions.TenantRelocationError, psycopg.Error, OSError) as e:
+
+        try:
+            close_database(target, db_name, drop=True)
+        except psycopg.Error as drop_error:
+            logger.error(f"Couldn't drop the copy of {db_name}: {drop_error}")
+
+        set_database_read_only(source, db_name, False)
+        Tenant.objects.filter(pk=tenant.pk).update(read_only=False)
+        bus.publish("tenant", tenant.subdomain_prefix)
+
+        if isinstance(e, exceptions.TenantRelocationError):
+            raise
+        raise exceptions.TenantRelocationError(str(e)) from e
+
+    new_record = target.to_record(db_name)
+    # The replica of the old database doesn't follow the new one.
+    Tenant.objects.filter(pk=tenant.pk).update(
+        read_only=False,
+        replica_host="",
+        replica_port="",
+        **new_record,
+    )
+    bus.publish("tenant", tenant.subdomain_prefix)
+
+    close_database(source, db_name, drop=drop_source)
+    return new_record
@@ -10,3 +10,24 @@ class CachingDatabaseError(Exception):
 
 class TenantRegistrationError(Exception):
     pass
+
+
+class TenantNotFoundError(Exception):
+    """
+    The current tenant doesn't exist.
+    """
+    pass
+
+
+class PlacementError(Exception):
+    """
+    There isn't a database host where a tenant can be placed.
+    """
+    pass
+
+
+class TenantRelocationError(Exception):
+    """
+    The database of a tenant couldn't be moved to other host.
+    """
+    pass
@@ -0,0 +1,269 @@
+"""
+Background jobs stored in the default database.
+
+A task is a function registered with the `task` decorator in the
+``tasks`` module of an application. Enqueuing it stores a ``Job`` row
+with its arguments and the subdomain of the current tenant, and the
+workers started by the command run_workers claim the jobs with
+``SELECT ... FOR UPDATE SKIP LOCKED`` and run them with the tenant's
+database routed, the jobs with the highest priority first.
+
+A job that raises an exception is retried with an exponential backoff
+until it reaches the task's maximum number of attempts.
+
+While a job runs, its worker updates it every JOBS_HEARTBEAT_INTERVAL
+seconds. A job that hasn't been updated for JOBS_STALE_AFTER seconds is
+taken to be abandoned by a dead worker and is claimed again.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction, close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+import tenants.bus as bus
+from tenants.connections import get_tenant_databases
+from tenants.middlewares import get_current_db_name, using_tenant
+
+logger = logging.getLogger(__name__)
+
+# Task name -> Task
+TASKS = {}
+
+
+class Task:
+    """
+    Function that can be run by the workers.
+    """
+
+    def __init__(self, func, name, max_attempts, priority, on_failure):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.priority = priority
+        self.on_failure = on_failure
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, **kwargs):
+        """Enqueue a job that calls the task with the given arguments."""
+        return enqueue(self.name, args=args, kwargs=kwargs, priority=self.priority)
+
+
+def task(name=None, max_attempts=None, priority=0, on_failure=None):
+    """
+    Register a function as a task.
+
+    :param name: Name of the task. The module and function name if it
+    isn't given.
+    :param max_attempts: Number of times a job is run before it is
+    given up. JOBS_MAX_ATTEMPTS if it isn't given.
+    :param priority: Default priority of the task's jobs.
+    :param on_failure: Function called with the job and the exception
+    when a job is given up.
+    """
+
+    def decorator(func):
+        task = Task(
+            func,
+            name or f"{func.__module__}.{func.__name__}",
+            max_attempts or settings.JOBS_MAX_ATTEMPTS,
+            priority,
+            on_failure,
+        )
+        TASKS[task.name] = task
+        return task
+
+    return decorator
+
+
+def autodiscover():
+    """Import the tasks modules of the installed applications."""
+    autodiscover_modules("tasks")
+
+
+def enqueue(name, args=(), kwargs=None, tenant=None, priority=0, delay=0):
+    """
+    Store a job that runs the task `name`.
+
+    :param tenant: Subdomain of the tenant whose database the job uses.
+    The current tenant if it isn't given.
+    :param delay: Seconds before the job can be run.
+    :return: The stored job.
+    :rtype: Job
+    """
+
+    from tenants.models import Job
+
+    return Job.objects.create(
+        task=name,
+        args=list(args),
+        kwargs=kwargs or {},
+        tenant=tenant or get_current_db_name() or "",
+        priority=priority,
+        run_after=timezone.now() + datetime.timedelta(seconds=delay),
+    )
+
+
+def claim_job(worker=""):
+    """
+    Take the next job ready to be run, so no other worker runs it.
+
+    Running jobs that haven't been updated for JOBS_STALE_AFTER seconds
+    are taken again, because their worker probably died.
+
+    :return: The claimed job or None.
+    """
+
+    from tenants.models import Job
+
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=settings.JOBS_STALE_AFTER)
+
+    with transaction.atomic(using="default"):
+        job = (
+            Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(Job.ready_q(now) | Job.stale_q(stale))
+            .order_by("-priority", "run_after")
+            .first()
+        )
+
+        if job is not None:
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.worker = worker
+            job.save(update_fields=["status", "attempts", "worker", "updated"])
+
+    return job
+
+
+@contextmanager
+def heartbeat(job):
+    """
+    Keep a claimed job updated while the block runs, so it isn't taken
+    as abandoned.
+    """
+
+    from tenants.models import Job
+
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.JOBS_HEARTBEAT_INTERVAL):
+                try:
+                    # Not if it has been claimed by another worker
+                    Job.objects.filter(
+                        pk=job.pk,
+                        status=Job.RUNNING,
+                        worker=job.worker,
+                    ).update(updated=timezone.now())
+                except DatabaseError as e:
+                    logger.warning(f"Couldn't update the job {job}: {e}")
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job.pk}", daemon=True)
+    thread.start()
+
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    """
+    Run a claimed job in the routing context of its tenant.
+
+    Finished jobs are deleted. The failed ones are scheduled again or,
+    after the task's maximum number of attempts, marked as failed.
+
+    :return: Whether the job finished successfully.
+    :rtype: bool
+    """
+
+    task = TASKS.get(job.task)
+
+    try:
+        if task is None:
+            raise LookupError(f"The task {job.task} isn't registered.")
+
+        with heartbeat(job), using_tenant(job.tenant or None):
+            task(*job.args, **job.kwargs)
+
+    except Exception as e:
+        logger.exception(f"The job {job} failed")
+        job.error = f"{type(e).__name__}: {e}"
+
+        if task is not None and job.attempts < task.max_attempts:
+            delay = settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.status = job.PENDING
+            job.run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        else:
+            job.status = job.FAILED
+
+            if task is not None and task.on_failure is not None:
+                task.on_failure(job, e)
+
+        job.save()
+        return False
+
+    job.delete()
+    return True
+
+
+def work(interval=None, once=False):
+    """
+    Run the jobs as they are ready.
+
+    :param interval: Seconds to wait when there are no jobs.
+    :param once: Return when there are no jobs ready.
+    """
+
+    if interval is None:
+        interval = settings.JOBS_POLL_INTERVAL
+
+    worker = f"{os.uname().nodename}:{os.getpid()}"
+    bus.start_listener()
+
+    while True:
+        # Like between requests, the connections used by the last job
+        # are returned to their pools.
+        close_old_connections()
+        get_tenant_databases().close_evicted_connections()
+
+        try:
+            job = claim_job(worker)
+        except DatabaseError:
+            # The default database is serializable, so claiming may fail
+            # when other workers claim at the same time.
+            logger.exception("Couldn't claim a job")
+            close_old_connections()
+            time.sleep(interval)
+            continue
+
+        if job is None:
+            if once:
+                return
+
+            time.sleep(interval)
+            continue
+
+        try:
+            run_job(job)
+        except DatabaseError:
+            # The job is still marked as running, so it's claimed again
+            # when it becomes stale.
+            logger.exception(f"Couldn't store the result of the job {job}")
+            close_old_connections()
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+import tenants.db_management as db
+import tenants.placement as placement
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Builds the template database the new tenants' databases are "
+        "cloned from, in every database host where tenants can be "
+        "placed, if the migrations have changed since it was built."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Build the template even if it is up to date.",
+        )
+
+    def handle(self, *args, **options):
+
+        for server in placement.get_servers():
+            db.build_template_db(force=options["force"], server=server)
+            self.stdout.write(f"Template of {server} built.")
+
+        self.stdout.write(
+            self.style.SUCCESS("The template databases are up to date.")
+        )
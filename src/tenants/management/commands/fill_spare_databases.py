@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import tenants.db_management as db
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Creates migrated databases not assigned to any tenant, up to "
+        "TENANT_SPARE_DATABASES, so new tenants can be registered "
+        "without creating a database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=settings.TENANT_SPARE_DATABASES,
+            help="Number of spare databases to keep.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help=(
+                "Keep running and fill the spare databases every "
+                "INTERVAL seconds."
+            ),
+        )
+
+    def handle(self, *args, **options):
+
+        while True:
+            created = db.fill_spare_dbs(options["count"])
+
+            if created:
+                self.stdout.write(f"Created {created} spare databases.")
+
+            if options["interval"] is None:
+                break
+
+            time.sleep(options["interval"])
+
+        self.stdout.write(
+            self.style.SUCCESS("The spare databases are filled.")
+        )
@@ -0,0 +1,137 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+import tenants.db_management as db
+import tenants.models as tmodels
+
+UP_TO_DATE = "up to date"
+MIGRATED = "migrated"
+FAILED = "failed"
+
+
+def migrate_one_tenant(subdomain):
+    """
+    Apply the pending migrations of a tenant in a worker process.
+
+    :return: The subdomain, the result, the number of migrations applied
+    or the error, and the seconds it took.
+    """
+
+    start = time.monotonic()
+
+    try:
+        pending = db.pending_migrations(subdomain)
+
+        if not pending:
+            return subdomain, UP_TO_DATE, 0, time.monotonic() - start
+
+        db.migrate_tenant(subdomain)
+        return subdomain, MIGRATED, len(pending), time.monotonic() - start
+
+    except Exception as e:
+        return subdomain, FAILED, f"{type(e).__name__}: {e}", time.monotonic() - start
+
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Migrates the databases of the tenants, several at the same time. "
+        "Tenants whose migrations are already applied are skipped, so "
+        "running it again after a failure resumes the migration."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.TENANT_MIGRATE_PROCESSES,
+            help="Number of tenants migrated at the same time.",
+        )
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            metavar="SUBDOMAIN",
+            help="Migrate only these tenants.",
+        )
+        parser.add_argument(
+            "--exclude",
+            nargs="+",
+            metavar="SUBDOMAIN",
+            default=[],
+            help="Don't migrate these tenants.",
+        )
+
+    def get_subdomains(self, only, exclude):
+        tenants = tmodels.Tenant.objects.order_by("subdomain_prefix")
+
+        if only:
+            missing = set(only) - set(
+                tenants.filter(subdomain_prefix__in=only)
+                .values_list("subdomain_prefix", flat=True)
+            )
+
+            if missing:
+                raise CommandError(
+                    f"There are no tenants {', '.join(sorted(missing))}."
+                )
+
+            tenants = tenants.filter(subdomain_prefix__in=only)
+
+        return list(
+            tenants.exclude(subdomain_prefix__in=exclude)
+            .values_list("subdomain_prefix", flat=True)
+        )
+
+    def handle(self, *args, **options):
+
+        subdomains = self.get_subdomains(options["only"], options["exclude"])
+        total = len(subdomains)
+        failed = []
+
+        self.stdout.write(
+            f"Migrating {total} tenants, {options['processes']} at a time."
+        )
+
+        # The workers are forked, they can't share the parent's
+        # connections.
+        connections.close_all()
+
+        with ProcessPoolExecutor(
+            max_workers=max(options["processes"], 1),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+
+            futures = [
+                executor.submit(migrate_one_tenant, subdomain)
+                for subdomain in subdomains
+            ]
+
+            for done, future in enumerate(as_completed(futures), 1):
+                subdomain, result, detail, seconds = future.result()
+                progress = f"[{done}/{total}] {subdomain}:"
+
+                if result == FAILED:
+                    failed.append(subdomain)
+                    self.stderr.write(f"{progress} failed after {seconds:.1f}s. {detail}")
+                elif result == MIGRATED:
+                    self.stdout.write(
+                        f"{progress} applied {detail} migrations in {seconds:.1f}s."
+                    )
+                else:
+                    self.stdout.write(f"{progress} {result}.")
+
+        if failed:
+            raise CommandError(
+                f"The migration of {len(failed)} tenants failed: "
+                f"{' '.join(failed)}. Run the command again to retry them."
+            )
+
+        self.stdout.write(self.style.SUCCESS("All the tenants are migrated."))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import tenants.db_management as db
+import tenants.exceptions as exceptions
+import tenants.models as tmodels
+import tenants.placement as placement
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Moves the database of a tenant to other database host. The "
+        "tenant's store only accepts reads while its database is copied."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("subdomain", help="Subdomain of the tenant.")
+        parser.add_argument("db_host", help="Name of the database host.")
+        parser.add_argument(
+            "--drop-source",
+            action="store_true",
+            help=(
+                "Drop the old database once moved. By default, it's kept "
+                "but it doesn't accept connections."
+            ),
+        )
+
+    def handle(self, *args, **options):
+
+        try:
+            tenant = tmodels.Tenant.objects.get(subdomain_prefix=options["subdomain"])
+            target = placement.get_server(options["db_host"])
+        except tmodels.Tenant.DoesNotExist:
+            raise CommandError(f"There isn't a tenant {options['subdomain']}.")
+        except exceptions.PlacementError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Moving {tenant.subdomain_prefix} to {target}...")
+
+        try:
+            db.move_tenant(tenant, target, drop_source=options["drop_source"])
+        except exceptions.TenantRelocationError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{tenant.subdomain_prefix} moved to {target}.")
+        )
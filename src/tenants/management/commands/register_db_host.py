@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+
+import tenants.models as tmodels
+import tenants.placement as placement
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Adds a Postgres server where the tenants' databases can be "
+        "created, or updates it if there is one with the same name. "
+        "Without arguments, lists the servers and their tenants."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", nargs="?")
+        parser.add_argument("--host")
+        parser.add_argument("--port", default="")
+        parser.add_argument("--user")
+        parser.add_argument("--password")
+        parser.add_argument(
+            "--maintenance-db",
+            default="postgres",
+            help="Database used to create and drop the tenants' databases.",
+        )
+        parser.add_argument(
+            "--weight",
+            type=int,
+            default=1,
+            help="Capacity of the host relative to the others.",
+        )
+        parser.add_argument(
+            "--inactive",
+            action="store_true",
+            help="Don't place new tenants in the host.",
+        )
+
+    def handle(self, *args, **options):
+
+        if options["name"]:
+            server, created = tmodels.DatabaseHost.objects.update_or_create(
+                name=options["name"],
+                defaults={
+                    field: options[field]
+                    for field in ("host", "port", "user", "password", "weight")
+                    if options[field] is not None
+                } | {
+                    "maintenance_db": options["maintenance_db"],
+                    "active": not options["inactive"],
+                },
+            )
+            self.stdout.write(f"{'Added' if created else 'Updated'} {server}.")
+
+        loads = placement.count_tenants()
+
+        for server in tmodels.DatabaseHost.objects.order_by("name"):
+            self.stdout.write(
+                f"{server}: weight {server.weight}, "
+                f"{loads.get((server.host, str(server.port or '')), 0)} tenants"
+                f"{'' if server.active else ', inactive'}"
+            )
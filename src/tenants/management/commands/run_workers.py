@@ -0,0 +1,76 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+import tenants.jobs as jobs
+
+
+def run_worker(interval, once):
+    # The parent handles the signals and terminates its workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    jobs.work(interval, once)
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Runs the background jobs in worker processes. The workers keep "
+        "waiting for new jobs unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.JOBS_WORKER_PROCESSES,
+            help="Number of worker processes.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when there are no jobs ready.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.JOBS_POLL_INTERVAL,
+            help="Seconds to wait between checks for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        jobs.autodiscover()
+        self.stdout.write(f"Registered tasks: {', '.join(sorted(jobs.TASKS))}")
+
+        # The workers are forked, they can't share the parent's
+        # connections.
+        connections.close_all()
+
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(
+                target=run_worker,
+                args=(options["interval"], options["once"]),
+                name=f"mws-worker-{i}",
+            )
+            for i in range(options["processes"])
+        ]
+
+        for worker in workers:
+            worker.start()
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+
+        failed = [worker.name for worker in workers if worker.exitcode]
+
+        if failed:
+            self.stderr.write(f"Workers {', '.join(failed)} exited with errors.")
@@ -1,21 +1,210 @@
-import threading
+import contextvars
+from contextlib import contextmanager
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from django.db import InterfaceError, OperationalError
+from django.shortcuts import render
+from psycopg.errors import ReadOnlySqlTransaction
+
+from mws_main.timing import timed, TENANT
 from .utils import tenant_db_from_request
+from .connections import get_tenant_databases
+
+# Subdomain of the tenant whose data is being accessed. A context
+# variable follows the request through sync_to_async() and
+# async_to_sync() calls and isn't shared between concurrent tasks.
+CURRENT_TENANT = contextvars.ContextVar("current_tenant", default=None)
+
+# Whether the reads of the tenant can go to its read replica (see
+# tenants.replicas). Only safe requests of clients that haven't written
+# recently set it.
+READ_FROM_REPLICA = contextvars.ContextVar("read_from_replica", default=False)
 
-THREAD_LOCAL = threading.local()
+# Cookie that sends the reads of a client to the primary database after
+# it writes
+PIN_COOKIE = "mws_primary"
 
 def get_current_db_name():
-    return getattr(THREAD_LOCAL, "DB", None)
-    
+    return CURRENT_TENANT.get()
+
 def set_db_for_router(db=None):
-    setattr(THREAD_LOCAL, "DB", db)
+    CURRENT_TENANT.set(db)
+
+@contextmanager
+def using_tenant(subdomain):
+    """
+    Route the queries of the block to the tenant's database.
+
+    It's meant for code that doesn't run within a request, such as
+    management commands or background jobs. The previous tenant is
+    restored on exit.
+
+    :param subdomain: Subdomain of the tenant.
+    :type subdomain: str
+    """
+
+    token = CURRENT_TENANT.set(subdomain)
+
+    try:
+        yield
+    finally:
+        CURRENT_TENANT.reset(token)
+
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+
+def read_only_response(request):
+    """Response to the requests that would write to a read-only tenant."""
+
+    response = render(request, "tenants/read_only.html", status=503)
+    response["Retry-After"] = "60"
+    return response
+
 
 class TenantMiddleware:
+    """
+    Route the queries of the request to the database of the tenant
+    whose subdomain is in the request's host.
+
+    While the tenant's database is moved to other host (see the command
+    move_tenant), only safe requests are accepted.
+
+    The reads of safe requests can go to the tenant's read replica,
+    except for TENANT_REPLICA_PIN seconds after the client writes.
+    """
 
     def __init__(self, get_response):
         self.get_response = get_response
-        
+
+    def prepare(self, request, db):
+        """
+        Register the tenant's database on its first request and keep it
+        as recently used.
+
+        :return: A response if the request can't be processed.
+        """
+
+        databases = get_tenant_databases()
+        databases.ensure(db)
+
+        if request.method not in SAFE_METHODS and databases.is_read_only(db):
+            return read_only_response(request)
+
+        return None
+
+    def enter(self, request, db):
+        """Set the tenant of the request and where it reads from."""
+
+        writes = (
+            request.method not in SAFE_METHODS
+            or PIN_COOKIE in request.COOKIES
+        )
+
+        return CURRENT_TENANT.set(db), READ_FROM_REPLICA.set(not writes)
+
+    def leave(self, tokens):
+        tenant_token, replica_token = tokens
+        READ_FROM_REPLICA.reset(replica_token)
+        CURRENT_TENANT.reset(tenant_token)
+
+    def pin(self, request, db, response):
+        """
+        Send the reads of a client that has written to the primary
+        database for a while, so it sees its changes.
+        """
+
+        if (
+            request.method not in SAFE_METHODS
+            and get_tenant_databases().replica_alias(db) is not None
+        ):
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=settings.TENANT_REPLICA_PIN,
+                httponly=True,
+                samesite="Lax",
+            )
+
+        return response
+
     def __call__(self, request):
         db = tenant_db_from_request(request)
-        set_db_for_router(db)
-        response = self.get_response(request)
-        return response
+
+        with timed(TENANT):
+            response = self.prepare(request, db)
+
+        if response is not None:
+            return response
+
+        tokens = self.enter(request, db)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            self.leave(tokens)
+
+        return self.pin(request, db, response)
+
+    def process_exception(self, request, exception):
+        db = get_current_db_name()
+
+        # The database was made read-only after the tenant was looked up.
+        if isinstance(exception.__cause__, ReadOnlySqlTransaction):
+            return read_only_response(request)
+
+        # The cached settings may point to a database that has been
+        # moved, so they are looked up again on the next request.
+        if db is not None and isinstance(exception, (OperationalError, InterfaceError)):
+            get_tenant_databases().invalidate(db)
+
+        return None
+
+
+class AsyncTenantMiddleware(TenantMiddleware):
+    """
+    Tenant middleware that can also be used in an asynchronous
+    middleware chain, so async views don't switch to a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        db = tenant_db_from_request(request)
+
+        with timed(TENANT):
+            response = await sync_to_async(self.prepare)(request, db)
+
+        if response is not None:
+            return response
+
+        tokens = self.enter(request, db)
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.leave(tokens)
+
+        if request.method in SAFE_METHODS:
+            return response
+
+        return await sync_to_async(self.pin)(request, db, response)
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0004_tenant_db_host_tenant_db_password_tenant_db_port_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tenant',
+            name='db_name',
+            field=models.CharField(help_text="Name of the tenant's database or schema.", max_length=63, unique=True),
+        ),
+    ]
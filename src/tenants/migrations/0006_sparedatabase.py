@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0005_alter_tenant_db_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpareDatabase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_name', models.CharField(max_length=63, unique=True)),
+                ('db_host', models.CharField(max_length=45)),
+                ('db_port', models.CharField(max_length=6)),
+                ('db_password', models.CharField(max_length=35)),
+                ('db_user', models.CharField(max_length=30)),
+                ('fingerprint', models.CharField(help_text='Fingerprint of the migrations applied to the database.', max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
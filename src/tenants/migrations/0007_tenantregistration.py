@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-17 12:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0006_sparedatabase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenantRegistration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.UUIDField(unique=True)),
+                ('name', models.CharField(max_length=25, verbose_name='store name')),
+                ('subdomain_prefix', models.CharField(max_length=25)),
+                ('email', models.EmailField(max_length=254)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=7)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text="The registration isn't attempted before this time.")),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='tenants.tenant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='tenants_ten_status_5ac627_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:04
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def enqueue_pending_registrations(apps, schema_editor):
+    TenantRegistration = apps.get_model("tenants", "TenantRegistration")
+    Job = apps.get_model("tenants", "Job")
+
+    for pk in TenantRegistration.objects.filter(
+        status__in=["pending", "running"],
+    ).values_list("pk", flat=True):
+        Job.objects.create(task="tenants.register_tenant", args=[pk], priority=10)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0007_tenantregistration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=100)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('tenant', models.CharField(blank=True, help_text='Subdomain of the tenant whose database the job uses.', max_length=25)),
+                ('priority', models.SmallIntegerField(default=0, help_text='Jobs with a higher priority are run first.')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')], default='pending', max_length=7)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text="The job isn't run before this time.")),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(
+            enqueue_pending_registrations,
+            migrations.RunPython.noop,
+        ),
+        migrations.RemoveIndex(
+            model_name='tenantregistration',
+            name='tenants_ten_status_5ac627_idx',
+        ),
+        migrations.RemoveField(
+            model_name='tenantregistration',
+            name='run_after',
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', '-priority', 'run_after'], name='tenants_job_status_267e99_idx'),
+        ),
+    ]
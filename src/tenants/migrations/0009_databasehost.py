@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0008_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatabaseHost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+                ('host', models.CharField(max_length=45)),
+                ('port', models.CharField(blank=True, max_length=6)),
+                ('user', models.CharField(max_length=30)),
+                ('password', models.CharField(max_length=35)),
+                ('maintenance_db', models.CharField(default='postgres', help_text="Database used to create and drop the tenants' databases.", max_length=63)),
+                ('weight', models.PositiveSmallIntegerField(default=1, help_text='Capacity of the host relative to the others.')),
+                ('active', models.BooleanField(default=True, help_text='New tenants are only placed in active hosts.')),
+                ('n_assigned', models.PositiveIntegerField(default=0, help_text='Used by the round-robin placement.', verbose_name='number of tenants assigned')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0009_databasehost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='read_only',
+            field=models.BooleanField(default=False, help_text="Writes are rejected while the tenant's database is moved."),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0010_tenant_read_only'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='replica_host',
+            field=models.CharField(blank=True, help_text="Host of a read replica of the tenant's database, if any.", max_length=45),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='replica_port',
+            field=models.CharField(blank=True, max_length=6),
+        ),
+    ]
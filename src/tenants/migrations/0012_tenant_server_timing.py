@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0011_tenant_replica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='server_timing',
+            field=models.BooleanField(default=True, help_text="Send the Server-Timing header in the store's responses."),
+        ),
+    ]
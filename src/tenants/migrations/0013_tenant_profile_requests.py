@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0012_tenant_server_timing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='profile_requests',
+            field=models.BooleanField(default=False, help_text='Profile every request of the store (see mws_main.profiling).'),
+        ),
+    ]
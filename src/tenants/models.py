@@ -3,11 +3,20 @@ import os
 import time
 import logging
 
-from django.db import models
+import psycopg
+
+from django.db import models, router, transaction, DatabaseError
 
 from django.utils import timezone
 import mws_main.models as mmodels
+import mws_main.theme as theme
+import tenants.bus as bus
 import tenants.db_management as db
+import tenants.exceptions as exceptions
+import tenants.jobs as jobs
+from tenants.middlewares import using_tenant
+
+logger = logging.getLogger(__name__)
 
 
 class Tenant(models.Model):
@@ -31,8 +40,9 @@ class Tenant(models.Model):
     )
 
     db_name = models.CharField(
-        max_length=25,
+        max_length=63,
         unique=True,
+        help_text="Name of the tenant's database or schema.",
     )
 
     db_host = models.CharField(
@@ -55,38 +65,459 @@ class Tenant(models.Model):
 
     email = models.EmailField()
 
+    read_only = models.BooleanField(
+        default=False,
+        help_text="Writes are rejected while the tenant's database is moved.",
+    )
+
+    replica_host = models.CharField(
+        max_length=45,
+        blank=True,
+        help_text="Host of a read replica of the tenant's database, if any.",
+    )
+
+    replica_port = models.CharField(
+        max_length=6,
+        blank=True,
+    )
+
+    server_timing = models.BooleanField(
+        default=True,
+        help_text="Send the Server-Timing header in the store's responses.",
+    )
+
+    profile_requests = models.BooleanField(
+        default=False,
+        help_text="Profile every request of the store (see mws_main.profiling).",
+    )
+
     def __str__(self):
         return self.name
 
+    @property
+    def store_url(self):
+        return f"http://{self.subdomain_prefix}.mws.local:8000/store/"
 
-def register_tenant(name, subdomain, email):
+
+class DatabaseHost(models.Model):
     """
-    Create a new tenant.
+    Postgres server where the tenants' databases can be created.
+
+    The tenants aren't linked to their host, their rows keep the
+    connection data of their database (see tenants.placement).
     """
 
-    db_settings = db.create_db(subdomain)
+    name = models.CharField(
+        max_length=30,
+        unique=True,
+    )
+
+    host = models.CharField(
+        max_length=45,
+    )
+
+    port = models.CharField(
+        max_length=6,
+        blank=True,
+    )
 
-    tenant = Tenant.objects.create(
-        name=name,
-        subdomain_prefix=subdomain,
-        email=email,
-        db_host=db_settings["db_host"],
-        db_port=db_settings["db_port"],
-        db_name=db_settings["db_name"],
-        db_password=db_settings["db_password"],
-        db_user=db_settings["db_user"]
+    user = models.CharField(
+        max_length=30,
     )
-    
-    metadata = {"main_theme_color": "purple"}
-    mmodels.Metadata.objects.create(
-        appearance_metadata=metadata,
-        download_bandwidth={},
+
+    password = models.CharField(
+        max_length=35,
     )
 
-    mmodels.TenantAdmin.objects.create_user(
-        username="admin",
-        email=email,
-        password="Ab12345678",
+    maintenance_db = models.CharField(
+        max_length=63,
+        default="postgres",
+        help_text="Database used to create and drop the tenants' databases.",
     )
-    
+
+    weight = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="Capacity of the host relative to the others.",
+    )
+
+    active = models.BooleanField(
+        default=True,
+        help_text="New tenants are only placed in active hosts.",
+    )
+
+    n_assigned = models.PositiveIntegerField(
+        "number of tenants assigned",
+        default=0,
+        help_text="Used by the round-robin placement.",
+    )
+
+    def __str__(self):
+        return f"{self.name} ({self.host}:{self.port})"
+
+    def connect(self):
+        """Open an autocommit connection to the maintenance database."""
+
+        return psycopg.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            dbname=self.maintenance_db,
+            autocommit=True
+        )
+
+    def to_record(self, db_name):
+        """Return the connection data of a database as stored in a Tenant."""
+        return {
+            "db_name": db_name,
+            "db_user": self.user,
+            "db_password": self.password,
+            "db_host": self.host,
+            "db_port": self.port,
+        }
+
+
+class SpareDatabase(models.Model):
+    """
+    Database, or schema, already migrated that hasn't been assigned to
+    a tenant yet.
+
+    Registrations take one of them instead of creating a database.
+    """
+
+    db_name = models.CharField(
+        max_length=63,
+        unique=True,
+    )
+
+    db_host = models.CharField(
+        max_length=45,
+    )
+
+    db_port = models.CharField(
+        max_length=6,
+    )
+
+    db_password = models.CharField(
+        max_length=35,
+    )
+
+    db_user = models.CharField(
+        max_length=30,
+    )
+
+    fingerprint = models.CharField(
+        max_length=64,
+        help_text="Fingerprint of the migrations applied to the database.",
+    )
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.db_name
+
+    def to_record(self):
+        """Return the database connection data as stored in a Tenant."""
+        return {
+            "db_name": self.db_name,
+            "db_user": self.db_user,
+            "db_password": self.db_password,
+            "db_host": self.db_host,
+            "db_port": self.db_port,
+        }
+
+
+def register_tenant(name, subdomain, email, db_host=None, registration=None):
+    """
+    Create a new tenant.
+
+    The tenant's row is created in the transaction that claims its
+    spare database, if there's one. If the tenant can't be created, the
+    spare database goes back to the spare ones, and a database created
+    for it is dropped.
+
+    :param db_host: Name of the DatabaseHost where the tenant's
+    database is created. It's chosen by the placement policy if it isn't
+    given.
+    :param registration: Registration of the tenant, which is linked to
+    it in the transaction that creates it.
+    :type registration: TenantRegistration
+    """
+
+    db_settings = spare = None
+    # Whether the tenant's data has been written in its database
+    stored = False
+
+    try:
+        with transaction.atomic(using="default"):
+            db_settings, spare = db.create_db(subdomain, db_host)
+
+            tenant = Tenant.objects.create(
+                name=name,
+                subdomain_prefix=subdomain,
+                email=email,
+                db_host=db_settings["db_host"],
+                db_port=db_settings["db_port"],
+                db_name=db_settings["db_name"],
+                db_password=db_settings["db_password"],
+                db_user=db_settings["db_user"]
+            )
+
+            if registration is not None:
+                registration.tenant = tenant
+                registration.save(update_fields=["tenant", "updated"])
+
+            # A failure doesn't leave partial data in a spare database
+            with transaction.atomic(using=router.db_for_write(mmodels.Metadata)):
+                metadata = {"main_theme_color": "purple"}
+                mmodels.Metadata.objects.create(
+                    appearance_metadata=metadata,
+                    download_bandwidth={},
+                )
+
+                mmodels.TenantAdmin.objects.create_user(
+                    username="admin",
+                    email=email,
+                    password="Ab12345678",
+                )
+
+            stored = True
+
+    except DatabaseError as e:
+
+        if registration is not None:
+            registration.tenant = None
+
+        if db_settings is None:
+            raise
+
+        if spare is not None and not stored:
+            # The rollback has returned it to the spare ones
+            db.release_spare_db(subdomain)
+        else:
+            if spare is not None:
+                SpareDatabase.objects.filter(pk=spare.pk).delete()
+
+            try:
+                db.revert_tenant_storage(subdomain, db_settings)
+            except (psycopg.Error, ValueError) as drop_error:
+                logger.critical(f"Couldn't drop an invalid database: {drop_error}")
+
+        raise exceptions.TenantRegistrationError(
+            "There has been an internal error trying"
+            "to register your data. Please, try again"
+            "later."
+        ) from e
+
+    # The workers may have cached that there wasn't such tenant.
+    bus.publish("tenant", subdomain)
+    theme.invalidate_store_theme(subdomain)
     return tenant
+
+
+class TenantRegistration(models.Model):
+    """
+    Request to register a new tenant, which is processed by a background
+    job (see tenants.tasks) outside the web request.
+
+    The key is generated when the registration form is shown, so the
+    form can be submitted again without registering the tenant twice.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    key = models.UUIDField(unique=True)
+    name = models.CharField("store name", max_length=25)
+    subdomain_prefix = models.CharField(max_length=25)
+    email = models.EmailField()
+
+    status = models.CharField(
+        max_length=7,
+        choices=[
+            (PENDING, "Pending"),
+            (RUNNING, "Running"),
+            (DONE, "Done"),
+            (FAILED, "Failed"),
+        ],
+        default=PENDING,
+    )
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    tenant = models.ForeignKey(
+        Tenant,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.subdomain_prefix} ({self.status})"
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+def request_registration(key, name, subdomain, email):
+    """
+    Enqueue the registration of a tenant.
+
+    Requesting it again with the same key returns the first request.
+
+    :raises TenantRegistrationError: if other registration of the same
+    subdomain is in progress.
+    """
+
+    with transaction.atomic(using="default"):
+
+        registration = TenantRegistration.objects.filter(key=key).first()
+
+        if registration is not None:
+            return registration
+
+        in_progress = TenantRegistration.objects.filter(
+            subdomain_prefix=subdomain,
+            status__in=[TenantRegistration.PENDING, TenantRegistration.RUNNING],
+        )
+
+        if in_progress.exists():
+            raise exceptions.TenantRegistrationError(
+                "There is already a store with that subdomain."
+            )
+
+        registration = TenantRegistration.objects.create(
+            key=key,
+            name=name,
+            subdomain_prefix=subdomain,
+            email=email,
+        )
+
+        # People wait for their registration, so it goes before the
+        # other jobs.
+        jobs.enqueue(
+            "tenants.register_tenant",
+            args=[registration.pk],
+            priority=10,
+        )
+
+    return registration
+
+
+def process_registration(registration):
+    """
+    Register the tenant of a registration.
+
+    The tenant is linked to the registration when it's created, so a
+    registration retried after its tenant was created isn't registered
+    again. A registration whose subdomain has been taken by other tenant
+    fails.
+
+    :raises TenantRegistrationError: if the tenant couldn't be
+    registered, so the job is retried.
+    """
+
+    subdomain = registration.subdomain_prefix
+    registration.status = TenantRegistration.RUNNING
+    registration.attempts += 1
+    registration.save(update_fields=["status", "attempts", "updated"])
+
+    # The tenant was created by a previous attempt
+    tenant = registration.tenant
+
+    if tenant is None and Tenant.objects.filter(subdomain_prefix=subdomain).exists():
+        # Other registration has taken the subdomain since the form
+        # checked it.
+        registration.status = TenantRegistration.FAILED
+        registration.error = "There is already a store with that subdomain."
+        registration.save(update_fields=["status", "error", "updated"])
+        return registration
+
+    try:
+        if tenant is None:
+            with using_tenant(subdomain):
+                tenant = register_tenant(
+                    registration.name,
+                    subdomain,
+                    registration.email,
+                    registration=registration,
+                )
+
+    except (exceptions.TenantRegistrationError, DatabaseError) as e:
+        registration.status = TenantRegistration.PENDING
+        registration.error = str(e)
+        registration.save(update_fields=["status", "error", "updated"])
+        raise exceptions.TenantRegistrationError(str(e)) from e
+
+    registration.status = TenantRegistration.DONE
+    registration.tenant = tenant
+    registration.error = ""
+    registration.save()
+    return registration
+
+
+class Job(models.Model):
+    """
+    Call to a task that is run by the background workers (see
+    tenants.jobs).
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+
+    task = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+
+    tenant = models.CharField(
+        max_length=25,
+        blank=True,
+        help_text="Subdomain of the tenant whose database the job uses.",
+    )
+
+    priority = models.SmallIntegerField(
+        default=0,
+        help_text="Jobs with a higher priority are run first.",
+    )
+
+    status = models.CharField(
+        max_length=7,
+        choices=[
+            (PENDING, "Pending"),
+            (RUNNING, "Running"),
+            (FAILED, "Failed"),
+        ],
+        default=PENDING,
+    )
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        help_text="The job isn't run before this time.",
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "-priority", "run_after"]),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.tenant or 'platform'})"
+
+    @classmethod
+    def ready_q(cls, now):
+        return models.Q(status=cls.PENDING, run_after__lte=now)
+
+    @classmethod
+    def stale_q(cls, stale):
+        return models.Q(status=cls.RUNNING, updated__lt=stale)
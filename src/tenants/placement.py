@@ -0,0 +1,178 @@
+"""
+Placement of the tenants' databases in the Postgres servers.
+
+The servers are the active ``DatabaseHost`` rows. A new tenant is
+placed in the one given explicitly or, otherwise, in the one chosen by
+``TENANT_PLACEMENT_POLICY``, taking into account the weight of each
+host. Without ``DatabaseHost`` rows, every tenant is placed in the
+default database's server.
+
+Once placed, the ``db_host`` and ``db_port`` of the tenant's row are the
+only link with its server: they are used by the tenant's connection
+settings and the connection limits per host (see tenants.connections
+and tenants.pools).
+"""
+
+from collections import Counter
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction, models
+
+import tenants.exceptions as exceptions
+
+LEAST_LOADED = "least-loaded"
+ROUND_ROBIN = "round-robin"
+EXPLICIT = "explicit"
+POLICIES = (LEAST_LOADED, ROUND_ROBIN, EXPLICIT)
+
+
+def default_server():
+    """Return the default database's server as an unsaved DatabaseHost."""
+
+    DatabaseHost = apps.get_model("tenants", "DatabaseHost")
+    default = settings.DATABASES["default"]
+
+    return DatabaseHost(
+        name="default",
+        host=default["HOST"],
+        port=default["PORT"],
+        user=default["USER"],
+        password=default["PASSWORD"],
+        maintenance_db=default["NAME"],
+    )
+
+
+def get_servers():
+    """Return the servers where new tenants can be placed."""
+
+    DatabaseHost = apps.get_model("tenants", "DatabaseHost")
+    servers = list(
+        DatabaseHost.objects.filter(active=True, weight__gt=0).order_by("name")
+    )
+
+    return servers or [default_server()]
+
+
+def get_server(name):
+    """
+    Return the server with the given name.
+
+    :raises PlacementError: if there isn't such server.
+    """
+
+    DatabaseHost = apps.get_model("tenants", "DatabaseHost")
+
+    if name == "default" and not DatabaseHost.objects.filter(name=name).exists():
+        return default_server()
+
+    try:
+        return DatabaseHost.objects.get(name=name)
+    except DatabaseHost.DoesNotExist:
+        raise exceptions.PlacementError(f"There isn't a database host {name}.")
+
+
+def find_server(host, port):
+    """
+    Return the server of a database given its host and port. The
+    default database's server if it isn't registered.
+    """
+
+    DatabaseHost = apps.get_model("tenants", "DatabaseHost")
+    server = DatabaseHost.objects.filter(host=host, port=port or "").first()
+    return server or default_server()
+
+
+def count_tenants():
+    """Return the number of tenants in every (db_host, db_port)."""
+
+    Tenant = apps.get_model("tenants", "Tenant")
+
+    return Counter({
+        (row["db_host"], str(row["db_port"] or "")): row["n_tenants"]
+        for row in Tenant.objects.values("db_host", "db_port")
+        .annotate(n_tenants=models.Count("pk"))
+    })
+
+
+def least_loaded(servers, loads):
+    """
+    Return the server with the fewest tenants for its weight.
+
+    :param loads: Number of tenants by (host, port).
+    :type loads: dict
+    """
+
+    return min(
+        servers,
+        key=lambda server: (
+            loads.get((server.host, str(server.port or "")), 0) / server.weight,
+            server.name,
+        ),
+    )
+
+
+def round_robin(servers):
+    """
+    Return the server with the fewest tenants assigned for its weight,
+    counting the new one.
+
+    Unlike `least_loaded`, it counts the assignments, not the tenants
+    that are still in the host, so the registrations are spread among
+    the hosts in turns. Concurrent registrations may fail to serialize,
+    and it's the transaction that registers the tenant that is retried.
+    """
+
+    DatabaseHost = apps.get_model("tenants", "DatabaseHost")
+
+    with transaction.atomic(using="default"):
+        servers = list(
+            DatabaseHost.objects
+            .select_for_update()
+            .filter(pk__in=[server.pk for server in servers])
+            .order_by("name")
+        )
+        server = min(
+            servers,
+            key=lambda server: (server.n_assigned + 1) / server.weight,
+        )
+        server.n_assigned = models.F("n_assigned") + 1
+        server.save(update_fields=["n_assigned"])
+
+    server.refresh_from_db(fields=["n_assigned"])
+    return server
+
+
+def place_tenant(name=None):
+    """
+    Choose the server where the database of a new tenant is created.
+
+    :param name: Name of the server, if it's given explicitly.
+    :rtype: DatabaseHost
+    :raises PlacementError: if the server given doesn't exist or the
+    policy is unknown.
+    """
+
+    if name:
+        return get_server(name)
+
+    policy = settings.TENANT_PLACEMENT_POLICY
+
+    if policy not in POLICIES:
+        raise exceptions.PlacementError(
+            f"Unknown placement policy {policy}. Use one of "
+            f"{', '.join(POLICIES)}."
+        )
+
+    servers = get_servers()
+
+    if policy == EXPLICIT or servers[0].pk is None:
+        return default_server()
+
+    if len(servers) == 1:
+        return servers[0]
+
+    if policy == ROUND_ROBIN:
+        return round_robin(servers)
+
+    return least_loaded(servers, count_tenants())
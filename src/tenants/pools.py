@@ -0,0 +1,189 @@
+"""
+Connection pools of the tenants' databases.
+
+Each tenant's database alias has its own psycopg pool, because a
+Postgres connection can only be used with the database it was opened
+to. The number of connections that can be checked out of those pools at
+the same time is also limited per database host (``db_host`` and
+``db_port``) and for the whole process, so the open connections of a
+worker don't grow with the number of tenants it serves. Idle
+connections are closed by the pools after ``TENANT_POOL_MAX_IDLE``
+seconds.
+"""
+
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.postgresql.base import DatabaseWrapper
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+
+class ConnectionLimiter:
+    """
+    Count the connections in use and block when a limit is reached.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.timeouts = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, deadline):
+
+        with self._cond:
+            while self.in_use >= self.limit:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if self.in_use >= self.limit:
+                        self.timeouts += 1
+                        return False
+
+            self.in_use += 1
+            return True
+
+    def release(self):
+
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    def to_dict(self):
+        return {
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "timeouts": self.timeouts,
+        }
+
+
+_limiters_lock = threading.Lock()
+_host_limiters = {}
+_global_limiter = None
+
+
+def get_limiters(host, port):
+    """Return the process and host limiters of a database server."""
+
+    global _global_limiter
+
+    with _limiters_lock:
+
+        if _global_limiter is None:
+            _global_limiter = ConnectionLimiter(
+                settings.TENANT_POOL_MAX_CONNECTIONS
+            )
+
+        key = (host or "", str(port or ""))
+
+        if key not in _host_limiters:
+            _host_limiters[key] = ConnectionLimiter(
+                settings.TENANT_POOL_MAX_PER_HOST
+            )
+
+        return _global_limiter, _host_limiters[key]
+
+
+class TenantConnectionPool(ConnectionPool):
+    """
+    Pool of a tenant's database whose connections are also counted by
+    the host and process limiters.
+    """
+
+    def __init__(self, *args, host=None, port=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = host or ""
+        self.port = str(port or "")
+        self.limiters = get_limiters(host, port)
+
+    def getconn(self, timeout=None):
+
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = time.monotonic() + timeout
+        acquired = []
+
+        try:
+            for limiter in self.limiters:
+                if not limiter.acquire(deadline):
+                    raise PoolTimeout(
+                        f"couldn't get a connection to {self.host}:{self.port}"
+                        f" after {timeout:.2f} sec, {limiter.in_use} of"
+                        f" {limiter.limit} connections are in use"
+                    )
+                acquired.append(limiter)
+
+            return super().getconn(max(deadline - time.monotonic(), 0.0))
+
+        except BaseException:
+            for limiter in acquired:
+                limiter.release()
+            raise
+
+    def putconn(self, conn):
+
+        try:
+            super().putconn(conn)
+        finally:
+            for limiter in self.limiters:
+                limiter.release()
+
+
+def get_tenant_pools():
+    """Return the tenants' pools created in this process by alias."""
+
+    return {
+        alias: pool
+        for alias, pool in list(DatabaseWrapper._connection_pools.items())
+        if isinstance(pool, TenantConnectionPool)
+    }
+
+
+def close_pool(alias):
+    """Close the pool of a tenant's database, if it was created."""
+
+    pool = DatabaseWrapper._connection_pools.pop(alias, None)
+
+    if pool is not None:
+        pool.close()
+
+
+def pool_stats():
+    """
+    Return the statistics of this process' pools, aggregated by
+    database host.
+
+    Counters such as ``requests_num`` are accumulated since each pool
+    was created.
+    """
+
+    hosts = {}
+    totals = {"pools": 0}
+
+    for alias, pool in get_tenant_pools().items():
+        host_stats = hosts.setdefault(
+            f"{pool.host}:{pool.port}",
+            {"pools": 0, **pool.limiters[1].to_dict()},
+        )
+        host_stats["pools"] += 1
+        totals["pools"] += 1
+
+        for name, value in pool.get_stats().items():
+            if name in ("pool_min", "pool_max"):
+                continue
+            host_stats[name] = host_stats.get(name, 0) + value
+            totals[name] = totals.get(name, 0) + value
+
+    with _limiters_lock:
+        if _global_limiter is not None:
+            totals.update(_global_limiter.to_dict())
+
+    return {
+        "pid": os.getpid(),
+        "max_size": settings.TENANT_POOL_MAX_SIZE,
+        "global": totals,
+        "hosts": hosts,
+    }
@@ -0,0 +1,97 @@
+"""
+Routing of the tenants' reads to their read replicas.
+
+The reads of a request go to the tenant's replica only if:
+
+* the tenant has one (``Tenant.replica_host``),
+* the request is safe and the client hasn't written recently, because
+  the unsafe requests pin the client to the primary database for
+  ``TENANT_REPLICA_PIN`` seconds with a cookie (see TenantMiddleware),
+* the request isn't in a transaction of the primary database, and
+* the replication lag, checked at most every
+  ``TENANT_REPLICA_LAG_CHECK`` seconds per process, is at most
+  ``TENANT_REPLICA_MAX_LAG`` seconds.
+
+Otherwise, they go to the primary database. Code that doesn't run
+within a request, such as the background jobs, always reads from the
+primary.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+from .connections import get_tenant_databases
+from .middlewares import READ_FROM_REPLICA
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind the primary. Its last changes may not
+# be replayed yet, but there is nothing left to replay if it has
+# received all the WAL sent.
+LAG_QUERY = (
+    "SELECT CASE "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+# Replica alias -> (time of the check, lag in seconds or None)
+_lags = {}
+
+
+def replica_lag(alias):
+    """
+    Return the replication lag of a replica in seconds or None if it
+    can't be reached.
+    """
+
+    try:
+        with connections[alias].cursor() as cur:
+            cur.execute(LAG_QUERY)
+            return float(cur.fetchone()[0])
+
+    except DatabaseError as e:
+        logger.warning(f"Couldn't check the lag of the replica {alias}: {e}")
+        connections[alias].close()
+        return None
+
+
+def replica_is_fresh(alias):
+    """Return whether the lag of a replica is small enough to read from it."""
+
+    now = time.monotonic()
+    checked = _lags.get(alias)
+
+    if checked is None or checked[0] + settings.TENANT_REPLICA_LAG_CHECK <= now:
+        checked = (now, replica_lag(alias))
+        _lags[alias] = checked
+
+    lag = checked[1]
+    return lag is not None and lag <= settings.TENANT_REPLICA_MAX_LAG
+
+
+def read_alias(subdomain, primary):
+    """
+    Return the alias where the reads of a tenant are sent.
+
+    :param primary: Alias of the tenant's primary database.
+    """
+
+    if not READ_FROM_REPLICA.get():
+        return primary
+
+    replica = get_tenant_databases().replica_alias(subdomain)
+
+    if replica is None:
+        return primary
+
+    # The reads of a transaction have to see its writes.
+    wrapper = getattr(connections._connections, primary, None)
+
+    if wrapper is not None and wrapper.in_atomic_block:
+        return primary
+
+    return replica if replica_is_fresh(replica) else primary
@@ -1,4 +1,7 @@
 from .middlewares import get_current_db_name
+from .connections import get_tenant_alias
+from .replicas import read_alias
+from .sessions import session_alias
 
 
 class TenantSpecRouter:
@@ -7,12 +10,13 @@ class TenantSpecRouter:
     
     def db_for_read(self, model, **hints):
         if model._meta.app_label in self.route_app_labels:
-            return get_current_db_name()
+            subdomain = get_current_db_name()
+            return read_alias(subdomain, get_tenant_alias(subdomain))
         return None
 
     def db_for_write(self, model, **hints):
         if model._meta.app_label in self.route_app_labels:
-            return get_current_db_name()
+            return get_tenant_alias(get_current_db_name())
         return None
 
     def allow_relation(self, obj1, obj2, **hints):
@@ -29,7 +33,10 @@ class TenantSpecRouter:
 
     def allow_migrate(self, db, app_label, model_name=None, **hints):
         if app_label in self.route_app_labels:
-            return db == get_current_db_name() and db != "default"
+            return (
+                db == get_tenant_alias(get_current_db_name())
+                and db != "default"
+            )
         return None
 
 
@@ -63,3 +70,25 @@ class GeneralMWSRouter:
         if app_label in self.route_app_labels:
             return db == "default"
         return None
+
+
+class TenantSessionRouter:
+    """
+    Store the sessions in the database of the request's tenant, or in
+    the default database for the platform's requests (see
+    tenants.sessions).
+    """
+
+    route_app_labels = {"sessions"}
+
+    def db_for_read(self, model, **hints):
+
+        if model._meta.app_label in self.route_app_labels:
+            return session_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+
+        if model._meta.app_label in self.route_app_labels:
+            return session_alias()
+        return None
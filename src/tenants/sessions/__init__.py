@@ -0,0 +1,77 @@
+"""
+Session engines that store the sessions of each tenant apart, so the
+requests of the stores don't read and write the default database.
+
+* ``tenants.sessions.db``: in the tenant's database.
+* ``tenants.sessions.cached_db``: in the tenant's database, written
+  through to the cache ``SESSION_CACHE_ALIAS``. The cache must be shared
+  by the processes (``MWS_CACHE_LOCATION``), or a process could read a
+  session that another one has changed or deleted.
+* ``tenants.sessions.signed_cookies``: in a cookie signed for the tenant.
+
+The sessions of the platform's own pages are stored in the default
+database. Sessions started when every session was stored in the default
+database are moved to the tenant the first time they are used, while
+``TENANT_SESSIONS_FALLBACK`` is set, so their users stay logged in.
+"""
+
+import logging
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from tenants.connections import get_tenant_alias, is_tenant
+from tenants.middlewares import get_current_db_name
+
+logger = logging.getLogger(__name__)
+
+
+def session_alias():
+    """
+    Return the alias of the database where the sessions of the current
+    request are stored: the tenant's one, or the default database if the
+    request isn't for a tenant.
+    """
+
+    subdomain = get_current_db_name()
+
+    if not is_tenant(subdomain):
+        return DEFAULT_DB_ALIAS
+
+    return get_tenant_alias(subdomain)
+
+
+def get_central_session(session_key):
+    """
+    Return a session of the current tenant that is still stored in the
+    default database.
+
+    :return: The session or None if there isn't such session, the
+    request isn't for a tenant or the fallback is disabled.
+    :rtype: django.contrib.sessions.models.Session or None
+    """
+
+    from django.contrib.sessions.models import Session
+
+    if (
+        not settings.TENANT_SESSIONS_FALLBACK
+        or not session_key
+        or session_alias() == DEFAULT_DB_ALIAS
+    ):
+        return None
+
+    return (
+        Session.objects.using(DEFAULT_DB_ALIAS)
+        .filter(session_key=session_key, expire_date__gt=timezone.now())
+        .first()
+    )
+
+
+def delete_central_session(session_key):
+    """Delete a session from the default database once it's moved."""
+
+    from django.contrib.sessions.models import Session
+
+    Session.objects.using(DEFAULT_DB_ALIAS).filter(session_key=session_key).delete()
+    logger.info(f"Moved a session of {get_current_db_name()} from the default database")
@@ -0,0 +1,18 @@
+from django.contrib.sessions.backends.cached_db import (
+    SessionStore as CachedDBStore,
+    KEY_PREFIX,
+)
+
+from tenants.middlewares import get_current_db_name
+from tenants.sessions.db import SessionStore as DBStore
+
+
+class SessionStore(CachedDBStore, DBStore):
+    """
+    Sessions stored in the tenant's database and written through to the
+    cache, under keys of the tenant.
+    """
+
+    @property
+    def cache_key_prefix(self):
+        return f"{KEY_PREFIX}:{get_current_db_name()}:"
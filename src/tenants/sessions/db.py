@@ -0,0 +1,68 @@
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.db import IntegrityError, router, transaction
+
+from tenants.middlewares import using_tenant
+from tenants.sessions import get_central_session, delete_central_session
+
+
+class SessionStore(DBStore):
+    """
+    Sessions stored in the tenant's database. The database is chosen by
+    tenants.router.TenantSessionRouter.
+    """
+
+    def _get_session_from_db(self):
+        session_key = self.session_key
+        session = super()._get_session_from_db()
+
+        if session is None:
+            session = self.move_central_session(session_key)
+
+        return session
+
+    async def _aget_session_from_db(self):
+        return await sync_to_async(self._get_session_from_db)()
+
+    def move_central_session(self, session_key):
+        """
+        Move the session from the default database to the tenant's one.
+
+        :return: The moved session or None if it isn't in the default
+        database.
+        """
+
+        session = get_central_session(session_key)
+
+        if session is None:
+            return None
+
+        using = router.db_for_write(self.model, instance=session)
+
+        try:
+            with transaction.atomic(using=using):
+                session.save(using=using, force_insert=True)
+        except IntegrityError:
+            # Moved by a concurrent request
+            pass
+
+        delete_central_session(session_key)
+        self._session_key = session_key
+        return session
+
+    @classmethod
+    def clear_expired(cls):
+        """Remove the expired sessions of the platform and every tenant."""
+
+        super().clear_expired()
+
+        Tenant = apps.get_model("tenants", "Tenant")
+
+        for subdomain in Tenant.objects.values_list("subdomain_prefix", flat=True):
+            with using_tenant(subdomain):
+                super().clear_expired()
+
+    @classmethod
+    async def aclear_expired(cls):
+        await sync_to_async(cls.clear_expired)()
@@ -0,0 +1,50 @@
+from django.contrib.sessions.backends.signed_cookies import (
+    SessionStore as SignedCookiesStore,
+)
+from django.core import signing
+
+from tenants.middlewares import get_current_db_name
+from tenants.sessions import get_central_session, delete_central_session
+
+
+class SessionStore(SignedCookiesStore):
+    """
+    Sessions stored in cookies signed for the tenant, so a cookie of a
+    store isn't valid in the others.
+    """
+
+    @property
+    def signing_salt(self):
+        return f"tenants.sessions.signed_cookies:{get_current_db_name()}"
+
+    def load(self):
+
+        try:
+            return signing.loads(
+                self.session_key,
+                serializer=self.serializer,
+                max_age=self.get_session_cookie_age(),
+                salt=self.signing_salt,
+            )
+        except Exception:
+            pass
+
+        # The cookie may be the key of a session stored in the default
+        # database.
+        session = get_central_session(self.session_key)
+
+        if session is not None:
+            delete_central_session(self.session_key)
+            self.modified = True
+            return self.decode(session.session_data)
+
+        self.create()
+        return {}
+
+    def _get_session_key(self):
+        return signing.dumps(
+            self._session,
+            compress=True,
+            salt=self.signing_salt,
+            serializer=self.serializer,
+        )
@@ -0,0 +1,23 @@
+from django.conf import settings
+
+import tenants.jobs as jobs
+import tenants.models as tmodels
+
+
+def registration_failed(job, error):
+    tmodels.TenantRegistration.objects.filter(pk=job.args[0]).update(
+        status=tmodels.TenantRegistration.FAILED,
+        error=str(error),
+    )
+
+
+@jobs.task(
+    name="tenants.register_tenant",
+    max_attempts=settings.TENANT_REGISTRATION_MAX_ATTEMPTS,
+    on_failure=registration_failed,
+)
+def register_tenant(registration_id):
+    registration = tmodels.TenantRegistration.objects.get(pk=registration_id)
+
+    if not registration.finished:
+        tmodels.process_registration(registration)
@@ -1,3 +1,666 @@
-from django.test import TestCase
+import asyncio
+import subprocess
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import DatabaseError, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils import timezone
+
+import tenants.backends.postgresql.base as tenant_backend
+import tenants.bus as bus
+import tenants.db_management as db
+import tenants.exceptions as exceptions
+import tenants.jobs as jobs
+import tenants.models as tmodels
+
+from tenants.connections import (
+    TenantDatabases,
+    get_tenant_databases,
+    tenant_db_settings,
+)
+from tenants.middlewares import (
+    PIN_COOKIE,
+    READ_FROM_REPLICA,
+    TenantMiddleware,
+    get_current_db_name,
+    using_tenant,
+)
+from tenants.models import DatabaseHost, Job
+import tenants.placement as placement
+from tenants.placement import least_loaded
+import tenants.replicas as replicas
+import tenants.sessions as tenant_sessions
+from tenants.sessions.signed_cookies import SessionStore as SignedCookiesStore
+from tenants.pools import ConnectionLimiter
+
+
+class TenantDatabasesTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = TenantDatabases(
+            {"default": {"NAME": "mwsdb"}},
+            max_tenants=2,
+            lookup_ttl=60,
+        )
+
+    def register(self, alias):
+        self.registry.register(
+            alias,
+            tenant_db_settings(f"mws_{alias}_db", "user", "", "", ""),
+        )
+
+    def test_least_recently_used_is_evicted(self):
+        """Test that the oldest tenant is removed beyond the limit."""
+        self.register("tenant1")
+        self.register("tenant2")
+        self.registry.touch("tenant1")
+        self.register("tenant3")
+
+        self.assertTrue(self.registry.is_registered("tenant1"))
+        self.assertFalse(self.registry.is_registered("tenant2"))
+        self.assertTrue(self.registry.is_registered("tenant3"))
+
+    def test_default_is_never_evicted(self):
+        """Test that the aliases in DATABASES are kept."""
+        for alias in ["tenant1", "tenant2", "tenant3"]:
+            self.register(alias)
+
+        self.assertTrue(self.registry.is_registered("default"))
+        self.assertRaises(ValueError, self.registry.evict, "default")
+
+    def test_registered_alias_isnt_looked_up(self):
+        """Test that registered tenants don't query the default database."""
+        self.register("tenant1")
+        self.assertTrue(self.registry.ensure("tenant1"))
+        self.assertEqual(self.registry["tenant1"]["NAME"], "mws_tenant1_db")
+
+
+class ConnectionLimiterTestCase(SimpleTestCase):
+
+    def test_limit_is_enforced(self):
+        """Test that no more connections than the limit are handed out."""
+        limiter = ConnectionLimiter(2)
+        deadline = time.monotonic() + 0.01
+
+        self.assertTrue(limiter.acquire(deadline))
+        self.assertTrue(limiter.acquire(deadline))
+        self.assertFalse(limiter.acquire(deadline))
+        self.assertEqual(limiter.timeouts, 1)
+
+        limiter.release()
+        self.assertTrue(limiter.acquire(time.monotonic() + 0.01))
+        self.assertEqual(limiter.in_use, 2)
+
+
+class TenantContextTestCase(SimpleTestCase):
+
+    def test_using_tenant_restores_previous(self):
+        """Test that nested tenant blocks restore the outer tenant."""
+        with using_tenant("tenant1"):
+            with using_tenant("tenant2"):
+                self.assertEqual(get_current_db_name(), "tenant2")
+            self.assertEqual(get_current_db_name(), "tenant1")
+
+        self.assertIsNone(get_current_db_name())
+
+    def test_concurrent_tasks_dont_share_tenant(self):
+        """Test that each asyncio task sees its own tenant."""
+
+        async def view(subdomain):
+            with using_tenant(subdomain):
+                await asyncio.sleep(0.01)
+                return get_current_db_name()
+
+        async def serve():
+            return await asyncio.gather(view("tenant1"), view("tenant2"))
+
+        self.assertEqual(asyncio.run(serve()), ["tenant1", "tenant2"])
+
+
+class JobTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tenants = []
+
+        def record_tenant(fail):
+            self.tenants.append(get_current_db_name())
+            if fail:
+                raise ValueError("failed")
+
+        self.task = jobs.task(name="tests.record_tenant", max_attempts=2)(record_tenant)
+        self.addCleanup(jobs.TASKS.pop, "tests.record_tenant")
+
+    def run_job(self, job):
+        with mock.patch.object(Job, "save"), mock.patch.object(Job, "delete") as delete:
+            finished = jobs.run_job(job)
+        return finished, delete.called
+
+    def test_job_runs_in_its_tenant(self):
+        """Test that a job is run with its tenant's database routed."""
+        job = Job(task="tests.record_tenant", args=[False], tenant="tenant1", attempts=1)
+
+        self.assertEqual(self.run_job(job), (True, True))
+        self.assertEqual(self.tenants, ["tenant1"])
+        self.assertIsNone(get_current_db_name())
+
+    def test_failed_job_is_retried_then_given_up(self):
+        """Test that a failed job is scheduled again until its last attempt."""
+        job = Job(task="tests.record_tenant", args=[True], attempts=1)
+        before = timezone.now()
+
+        self.assertEqual(self.run_job(job), (False, False))
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertGreater(job.run_after, before)
+
+        job.attempts = 2
+        self.run_job(job)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("ValueError", job.error)
+
+    @override_settings(JOBS_HEARTBEAT_INTERVAL=0.01)
+    def test_running_job_is_kept_updated(self):
+        """Test that a job is updated while it runs, and not after."""
+        job = Job(pk=1, task="tests.record_tenant", worker="host:1")
+
+        with mock.patch.object(Job.objects, "filter") as filter_jobs:
+            with jobs.heartbeat(job):
+                time.sleep(0.1)
+
+            updates = filter_jobs.return_value.update.call_count
+            time.sleep(0.05)
+
+        self.assertGreater(updates, 0)
+        self.assertEqual(filter_jobs.return_value.update.call_count, updates)
+        filter_jobs.assert_called_with(pk=1, status=Job.RUNNING, worker="host:1")
+
+    def test_worker_survives_database_errors(self):
+        """Test that a failed claim or save doesn't stop the worker."""
+        job = Job(task="tests.record_tenant", args=[False], attempts=1)
+
+        with mock.patch.object(jobs.bus, "start_listener"), \
+                mock.patch.object(jobs, "close_old_connections"), \
+                mock.patch.object(jobs, "get_tenant_databases"), \
+                mock.patch.object(jobs.time, "sleep"), \
+                mock.patch.object(jobs.logger, "exception"), \
+                mock.patch.object(Job, "delete", side_effect=DatabaseError), \
+                mock.patch.object(
+                    jobs, "claim_job", side_effect=[DatabaseError, job, None],
+                ) as claim_job:
+            jobs.work(once=True)
+
+        self.assertEqual(claim_job.call_count, 3)
+        self.assertEqual(self.tenants, [None])
+
+
+class PlacementTestCase(SimpleTestCase):
+
+    def test_least_loaded_honours_weights(self):
+        """Test that hosts with more capacity get more tenants."""
+        small = DatabaseHost(name="small", host="db1", port="5432", weight=1)
+        big = DatabaseHost(name="big", host="db2", port="5432", weight=4)
+
+        loads = {("db1", "5432"): 2, ("db2", "5432"): 4}
+        self.assertEqual(least_loaded([small, big], loads), big)
+
+        loads[("db2", "5432")] = 12
+        self.assertEqual(least_loaded([small, big], loads), small)
+
+    def test_least_loaded_ties_and_empty_hosts(self):
+        """Test that a host without tenants is chosen, and ties by name."""
+        first = DatabaseHost(name="a", host="db1", port=5432, weight=1)
+        second = DatabaseHost(name="b", host="db2", port=5432, weight=1)
+
+        self.assertEqual(least_loaded([second, first], {}), first)
+        self.assertEqual(least_loaded([first, second], {("db1", "5432"): 1}), second)
+
+    def test_round_robin_counts_assignments(self):
+        """Test that the host with the fewest assignments for its weight is taken."""
+        small = DatabaseHost(pk=1, name="small", host="db1", port="5432", weight=1, n_assigned=1)
+        big = DatabaseHost(pk=2, name="big", host="db2", port="5432", weight=4, n_assigned=8)
+
+        with mock.patch.object(placement.transaction, "atomic"), \
+                mock.patch.object(DatabaseHost, "save") as save, \
+                mock.patch.object(DatabaseHost, "refresh_from_db"), \
+                mock.patch.object(DatabaseHost.objects, "select_for_update") as select:
+            select.return_value.filter.return_value.order_by.return_value = [small, big]
+            self.assertEqual(placement.round_robin([small, big]), small)
+
+        save.assert_called_once_with(update_fields=["n_assigned"])
+
+    @override_settings(TENANT_PLACEMENT_POLICY="random")
+    def test_unknown_policy(self):
+        """Test that an unknown policy is rejected."""
+        with self.assertRaises(exceptions.PlacementError):
+            placement.place_tenant()
+
+    def test_default_server_without_hosts(self):
+        """Test that the tenants are placed in the default server without hosts."""
+        default = placement.settings.DATABASES["default"]
+
+        with mock.patch.object(DatabaseHost.objects, "filter") as filter_hosts:
+            filter_hosts.return_value.order_by.return_value = []
+            server = placement.place_tenant()
+
+        self.assertIsNone(server.pk)
+        self.assertEqual((server.host, server.port), (default["HOST"], default["PORT"]))
+
+    def test_policy_dispatch(self):
+        """Test that each policy chooses among the hosts as configured."""
+        servers = [
+            DatabaseHost(pk=1, name="a", host="db1", port="5432", weight=1),
+            DatabaseHost(pk=2, name="b", host="db2", port="5432", weight=1),
+        ]
+
+        with mock.patch.object(placement, "get_servers", return_value=servers), \
+                mock.patch.object(placement, "round_robin") as round_robin, \
+                mock.patch.object(
+                    placement, "count_tenants", return_value={("db1", "5432"): 3},
+                ):
+
+            with override_settings(TENANT_PLACEMENT_POLICY=placement.LEAST_LOADED):
+                self.assertEqual(placement.place_tenant(), servers[1])
+
+            with override_settings(TENANT_PLACEMENT_POLICY=placement.ROUND_ROBIN):
+                self.assertEqual(placement.place_tenant(), round_robin.return_value)
+                round_robin.assert_called_once_with(servers)
+
+            with override_settings(TENANT_PLACEMENT_POLICY=placement.EXPLICIT):
+                self.assertIsNone(placement.place_tenant().pk)
+
+        with mock.patch.object(placement, "get_server") as get_server:
+            self.assertEqual(placement.place_tenant("a"), get_server.return_value)
+            get_server.assert_called_once_with("a")
+
+
+@override_settings(TENANT_STORAGE="schema")
+class SchemaStorageTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.shared_settings = {
+            **connections.settings["default"],
+            "ENGINE": "tenants.backends.postgresql",
+            "HOST": "localhost",
+            "PORT": "5432",
+            "USER": "user",
+            "PASSWORD": "password",
+        }
+        self.wrapper = tenant_backend.DatabaseWrapper(
+            self.shared_settings,
+            alias=tenant_backend.settings.TENANT_SCHEMAS_ALIAS,
+        )
+        self.wrapper.connection = mock.MagicMock()
+        self.cursor = self.wrapper.connection.cursor.return_value.__enter__.return_value
+
+        patcher = mock.patch.object(tenant_backend, "get_tenant_databases")
+        self.schema = patcher.start().return_value.schema
+        self.schema.side_effect = {"tenant1": "mws_tenant1"}.get
+        self.addCleanup(patcher.stop)
+
+    def search_paths(self):
+        return [call.args[0] for call in self.cursor.execute.call_args_list]
+
+    def test_search_path_of_current_tenant(self):
+        """Test that the search_path is set to the tenant's schema once."""
+
+        with using_tenant("tenant1"):
+            self.wrapper.set_tenant_schema()
+            self.wrapper.set_tenant_schema()
+
+        self.assertEqual(self.search_paths(), [
+            tenant_backend.sql.SQL("SET search_path TO {}").format(
+                tenant_backend.sql.Identifier("mws_tenant1")
+            ),
+        ])
+
+        # A rollback undoes the SET
+        self.wrapper.tenant_schema = None
+
+        with using_tenant("tenant1"):
+            self.wrapper.set_tenant_schema()
+
+        self.assertEqual(len(self.search_paths()), 2)
+
+    def test_public_schema_without_tenant(self):
+        """Test that the shared database can be used without a tenant."""
+        self.wrapper.set_tenant_schema()
+        self.assertEqual(self.wrapper.tenant_schema, tenant_backend.PUBLIC_SCHEMA)
+
+    def test_unknown_tenant(self):
+        """Test that the schema of a tenant that doesn't exist isn't used."""
+
+        with using_tenant("tenant2"), self.assertRaises(exceptions.TenantNotFoundError):
+            self.wrapper.set_tenant_schema()
+
+        self.cursor.execute.assert_not_called()
+
+    def test_schema_is_provisioned(self):
+        """Test that a new schema is created and migrated as its tenant."""
+        migrated = []
+
+        with mock.patch.dict(db.settings.DATABASES, {
+                    db.settings.TENANT_SCHEMAS_ALIAS: self.shared_settings,
+                }), \
+                mock.patch.object(db.psycopg, "connect") as connect, \
+                mock.patch.object(db, "get_tenant_databases") as get_tenant_databases, \
+                mock.patch.object(
+                    db,
+                    "migrate_new_db",
+                    side_effect=lambda *args: migrated.append(get_current_db_name()),
+                ) as migrate_new_db, \
+                mock.patch.object(db, "load_permissions"):
+            record = db.provision_schema("mws_tenant1", "tenant1")
+
+        cursor = connect.return_value.cursor.return_value.__enter__.return_value
+        cursor.execute.assert_called_once_with(
+            db.sql.SQL("CREATE SCHEMA {}").format(db.sql.Identifier("mws_tenant1"))
+        )
+        self.assertEqual(record["db_name"], "mws_tenant1")
+        get_tenant_databases.return_value.remember.assert_called_once_with("tenant1", record)
+        migrate_new_db.assert_called_once_with(
+            "mws_tenant1", db.settings.TENANT_SCHEMAS_ALIAS,
+        )
+        self.assertEqual(migrated, ["tenant1"])
+
+
+class ReadOnlyTenantTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.middleware = TenantMiddleware(lambda request: HttpResponse("ok"))
+        self.factory = RequestFactory(HTTP_HOST="tenant1.mws.local")
+
+    @mock.patch.object(TenantDatabases, "ensure", return_value=True)
+    @mock.patch.object(TenantDatabases, "is_read_only", return_value=True)
+    def test_writes_are_rejected_while_moved(self, is_read_only, ensure):
+        """Test that only safe requests reach a read-only tenant."""
+        self.assertEqual(self.middleware(self.factory.get("/store/")).status_code, 200)
+
+        response = self.middleware(self.factory.post("/store/"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "60")
+
+    def test_read_only_record_is_looked_up_again(self):
+        """Test that a tenant is writable as soon as its move finishes."""
+        registry = TenantDatabases({}, max_tenants=2, lookup_ttl=60)
+        registry.remember("tenant1", {"read_only": True})
+
+        with mock.patch(
+            "tenants.connections.lookup_tenant_record",
+            return_value={"read_only": False},
+        ):
+            self.assertFalse(registry.is_read_only("tenant1"))
+
+
+class MoveTenantTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tenant = tmodels.Tenant(
+            pk=1,
+            subdomain_prefix="tenant1",
+            db_name="mws_tenant1_db",
+            db_user="user",
+            db_password="password",
+            db_host="db1",
+            db_port="5432",
+        )
+        self.target = DatabaseHost(
+            name="second", host="db2", port="5432", user="user", password="password",
+        )
+        self.source = DatabaseHost(name="first", host="db1", port="5432")
+
+        for target, attribute, kwargs in (
+                (DatabaseHost, "connect", {}),
+                (db.placement, "find_server", {"return_value": self.source}),
+                (db, "set_database_read_only", {}),
+                (db, "close_database", {}),
+                (db.bus, "publish", {}),
+                (tmodels.Tenant.objects, "filter", {}),
+                (db.subprocess, "Popen", {}),
+                (db.subprocess, "run", {}),
+        ):
+            patcher = mock.patch.object(target, attribute, **kwargs)
+            setattr(self, attribute, patcher.start())
+            self.addCleanup(patcher.stop)
+
+        self.Popen.return_value.returncode = 0
+
+    def updates(self):
+        return [call.kwargs for call in self.filter.return_value.update.call_args_list]
+
+    def test_failed_copy_is_rolled_back(self):
+        """Test that a tenant is writable again and not moved if the copy fails."""
+        self.run.return_value = subprocess.CompletedProcess([], 1, stderr=b"failed")
+
+        with self.assertRaisesMessage(exceptions.TenantRelocationError, "failed"):
+            db.move_tenant(self.tenant, self.target)
+
+        self.assertEqual(self.updates(), [{"read_only": True}, {"read_only": False}])
+        self.assertEqual(self.set_database_read_only.call_args_list, [
+            mock.call(self.source, "mws_tenant1_db", True),
+            mock.call(self.source, "mws_tenant1_db", False),
+        ])
+        self.close_database.assert_called_once_with(self.target, "mws_tenant1_db", drop=True)
+
+    def test_tenant_is_moved(self):
+        """Test that a copied tenant is pointed to the new host and writable."""
+        self.run.return_value = subprocess.CompletedProcess([], 0, stderr=b"")
+
+        record = db.move_tenant(self.tenant, self.target, drop_source=True)
+
+        self.assertEqual(record["db_host"], "db2")
+        self.assertEqual(self.updates()[-1], {
+            "read_only": False,
+            "replica_host": "",
+            "replica_port": "",
+            **record,
+        })
+        self.close_database.assert_called_once_with(self.source, "mws_tenant1_db", drop=True)
+
+    def test_command_drops_source(self):
+        """Test that the old database is only dropped with --drop-source."""
+
+        with mock.patch.object(tmodels.Tenant.objects, "get", return_value=self.tenant), \
+                mock.patch.object(db.placement, "get_server", return_value=self.target), \
+                mock.patch.object(db, "move_tenant") as move_tenant:
+            call_command("move_tenant", "tenant1", "second", stdout=mock.Mock())
+            call_command("move_tenant", "tenant1", "second", "--drop-source", stdout=mock.Mock())
+
+        self.assertEqual(
+            [call.kwargs["drop_source"] for call in move_tenant.call_args_list],
+            [False, True],
+        )
+
+
+@mock.patch.object(TenantDatabases, "replica_alias", return_value="tenant1__replica")
+class ReplicaRoutingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        replicas._lags.clear()
+        self.token = READ_FROM_REPLICA.set(True)
+        self.addCleanup(READ_FROM_REPLICA.reset, self.token)
+
+    def test_fresh_replica_is_read(self, replica_alias):
+        """Test that the reads go to a replica that is up to date."""
+        with mock.patch.object(replicas, "replica_lag", return_value=0.5):
+            self.assertEqual(replicas.read_alias("tenant1", "tenant1"), "tenant1__replica")
+
+    def test_lagging_replica_falls_back_to_primary(self, replica_alias):
+        """Test that the reads go to the primary if the replica lags."""
+        with mock.patch.object(replicas, "replica_lag", return_value=60):
+            self.assertEqual(replicas.read_alias("tenant1", "tenant1"), "tenant1")
+
+        READ_FROM_REPLICA.set(False)
+        self.assertEqual(replicas.read_alias("tenant1", "tenant1"), "tenant1")
+
+    @mock.patch.object(TenantDatabases, "ensure", return_value=True)
+    @mock.patch.object(TenantDatabases, "is_read_only", return_value=False)
+    def test_writes_pin_client_to_primary(self, is_read_only, ensure, replica_alias):
+        """Test that the reads after a write don't go to the replica."""
+        reads = []
+        middleware = TenantMiddleware(
+            lambda request: reads.append(READ_FROM_REPLICA.get()) or HttpResponse()
+        )
+        factory = RequestFactory(HTTP_HOST="tenant1.mws.local")
+
+        response = middleware(factory.post("/store/"))
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        pinned = factory.get("/store/")
+        pinned.COOKIES[PIN_COOKIE] = "1"
+        middleware(pinned)
+        middleware(factory.get("/store/"))
+
+        self.assertEqual(reads, [False, False, True])
+
+
+class RegisterTenantTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.db_record = {
+            "db_name": "mws_spare_1",
+            "db_user": "user",
+            "db_password": "password",
+            "db_host": "localhost",
+            "db_port": 5432,
+        }
+
+        for target, attribute in (
+                (tmodels.transaction, "atomic"),
+                (tmodels.db, "release_spare_db"),
+                (tmodels.db, "revert_tenant_storage"),
+                (tmodels.SpareDatabase.objects, "filter"),
+        ):
+            patcher = mock.patch.object(target, attribute)
+            setattr(self, attribute, patcher.start())
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(
+            tmodels.Tenant.objects,
+            "create",
+            side_effect=DatabaseError("failed"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_spare_database_is_returned(self):
+        """Test that a failed registration doesn't drop a spare database."""
+        spare = mock.Mock(pk=1)
+
+        with mock.patch.object(tmodels.db, "create_db", return_value=(self.db_record, spare)):
+            with self.assertRaises(exceptions.TenantRegistrationError):
+                tmodels.register_tenant("Tenant", "tenant1", "admin@tenant1.test")
+
+        self.release_spare_db.assert_called_once_with("tenant1")
+        self.revert_tenant_storage.assert_not_called()
+        self.filter.assert_not_called()
+
+    def test_created_database_is_dropped(self):
+        """Test that a failed registration drops the database created for it."""
+
+        with mock.patch.object(tmodels.db, "create_db", return_value=(self.db_record, None)):
+            with self.assertRaises(exceptions.TenantRegistrationError):
+                tmodels.register_tenant("Tenant", "tenant1", "admin@tenant1.test")
+
+        self.revert_tenant_storage.assert_called_once_with("tenant1", self.db_record)
+        self.release_spare_db.assert_not_called()
+
+
+class ProcessRegistrationTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.registration = tmodels.TenantRegistration(
+            name="Tenant",
+            subdomain_prefix="tenant1",
+            email="admin@tenant1.test",
+        )
+
+        for target, attribute in (
+                (tmodels.TenantRegistration, "save"),
+                (tmodels, "register_tenant"),
+        ):
+            patcher = mock.patch.object(target, attribute)
+            setattr(self, attribute, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_taken_subdomain_fails(self):
+        """Test that a tenant of other registration isn't taken as this one's."""
+
+        with mock.patch.object(tmodels.Tenant.objects, "filter") as tenants:
+            tenants.return_value.exists.return_value = True
+            tmodels.process_registration(self.registration)
+
+        self.register_tenant.assert_not_called()
+        self.assertEqual(self.registration.status, tmodels.TenantRegistration.FAILED)
+        self.assertIsNone(self.registration.tenant)
+
+    def test_tenant_is_registered_once(self):
+        """Test that a retried registration keeps the tenant it created."""
+        tenant = tmodels.Tenant(subdomain_prefix="tenant1")
+        self.registration.tenant = tenant
+
+        tmodels.process_registration(self.registration)
+
+        self.register_tenant.assert_not_called()
+        self.assertEqual(self.registration.status, tmodels.TenantRegistration.DONE)
+        self.assertIs(self.registration.tenant, tenant)
+
+
+class InvalidationBusTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.keys = []
+        self.resets = 0
+
+        def reset():
+            self.resets += 1
+
+        bus.subscribe("test", self.keys.append, reset)
+        self.addCleanup(bus._subscribers.pop, "test")
+
+    def test_messages_of_other_processes_are_dispatched(self):
+        """Test that only the changes made by other processes are handled."""
+        listener = bus.InvalidationListener()
+        listener.handle('{"kind": "test", "key": "tenant1", "origin": "other:1"}')
+        listener.handle(
+            f'{{"kind": "test", "key": "tenant2", "origin": "{listener.origin}"}}'
+        )
+        self.assertEqual(self.keys, ["tenant1"])
+
+    def test_reset_after_missed_messages(self):
+        """Test that the caches are dropped when changes may have been missed."""
+        bus.reset_all()
+        self.assertEqual(self.resets, 1)
+
+
+class TenantSessionsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            get_tenant_databases(),
+            "lookup",
+            side_effect=lambda subdomain: {} if subdomain != "mws" else None,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_session_alias(self):
+        """Test that only the platform's sessions use the default database."""
+        with using_tenant("tenant1"):
+            self.assertEqual(tenant_sessions.session_alias(), "tenant1")
+
+        with using_tenant("mws"):
+            self.assertEqual(tenant_sessions.session_alias(), "default")
+
+    @override_settings(TENANT_SESSIONS_FALLBACK=False)
+    def test_signed_cookie_is_bound_to_tenant(self):
+        """Test that a session cookie of a store isn't valid in others."""
+        with using_tenant("tenant1"):
+            session = SignedCookiesStore()
+            session["user"] = 1
+            session.save()
+            self.assertEqual(SignedCookiesStore(session.session_key)["user"], 1)
+
+        with using_tenant("tenant2"):
+            self.assertNotIn("user", SignedCookiesStore(session.session_key))
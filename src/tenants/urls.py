@@ -9,8 +9,24 @@ urlpatterns = [
     path("register/",
          views.RegistrationView.as_view(),
          name="registration"),
+
+    path("register/<uuid:key>/",
+         views.RegistrationStatusView.as_view(),
+         name="registration_status"),
+
+    path("register/<uuid:key>/status/",
+         views.RegistrationStatusJSONView.as_view(),
+         name="registration_status_json"),
  
     path("plans/",
          views.PlansView.as_view(),
          name="view_plans"),
+
+    path("pool-stats/",
+         views.PoolStatsView.as_view(),
+         name="pool_stats"),
+
+    path("metrics/",
+         views.MetricsView.as_view(),
+         name="metrics"),
 ]
@@ -1,13 +1,19 @@
-from django.shortcuts import render
+import uuid
+
+from django.conf import settings
+from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, Http404
+from django.views import View
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import (
     UserPassesTestMixin,
     LoginRequiredMixin,
 )
-from django.contrib import messages
-from tenants import forms, models
+from tenants import forms, models, pools, exceptions
+from tenants.connections import is_tenant
+from tenants.utils import subdomain_from_request
+import mws_main.metrics as metrics
 
 
 class HomeView(TemplateView):
@@ -22,25 +28,37 @@ class HomeView(TemplateView):
 
 
 class RegistrationView(TemplateView):
+    """
+    Registration form of a new tenant.
+
+    The registration is processed in the background and the user is
+    redirected to a page that shows its status.
+    """
 
     template_name = "tenants/registration.html"
     tenant_form_class = forms.TenantForm
-    #success_url = reverse("tenants:completed")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["tenant_form"] = self.tenant_form_class()
+        context["registration_key"] = uuid.uuid4()
         context["reg_error"] = None
         return context
     
     def post(self, request, *args, **kwargs):
 
         tenant_form = self.tenant_form_class(request.POST)
+
+        try:
+            key = uuid.UUID(request.POST.get("registration_key", ""))
+        except ValueError:
+            key = uuid.uuid4()
         
         if tenant_form.is_valid():
 
             try:
-                tenant = models.register_tenant(
+                registration = models.request_registration(
+                    key,
                     tenant_form.cleaned_data['name'],
                     tenant_form.cleaned_data['subdomain_prefix'],
                     tenant_form.cleaned_data['email'],
@@ -52,27 +70,97 @@ class RegistrationView(TemplateView):
                     self.template_name,
                     {
                         "tenant_form": tenant_form,
+                        "registration_key": key,
                         "reg_error": str(error),
                     },
                 )
-            
-            store_url = f"http://{tenant.subdomain_prefix}.mws.local:8000/store/"
-            messages.success(
-                request,
-                'You can acces now your'
-                f' store at <a href="{store_url}">{store_url}</a>.'
+
+            return HttpResponseRedirect(
+                reverse("tenants:registration_status", args=[registration.key])
             )
-            return HttpResponseRedirect("/")
         
         return render(
             request,
             self.template_name,
             {
                 "tenant_form": tenant_form,
+                "registration_key": key,
             },
             status=422,
         )
 
 
+class RegistrationStatusView(TemplateView):
+    """
+    Progress of a registration. The page polls the status until the
+    registration finishes.
+    """
+
+    template_name = "tenants/registration_status.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["registration"] = get_object_or_404(
+            models.TenantRegistration,
+            key=kwargs["key"],
+        )
+        return context
+
+
+class RegistrationStatusJSONView(View):
+
+    def get(self, request, *args, **kwargs):
+
+        registration = get_object_or_404(
+            models.TenantRegistration,
+            key=kwargs["key"],
+        )
+        data = {
+            "status": registration.status,
+            "finished": registration.finished,
+            "store_url": None,
+        }
+
+        if registration.status == registration.DONE and registration.tenant:
+            data["store_url"] = registration.tenant.store_url
+
+        return JsonResponse(data)
+
+
 class PlansView(TemplateView):
     template_name = "tenants/view_plans.html"
+
+
+class PoolStatsView(View):
+    """
+    Statistics of the tenants' connection pools of the process that
+    serves the request. Only available from the internal IPs.
+    """
+
+    def get(self, request, *args, **kwargs):
+
+        if request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS:
+            raise Http404()
+
+        return JsonResponse(pools.pool_stats())
+
+
+class MetricsView(View):
+    """
+    Metrics of the requests served by every process, in the Prometheus
+    text format. Only available in the platform's domain and from the
+    internal IPs.
+    """
+
+    def get(self, request, *args, **kwargs):
+
+        if (
+            request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS
+            or is_tenant(subdomain_from_request(request))
+        ):
+            raise Http404()
+
+        return HttpResponse(
+            metrics.render(metrics.collect()),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )